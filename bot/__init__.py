@@ -0,0 +1 @@
+# Bot package for Telegram YouTube Bot
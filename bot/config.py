@@ -0,0 +1,46 @@
+"""
+Bot Configuration for Telegram YouTube Downloader Bot
+Features: Environment parsing in one place, immutable slotted settings
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Mapping, Optional
+
+
+def _env_bool(env: Mapping[str, str], name: str, default: str = 'true') -> bool:
+    return env.get(name, default).lower() == 'true'
+
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Runtime settings parsed once from the environment"""
+    bot_token: str
+    admin_id: int
+    max_concurrent_downloads: int
+    rate_limit_requests: int
+    rate_limit_period: int
+    enable_analytics: bool
+    enable_security: bool
+    http_connection_limit: int
+    info_worker_processes: int
+    log_level: str
+    redis_url: str
+
+    @classmethod
+    def from_env(cls, env: Optional[Mapping[str, str]] = None) -> 'Config':
+        """Build the configuration from environment variables"""
+        env = os.environ if env is None else env
+        return cls(
+            bot_token=env.get('BOT_TOKEN', ''),
+            admin_id=int(env.get('ADMIN_ID', '7352192536')),
+            max_concurrent_downloads=int(env.get('MAX_CONCURRENT_DOWNLOADS', '5')),
+            rate_limit_requests=int(env.get('RATE_LIMIT_REQUESTS', '30')),
+            rate_limit_period=int(env.get('RATE_LIMIT_PERIOD', '60')),
+            enable_analytics=_env_bool(env, 'ENABLE_ANALYTICS'),
+            enable_security=_env_bool(env, 'ENABLE_SECURITY'),
+            http_connection_limit=int(env.get('HTTP_CONNECTION_LIMIT', '100')),
+            info_worker_processes=int(env.get('INFO_WORKER_PROCESSES', '0')),
+            log_level=env.get('LOG_LEVEL', 'INFO').upper(),
+            redis_url=env.get('REDIS_URL', '')
+        )
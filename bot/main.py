@@ -7,233 +7,591 @@ enterprise security, comprehensive admin panel, performance monitoring
 
 import asyncio
 import logging
+import logging.handlers
+import atexit
+import queue
 import os
 import sys
 import time
-import json
+import re
+import hashlib
+import html
+import array
+import contextvars
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Union, Any
-from functools import wraps
-import aiohttp
-from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Union, Any, Final, Tuple
+from functools import wraps, lru_cache
+from contextlib import AsyncExitStack, asynccontextmanager, suppress
 
-from aiogram import Bot, Dispatcher, Router, F
+from aiogram import Bot, Dispatcher, Router, F, BaseMiddleware
 from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode, ChatAction
-from aiogram.filters import CommandStart, Command, StateFilter
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.enums import ParseMode, ChatAction, ChatType
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+)
+from aiogram.filters import CommandStart, Command, Filter, StateFilter
 from aiogram.types import (
     Message, CallbackQuery, InlineKeyboardMarkup, 
-    InlineKeyboardButton, ReactionTypeEmoji, BotCommand,
-    InputFile, BufferedInputFile
+    InlineKeyboardButton, ReactionTypeEmoji, BotCommand, TelegramObject
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from dotenv import load_dotenv
-import asyncio_throttle
 
-# Import our professional modules
-sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+try:
+    import uvloop
+except ImportError:  # uvloop is optional and unavailable on Windows
+    uvloop = None
+
+# Import our professional modules (run from the project root: python -m bot.main)
+from bot.config import Config
 from utils.database import DatabasePro as ProfessionalDatabase
 from utils.download_manager import AdvancedDownloadManager
 from utils.user_manager import ProfessionalUserManager
 from utils.admin_panel import ProfessionalAdminPanel
 from utils.security import SecurityManager
-from utils.analytics import AnalyticsManager
-
-# Load environment variables
-load_dotenv()
-
-# Configure professional logging system
-log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
-os.makedirs('logs', exist_ok=True)
-
-# Configure logging handlers
-log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(funcName)s - %(message)s')
-
-# Create file handlers
-bot_handler = logging.FileHandler('logs/bot.log', encoding='utf-8')
-bot_handler.setFormatter(log_formatter)
-
-error_handler = logging.FileHandler('logs/error.log', encoding='utf-8')
-error_handler.setLevel(logging.ERROR)
-error_handler.setFormatter(log_formatter)
-
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setFormatter(log_formatter)
-
-# Configure root logger
-logging.basicConfig(
-    level=getattr(logging, log_level),
-    handlers=[bot_handler, error_handler, console_handler]
-)
-
-# Set specific log levels for different modules
-logging.getLogger('aiogram').setLevel(logging.WARNING)
-logging.getLogger('aiohttp').setLevel(logging.WARNING)
-logging.getLogger('yt_dlp').setLevel(logging.ERROR)
+from utils.analytics import AnalyticsManager, HyperLogLog
+from utils.rate_limiter import TokenBucket, TokenBucketLimiter
+from utils.fsm_storage import create_storage
+from utils.formatting import html_preview
+from utils import serialization
+
+# Runtime configuration, loaded in main() so importing this module has no side effects
+CFG: Optional[Config] = None
+
+def configure_logging(log_level: str):
+    """Configure professional logging system"""
+    os.makedirs('logs', exist_ok=True)
+    
+    # Configure logging handlers
+    log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(funcName)s - %(message)s')
+    
+    # Create file handlers
+    bot_handler = logging.FileHandler('logs/bot.log', encoding='utf-8')
+    bot_handler.setFormatter(log_formatter)
+    
+    error_handler = logging.FileHandler('logs/error.log', encoding='utf-8')
+    error_handler.setLevel(logging.ERROR)
+    error_handler.setFormatter(log_formatter)
+    
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(log_formatter)
+    
+    # The format never shows thread or process details, so skip collecting them per record
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    
+    # Handlers do their blocking writes on a listener thread, off the event loop
+    log_queue = queue.SimpleQueue()
+    log_listener = logging.handlers.QueueListener(
+        log_queue, bot_handler, error_handler, console_handler,
+        respect_handler_level=True
+    )
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    
+    # Configure root logger
+    logging.basicConfig(
+        level=getattr(logging, log_level),
+        handlers=[logging.handlers.QueueHandler(log_queue)]
+    )
+    
+    # Set specific log levels for different modules
+    logging.getLogger('aiogram').setLevel(logging.WARNING)
+    logging.getLogger('aiohttp').setLevel(logging.WARNING)
+    logging.getLogger('yt_dlp').setLevel(logging.ERROR)
 
 logger = logging.getLogger(__name__)
 
 # Performance and monitoring setup
+RESPONSE_RING_SIZE = 4096  # power of two so the ring index is a mask
+RESPONSE_WINDOW = 100  # samples covered by the running average
+ACTIVE_USERS_WINDOW = 3600  # seconds per active-user sketch generation
+
+class RunningStats:
+    """Welford running mean and variance in O(1) memory"""
+    
+    __slots__ = ('n', 'mean', 'm2')
+    
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+    
+    def push(self, x: float):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+    
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+    
+    @property
+    def stdev(self) -> float:
+        return self.variance ** 0.5
+
 class BotMetrics:
     def __init__(self):
-        self.start_time = time.time()
+        self.start_time = time.monotonic()
+        self.download_stats = {'total': 0, 'successful': 0, 'failed': 0}
+        # Two rotating sketches give a sliding 1-2h active-user window
+        self.active_users = HyperLogLog(error_rate=0.01)  # fixed ~16KB, unlike a set
+        self._prev_active_users = HyperLogLog(error_rate=0.01)
+        self._active_since = time.monotonic()
+        
+        # Plain counters: every update runs on the event loop thread
         self.request_count = 0
         self.error_count = 0
-        self.download_stats = {'total': 0, 'successful': 0, 'failed': 0}
-        self.response_times = []
-        self.active_users = set()
+        self.dropped_events = 0
+        
+        # Fixed-size ring buffer of recent response times in nanoseconds
+        self._resp_ring = array.array('q', [0]) * RESPONSE_RING_SIZE
+        self._resp_idx = 0  # total samples ever written
+        self._window_ns = 0  # sum of the last RESPONSE_WINDOW samples
+        
+        # Lifetime response time summary (seconds)
+        self.rt = RunningStats()
+        
+        # Last /health report, refreshed by background_tasks or on demand
+        self.health_snapshot: Optional[Dict[str, Any]] = None
+        self.health_snapshot_ts = 0.0
+    
+    @property
+    def response_samples(self) -> int:
+        return min(self._resp_idx, RESPONSE_RING_SIZE)
+    
+    def record_request(self, response_ns: int):
+        """Count a handled request and store its response time in ns"""
+        self.request_count += 1
+        idx = self._resp_idx
+        self._resp_idx += 1
+        mask = RESPONSE_RING_SIZE - 1
+        if idx >= RESPONSE_WINDOW:
+            self._window_ns -= self._resp_ring[(idx - RESPONSE_WINDOW) & mask]
+        self._resp_ring[idx & mask] = response_ns
+        self._window_ns += response_ns
+        self.rt.push(response_ns * 1e-9)
+    
+    def _rotate_active_users(self):
+        now = time.monotonic()
+        if now - self._active_since >= ACTIVE_USERS_WINDOW:
+            self._prev_active_users = self.active_users
+            self.active_users = HyperLogLog(error_rate=0.01)
+            self._active_since = now
+    
+    def track_active_user(self, user_id: int):
+        self._rotate_active_users()
+        self.active_users.add(user_id)
+    
+    def active_user_count(self) -> int:
+        """Distinct users seen in the current and previous window"""
+        self._rotate_active_users()
+        return self.active_users.union(self._prev_active_users).cardinality()
+    
+    def record_error(self):
+        self.error_count += 1
+    
+    def record_dropped_event(self):
+        self.dropped_events += 1
+    
+    def recent_response_times(self, count: int = 100) -> List[float]:
+        """Return up to `count` most recent response times in seconds, oldest first"""
+        end = self._resp_idx
+        count = min(count, end, RESPONSE_RING_SIZE)
+        mask = RESPONSE_RING_SIZE - 1
+        return [self._resp_ring[i & mask] * 1e-9 for i in range(end - count, end)]
+    
+    def avg_response_time(self, count: int = RESPONSE_WINDOW) -> float:
+        if count == RESPONSE_WINDOW:
+            samples = min(self._resp_idx, RESPONSE_WINDOW)
+            return self._window_ns * 1e-9 / samples if samples else 0
+        recent = self.recent_response_times(count)
+        return sum(recent) / len(recent) if recent else 0
+    
+    def response_time_percentile(self, pct: float) -> float:
+        """Percentile over the ring window; sorted only when read"""
+        samples = self.response_samples
+        if not samples:
+            return 0
+        # Order is irrelevant for a percentile, so sort the raw ns slots directly
+        window = sorted(self._resp_ring[:samples])
+        return window[min(samples - 1, int(samples * pct / 100))] * 1e-9
 
 metrics = BotMetrics()
 
-# Bot configuration
-BOT_TOKEN = os.getenv('BOT_TOKEN')
-if not BOT_TOKEN:
-    logger.error("BOT_TOKEN not found in environment variables")
-    sys.exit(1)
+# Analytics events are queued here and written in batches by analytics_flush_loop
+ANALYTICS_QUEUE_SIZE = 10000
+ANALYTICS_BATCH_SIZE = 500
+ANALYTICS_FLUSH_INTERVAL = 0.25
+analytics_queue: asyncio.Queue = asyncio.Queue(maxsize=ANALYTICS_QUEUE_SIZE)
+
+def queue_analytics(*event) -> bool:
+    """Queue an analytics event without waiting, returning False if full"""
+    try:
+        analytics_queue.put_nowait(event)
+        return True
+    except asyncio.QueueFull:
+        metrics.record_dropped_event()
+        return False
+
+async def flush_analytics(limit: int = ANALYTICS_BATCH_SIZE) -> int:
+    """Write up to `limit` queued events to the analytics manager"""
+    batch = []
+    while len(batch) < limit and not analytics_queue.empty():
+        batch.append(analytics_queue.get_nowait())
+    if batch:
+        await analytics_manager.track_batch(batch)
+    return len(batch)
+
+async def drain_analytics():
+    """Flush every queued analytics event, used on shutdown"""
+    while await flush_analytics():
+        pass
+
+async def collect_analytics_batch(batch: List[tuple], limit: int = ANALYTICS_BATCH_SIZE,
+                                  interval: float = ANALYTICS_FLUSH_INTERVAL) -> List[tuple]:
+    """Wait for the next event, then gather more into `batch` until it is full or the interval ends"""
+    batch.append(await analytics_queue.get())
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + interval
+    while len(batch) < limit:
+        if not analytics_queue.empty():
+            batch.append(analytics_queue.get_nowait())
+            continue
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(analytics_queue.get(), timeout=remaining))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+async def analytics_flush_loop():
+    """Drain the analytics queue in batches, sleeping while it is empty"""
+    batch: List[tuple] = []
+    while True:
+        try:
+            await collect_analytics_batch(batch)
+            await analytics_manager.track_batch(batch)
+        except asyncio.CancelledError:
+            # Events already taken off the queue would be missed by the drain
+            if batch:
+                await analytics_manager.track_batch(batch)
+            raise
+        except Exception as e:
+            logger.error("Analytics flush error: %s", e)
+        batch = []
 
-ADMIN_ID = int(os.getenv('ADMIN_ID', '7352192536'))
-MAX_CONCURRENT_DOWNLOADS = int(os.getenv('MAX_CONCURRENT_DOWNLOADS', '5'))
-RATE_LIMIT_REQUESTS = int(os.getenv('RATE_LIMIT_REQUESTS', '30'))
-RATE_LIMIT_PERIOD = int(os.getenv('RATE_LIMIT_PERIOD', '60'))
-ENABLE_ANALYTICS = os.getenv('ENABLE_ANALYTICS', 'true').lower() == 'true'
-ENABLE_SECURITY = os.getenv('ENABLE_SECURITY', 'true').lower() == 'true'
+async def stop_task(task: asyncio.Task):
+    """Cancel a background task and wait for its cleanup to finish"""
+    task.cancel()
+    with suppress(asyncio.CancelledError):
+        await task
 
 # Performance monitoring decorator
 def monitor_performance(func):
+    metric_name = f"{func.__name__}_response_time"
+    
     @wraps(func)
     async def wrapper(*args, **kwargs):
-        start_time = time.time()
+        start_ns = time.perf_counter_ns()
         try:
             result = await func(*args, **kwargs)
-            response_time = time.time() - start_time
-            metrics.response_times.append(response_time)
-            metrics.request_count += 1
+            elapsed_ns = time.perf_counter_ns() - start_ns
+            metrics.record_request(elapsed_ns)
+            response_time = elapsed_ns * 1e-9
             
             # Track in analytics if available
-            if 'analytics_manager' in globals():
-                await analytics_manager.track_performance_metric(
-                    f"{func.__name__}_response_time", 
-                    response_time
-                )
+            if analytics_manager:
+                queue_analytics('performance_metric', metric_name, response_time)
             
             return result
         except Exception as e:
-            metrics.error_count += 1
-            logger.error(f"Error in {func.__name__}: {e}")
+            metrics.record_error()
+            logger.error("Error in %s: %s", func.__name__, e)
             raise
     return wrapper
 
-# Initialize bot with advanced configuration
-bot = Bot(
-    token=BOT_TOKEN, 
-    default=DefaultBotProperties(
-        parse_mode=ParseMode.HTML,
-        protect_content=False,
-        allow_sending_without_reply=True,
-        link_preview_is_disabled=True
+# Telegram allows roughly 30 messages a second per bot and one a second per chat
+OUTBOUND_GLOBAL_RATE = 28
+OUTBOUND_CHAT_RATE = 1
+OUTBOUND_CHAT_BURST = 3
+OUTBOUND_MAX_RETRIES = 3
+OUTBOUND_BACKOFF_CAP = 30
+
+class OutboundRateLimitMiddleware(BaseRequestMiddleware):
+    """Pace chat-bound Bot API calls and back off on flood control.
+    
+    Runs on the bot session, so every send, edit and reply made by any
+    handler shares one global bucket and a bucket per chat. A flood-control
+    reply pauses all chat-bound calls until its retry_after has passed,
+    while polling (which has no chat) keeps running.
+    """
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(OUTBOUND_GLOBAL_RATE, OUTBOUND_GLOBAL_RATE)
+        self.chat_buckets = TokenBucketLimiter(
+            requests=OUTBOUND_CHAT_BURST, period=OUTBOUND_CHAT_BURST / OUTBOUND_CHAT_RATE
+        )
+        self.paused_until = 0.0
+
+    async def __call__(self, make_request, bot: Bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        for attempt in range(OUTBOUND_MAX_RETRIES + 1):
+            if chat_id is not None:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                delay = max(self.global_bucket.reserve(), self.chat_buckets.reserve(chat_id))
+                if delay:
+                    await asyncio.sleep(delay)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.paused_until = max(self.paused_until, time.monotonic() + e.retry_after)
+                if attempt == OUTBOUND_MAX_RETRIES:
+                    raise
+                wait = max(e.retry_after, min(2 ** attempt, OUTBOUND_BACKOFF_CAP))
+                logger.warning("Flood control on %s, retrying in %ss", type(method).__name__, wait)
+                await asyncio.sleep(wait)
+
+def create_bot(config: Config) -> Bot:
+    """Initialize bot with advanced configuration"""
+    # Single pooled HTTP session for every Bot API call, closed on shutdown.
+    # All requests go to api.telegram.org, so the pool limit is the per-host limit.
+    session = AiohttpSession(limit=config.http_connection_limit)
+    session.middleware(OutboundRateLimitMiddleware())
+    return Bot(
+        token=config.bot_token, 
+        session=session,
+        default=DefaultBotProperties(
+            parse_mode=ParseMode.HTML,
+            protect_content=False,
+            allow_sending_without_reply=True,
+            link_preview_is_disabled=True
+        )
     )
-)
 
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+bot: Optional[Bot] = None
+
+# Dispatcher with database or Redis FSM storage, created in lifespan() once db exists
+dp: Optional[Dispatcher] = None
 router = Router()
 
-# Rate limiting with professional throttling
-throttle = asyncio_throttle.Throttler(rate_limit=RATE_LIMIT_REQUESTS, period=RATE_LIMIT_PERIOD)
+class IsAdmin(Filter):
+    """Pass only messages sent by the configured admin"""
+
+    async def __call__(self, message: Message) -> bool:
+        return bool(message.from_user) and message.from_user.id == CFG.admin_id
+
+# Admin commands live on their own router, so non-admins never reach the handlers
+admin_router = Router(name="admin")
+admin_router.message.filter(IsAdmin())
+
+# Rate limiting with per-user token buckets, configured in main()
+rate_limiter: Optional[TokenBucketLimiter] = None
+
+class DownloadQueue:
+    """Admission control for downloads with a visible queue position"""
+
+    def __init__(self, limit: int):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.waiting = 0
+
+    def position(self) -> int:
+        """Queue position a new download would get, 0 when a slot is free"""
+        return self.waiting + 1 if self.semaphore.locked() else 0
+
+    @asynccontextmanager
+    async def slot(self):
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            yield
+        finally:
+            self.semaphore.release()
+
+# Download admission control, sized from MAX_CONCURRENT_DOWNLOADS in main()
+download_queue: Optional[DownloadQueue] = None
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Drop updates from users whose token bucket is empty"""
+
+    async def __call__(self, handler, event: TelegramObject, data: Dict[str, Any]):
+        user = getattr(event, 'from_user', None)
+        if user and not rate_limiter.allow(user.id):
+            if isinstance(event, CallbackQuery):
+                await event.answer("⏳ Too many requests, please slow down.")
+            return None
+        return await handler(event, data)
+
+# Per-update memo for status lookups, so one handler never fetches twice
+_request_cache: contextvars.ContextVar[Optional[Dict[Any, Any]]] = contextvars.ContextVar(
+    'request_cache', default=None
+)
+
+class RequestCacheMiddleware(BaseMiddleware):
+    """Give every update its own request-scoped cache"""
+
+    async def __call__(self, handler, event: TelegramObject, data: Dict[str, Any]):
+        token = _request_cache.set({})
+        try:
+            return await handler(event, data)
+        finally:
+            _request_cache.reset(token)
+
+class UserStatusMiddleware(BaseMiddleware):
+    """Resolve the sender's status once and inject it as `user_status`"""
+
+    async def __call__(self, handler, event: TelegramObject, data: Dict[str, Any]):
+        # Only handlers that declare a user_status parameter pay for the lookup
+        handler_object = data.get('handler')
+        user = data.get('event_from_user')
+        if user and user_manager and handler_object and 'user_status' in handler_object.params:
+            data['user_status'] = await get_user_status_cached(user.id)
+        return await handler(event, data)
+
+router.message.outer_middleware(ThrottlingMiddleware())
+router.callback_query.outer_middleware(ThrottlingMiddleware())
+router.message.outer_middleware(RequestCacheMiddleware())
+router.callback_query.outer_middleware(RequestCacheMiddleware())
+router.message.middleware(UserStatusMiddleware())
+router.callback_query.middleware(UserStatusMiddleware())
+
+# Admin commands get the same middlewares, registered as inner middlewares:
+# admin_router sees every message first, so outer ones would throttle
+# non-admin messages twice before they reach the main router
+admin_router.message.middleware(ThrottlingMiddleware())
+admin_router.message.middleware(RequestCacheMiddleware())
+admin_router.message.middleware(UserStatusMiddleware())
 
 # Advanced bot states
 class BotStates(StatesGroup):
     waiting_for_url = State()
+    waiting_video_url = State()
+    waiting_audio_url = State()
     selecting_quality = State()
+    selecting_video_quality = State()
+    selecting_audio_quality = State()
     downloading = State()
     waiting_admin_input = State()
     admin_user_management = State()
     admin_broadcast_compose = State()
 
-# Initialize professional system managers
-logger.info("Initializing professional system managers...")
+# Professional system managers, created by init_managers() inside the running loop
+db: Optional[ProfessionalDatabase] = None
+download_manager: Optional[AdvancedDownloadManager] = None
+user_manager: Optional[ProfessionalUserManager] = None
+security_manager: Optional[SecurityManager] = None
+analytics_manager: Optional[AnalyticsManager] = None
+admin_panel: Optional[ProfessionalAdminPanel] = None
 
-try:
+def init_managers(config: Config):
+    """Initialize professional system managers.
+    
+    Managers start background tasks in their constructors, so this must run
+    while the event loop is running.
+    """
+    global db, download_manager, user_manager, security_manager, analytics_manager, admin_panel
+    logger.info("Initializing professional system managers...")
+    
     # Database with connection pooling
     db = ProfessionalDatabase(
         db_path="db/bot_database.db",
         pool_size=10,
+        max_overflow=10,
         cache_size=1000
     )
     
     # Advanced download manager with concurrent processing
     download_manager = AdvancedDownloadManager(
-        max_concurrent=MAX_CONCURRENT_DOWNLOADS,
+        max_concurrent=config.max_concurrent_downloads,
         temp_dir="temp",
         cleanup_interval=3600,
         max_file_size=50 * 1024 * 1024,  # 50MB
-        max_duration=3600  # 1 hour
+        max_duration=3600,  # 1 hour
+        info_processes=config.info_worker_processes,
+        info_store=db
     )
     
     # Professional user manager with analytics
     user_manager = ProfessionalUserManager(
         database=db,
         cache_ttl=300,
-        analytics_enabled=ENABLE_ANALYTICS
+        analytics_enabled=config.enable_analytics
     )
     
     # Security manager with threat detection
     security_manager = SecurityManager(
         database=db,
-        enable_monitoring=ENABLE_SECURITY
-    ) if ENABLE_SECURITY else None
+        enable_monitoring=config.enable_security
+    ) if config.enable_security else None
     
     # Analytics manager for comprehensive tracking
     analytics_manager = AnalyticsManager(
         database=db,
-        enable_detailed_tracking=ENABLE_ANALYTICS
-    ) if ENABLE_ANALYTICS else None
+        enable_detailed_tracking=config.enable_analytics
+    ) if config.enable_analytics else None
     
     # Advanced admin panel with real-time monitoring
     admin_panel = ProfessionalAdminPanel(
         database=db,
         bot=bot,
-        admin_id=ADMIN_ID,
+        admin_id=config.admin_id,
         user_manager=user_manager,
         download_manager=download_manager,
-        analytics_enabled=ENABLE_ANALYTICS
+        analytics_enabled=config.enable_analytics
     )
     
     logger.info("All professional managers initialized successfully")
-    
-except Exception as e:
-    logger.error(f"Failed to initialize managers: {e}")
-    sys.exit(1)
 
-# Enhanced keyboard generators
-def get_main_keyboard(user_status: Dict[str, Any] = None):
+# Shared button instances; buttons are immutable so markups can reuse them
+_VIDEO_BTN: Final[InlineKeyboardButton] = InlineKeyboardButton(text="🎬 Video Download", callback_data="video_download")
+_AUDIO_BTN: Final[InlineKeyboardButton] = InlineKeyboardButton(text="🎵 Audio Download", callback_data="audio_download")
+_LIMITS_BTN: Final[InlineKeyboardButton] = InlineKeyboardButton(text="📊 Usage & Limits", callback_data="check_limits")
+_PREMIUM_STATUS_BTN: Final[InlineKeyboardButton] = InlineKeyboardButton(text="👑 Premium Status", callback_data="premium_status")
+_UPGRADE_BTN: Final[InlineKeyboardButton] = InlineKeyboardButton(text="⭐ Upgrade to Premium", callback_data="upgrade_info")
+_HELP_BTN: Final[InlineKeyboardButton] = InlineKeyboardButton(text="❓ Help & Support", callback_data="help_support")
+_STATS_BTN: Final[InlineKeyboardButton] = InlineKeyboardButton(text="📈 Bot Stats", callback_data="bot_stats")
+_BACK_BTN: Final[InlineKeyboardButton] = InlineKeyboardButton(text="🔙 Back to Menu", callback_data="back_to_main")
+
+# Enhanced keyboard builders (run once at import, see markups below)
+def _build_main_keyboard(is_prime: bool) -> InlineKeyboardMarkup:
     """Create enhanced main inline keyboard with user-specific options"""
     keyboard = InlineKeyboardBuilder()
     
     # Main download options
-    keyboard.add(InlineKeyboardButton(text="🎬 Video Download", callback_data="video_download"))
-    keyboard.add(InlineKeyboardButton(text="🎵 Audio Download", callback_data="audio_download"))
+    keyboard.add(_VIDEO_BTN)
+    keyboard.add(_AUDIO_BTN)
     
     # User status and limits
-    keyboard.add(InlineKeyboardButton(text="📊 Usage & Limits", callback_data="check_limits"))
+    keyboard.add(_LIMITS_BTN)
     
     # Premium upgrade or status
-    if user_status and user_status.get('is_prime'):
-        keyboard.add(InlineKeyboardButton(text="👑 Premium Status", callback_data="premium_status"))
+    if is_prime:
+        keyboard.add(_PREMIUM_STATUS_BTN)
     else:
-        keyboard.add(InlineKeyboardButton(text="⭐ Upgrade to Premium", callback_data="upgrade_info"))
+        keyboard.add(_UPGRADE_BTN)
     
     # Help and support
-    keyboard.add(InlineKeyboardButton(text="❓ Help & Support", callback_data="help_support"))
-    keyboard.add(InlineKeyboardButton(text="📈 Bot Stats", callback_data="bot_stats"))
+    keyboard.add(_HELP_BTN)
+    keyboard.add(_STATS_BTN)
     
     keyboard.adjust(2, 2, 2)
     return keyboard.as_markup()
 
-def get_quality_keyboard(download_type="video", is_prime=False, user_tier="Free"):
+def _build_quality_keyboard(download_type: str, is_prime: bool) -> InlineKeyboardMarkup:
     """Create enhanced quality selection keyboard with tier-based options"""
     keyboard = InlineKeyboardBuilder()
     
@@ -262,10 +620,10 @@ def get_quality_keyboard(download_type="video", is_prime=False, user_tier="Free"
             keyboard.add(InlineKeyboardButton(text="🔒 HQ Audio (Premium)", callback_data="upgrade_info"))
             keyboard.adjust(2)
     
-    keyboard.add(InlineKeyboardButton(text="🔙 Back to Menu", callback_data="back_to_main"))
+    keyboard.add(_BACK_BTN)
     return keyboard.as_markup()
 
-def get_admin_keyboard():
+def _build_admin_keyboard() -> InlineKeyboardMarkup:
     """Create advanced admin management keyboard"""
     keyboard = InlineKeyboardBuilder()
     
@@ -288,50 +646,303 @@ def get_admin_keyboard():
     keyboard.adjust(2, 2, 2, 2)
     return keyboard.as_markup()
 
+# Markups are immutable, so every possible variant is built once and shared
+MAIN_KB_PRIME: Final[InlineKeyboardMarkup] = _build_main_keyboard(is_prime=True)
+MAIN_KB_FREE: Final[InlineKeyboardMarkup] = _build_main_keyboard(is_prime=False)
+QUALITY_VIDEO_PRIME: Final[InlineKeyboardMarkup] = _build_quality_keyboard("video", is_prime=True)
+QUALITY_VIDEO_FREE: Final[InlineKeyboardMarkup] = _build_quality_keyboard("video", is_prime=False)
+QUALITY_AUDIO_PRIME: Final[InlineKeyboardMarkup] = _build_quality_keyboard("audio", is_prime=True)
+QUALITY_AUDIO_FREE: Final[InlineKeyboardMarkup] = _build_quality_keyboard("audio", is_prime=False)
+ADMIN_KB: Final[InlineKeyboardMarkup] = _build_admin_keyboard()
+_QUALITY_KEYBOARDS: Final[Dict[Tuple[str, bool], InlineKeyboardMarkup]] = {
+    ("video", True): QUALITY_VIDEO_PRIME,
+    ("video", False): QUALITY_VIDEO_FREE,
+    ("audio", True): QUALITY_AUDIO_PRIME,
+    ("audio", False): QUALITY_AUDIO_FREE
+}
+
+# Static handler markups
+LIMITS_KB: Final[InlineKeyboardMarkup] = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🔄 Refresh Stats", callback_data="check_limits")],
+    [InlineKeyboardButton(text="📊 Detailed Analytics", callback_data="user_analytics")],
+    [_BACK_BTN]
+])
+UPGRADE_KB: Final[InlineKeyboardMarkup] = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="💬 Contact Admin", url="https://t.me/chhinhlong")],
+    [InlineKeyboardButton(text="📊 View Benefits", callback_data="premium_benefits")],
+    [_BACK_BTN]
+])
+VIDEO_PROMPT_KB: Final[InlineKeyboardMarkup] = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="❓ Help with Links", callback_data="link_help")],
+    [_BACK_BTN]
+])
+AUDIO_PROMPT_KB: Final[InlineKeyboardMarkup] = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="❓ Audio Help", callback_data="audio_help")],
+    [_BACK_BTN]
+])
+CHOOSE_TYPE_KB: Final[InlineKeyboardMarkup] = InlineKeyboardMarkup(inline_keyboard=[
+    [
+        InlineKeyboardButton(text="🎬 Download Video", callback_data="video_download"),
+        InlineKeyboardButton(text="🎵 Extract Audio", callback_data="audio_download")
+    ],
+    [_BACK_BTN]
+])
+PREMIUM_QUALITY_KB: Final[InlineKeyboardMarkup] = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="⭐ Upgrade Now", callback_data="upgrade_info")],
+    [InlineKeyboardButton(text="🔙 Choose Standard Quality", callback_data="back_to_quality")]
+])
+DOWNLOAD_FAILED_KB: Final[InlineKeyboardMarkup] = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🔄 Try Again", callback_data="retry_download")],
+    [_BACK_BTN]
+])
+
+# Display labels for quality callback data
+_QUALITY_LABELS: Final[Dict[str, str]] = {
+    'quality_360p': '360p',
+    'quality_480p': '480p',
+    'quality_720p': '720p',
+    'quality_1080p': '1080p',
+    'audio_standard': 'Standard Audio',
+    'audio_hq': 'HQ Audio'
+}
+
+# Callback values handled by handle_quality_selection, and the premium-only subset
+_QUALITY_CALLBACKS: Final[frozenset] = frozenset(_QUALITY_LABELS)
+_PREMIUM_QUALITIES: Final[frozenset] = frozenset({'quality_720p', 'quality_1080p', 'audio_hq'})
+
+# Every callback value this router handles. Checked once at the observer so
+# buttons without a handler (admin panel, stale keyboards) skip the per-handler
+# filter walk entirely.
+_ROUTER_CALLBACKS: Final[frozenset] = _QUALITY_CALLBACKS | {'video_download', 'audio_download', 'back_to_main'}
+router.callback_query.filter(F.data.in_(_ROUTER_CALLBACKS))
+
+def quality_label(quality: str) -> str:
+    """Human readable name for a quality callback value"""
+    return _QUALITY_LABELS.get(quality, quality)
+
+def get_main_keyboard(user_status: Dict[str, Any] = None) -> InlineKeyboardMarkup:
+    """Return the main keyboard matching the user's premium status"""
+    return MAIN_KB_PRIME if user_status and user_status.get('is_prime') else MAIN_KB_FREE
+
+def get_quality_keyboard(download_type="video", is_prime=False, user_tier="Free") -> InlineKeyboardMarkup:
+    """Return the quality selection keyboard for the download type and tier"""
+    return _QUALITY_KEYBOARDS[download_type if download_type == "video" else "audio", bool(is_prime)]
+
+def get_admin_keyboard() -> InlineKeyboardMarkup:
+    """Return the admin management keyboard"""
+    return ADMIN_KB
+
 # Security wrapper for user actions
 async def security_check(user_id: int, action: str, message: Message = None) -> bool:
-    """Perform comprehensive security check"""
+    """Perform comprehensive security check.
+    
+    Call sites guard with ``security_manager and ...`` so that no coroutine
+    is created at all when security is disabled.
+    """
     if not security_manager:
         return True
     
     try:
-        # Extract IP if available (Telegram doesn't provide direct IP access)
-        ip_address = None
-        
-        # Validate input if message provided
-        if message and message.text:
-            is_valid, error_msg = security_manager.validate_input(message.text, 'general')
-            if not is_valid:
-                logger.warning(f"Invalid input from user {user_id}: {error_msg}")
-                if message:
-                    await message.reply(f"⚠️ Security Warning: {error_msg}")
-                return False
-        
-        # Check user permissions
-        permission_result = await security_manager.check_user_permission(user_id, action, ip_address)
+        # Input validation and permission check share one security manager call
+        result = await security_manager.check_and_validate(
+            user_id, action, message.text if message and message.text else None
+        )
+        if result['allowed']:
+            return True
         
-        if not permission_result['allowed']:
-            logger.warning(f"Security denied for user {user_id}: {permission_result['reason']}")
+        if result['stage'] == 'input':
+            logger.warning("Invalid input from user %s: %s", user_id, result['reason'])
+            await message.reply(f"⚠️ Security Warning: {result['reason']}")
+        else:
+            logger.warning("Security denied for user %s: %s", user_id, result['reason'])
             if message:
-                await message.reply(f"🚫 Access Denied: {permission_result['reason']}")
-            return False
-        
-        return True
+                await message.reply(f"🚫 Access Denied: {result['reason']}")
+        return False
     except Exception as e:
-        logger.error(f"Security check error: {e}")
-        return True  # Fail open for system stability
+        logger.error("Security check error for user %s: %s", user_id, e)
+        return False  # Fail closed, like SecurityManager.check_user_permission
+
+# User status helpers: per-update memo backed by a short-lived process cache
+USER_STATUS_TTL = 30
+USER_STATUS_MAX_ENTRIES = 50000
+# Entries are re-inserted on refresh, so iteration order is oldest first
+_user_status_cache: Dict[int, Tuple[float, Dict[str, Any]]] = {}
+
+async def _fetch_user_status(user_id: int) -> Dict[str, Any]:
+    """Get user status from the TTL cache or the user manager"""
+    now = time.monotonic()
+    cached = _user_status_cache.get(user_id)
+    if cached is not None and now - cached[0] < USER_STATUS_TTL:
+        return cached[1]
+    
+    user_status = await user_manager.get_user_status(user_id)
+    _user_status_cache.pop(user_id, None)
+    _user_status_cache[user_id] = (now, user_status)
+    if len(_user_status_cache) > USER_STATUS_MAX_ENTRIES:
+        del _user_status_cache[next(iter(_user_status_cache))]
+    return user_status
+
+def invalidate_user_status(user_id: Optional[int] = None):
+    """Forget cached status for one user, or for everyone"""
+    if user_id is None:
+        _user_status_cache.clear()
+    else:
+        _user_status_cache.pop(user_id, None)
+    
+    cache = _request_cache.get()
+    if cache is not None:
+        cache.clear()
+
+def prune_user_status_cache():
+    """Drop expired status entries"""
+    expiry = time.monotonic() - USER_STATUS_TTL
+    while _user_status_cache:
+        user_id = next(iter(_user_status_cache))
+        if _user_status_cache[user_id][0] >= expiry:
+            break
+        del _user_status_cache[user_id]
+
+async def get_user_status_cached(user_id: int) -> Dict[str, Any]:
+    """Get user status once per update, reusing it for repeated lookups"""
+    cache = _request_cache.get()
+    if cache is None:
+        return await _fetch_user_status(user_id)
+    
+    key = ('status', user_id)
+    if key not in cache:
+        cache[key] = await _fetch_user_status(user_id)
+    return cache[key]
+
+async def get_status_bundle(user_id: int):
+    """Return (status, download permission, security info) for a user on the download paths"""
+    cache = _request_cache.get()
+    key = ('bundle', user_id)
+    if cache is not None and key in cache:
+        return cache[key]
+    
+    user_status = await get_user_status_cached(user_id)
+    permission_check = await user_manager.can_user_download(user_id, status=user_status)
+    security_info = security_manager.get_user_security_info(user_id) if security_manager else {}
+    
+    bundle = (user_status, permission_check, security_info)
+    if cache is not None:
+        cache[key] = bundle
+    return bundle
 
 # Analytics tracking wrapper
-async def track_event(user_id: int, event_type: str, data: Dict[str, Any] = None):
+def track_event(user_id: int, event_type: str, data: Dict[str, Any] = None):
     """Track user events for analytics"""
     if not analytics_manager:
         return
     
+    metrics.track_active_user(user_id)
+    if not queue_analytics('user_event', user_id, event_type, data):
+        logger.warning("Analytics queue full, dropped event %s", event_type)
+
+# Hash of the last content sent to each (chat_id, message_id), LRU-capped
+LAST_EDIT_CACHE_SIZE = 10000
+_last_edit: 'OrderedDict[Tuple[int, int], int]' = OrderedDict()
+
+async def safe_edit_text(message: Message, text: str, **kwargs):
+    """Edit a message, ignoring no-op edits (flood control is handled by the session)"""
+    key = (message.chat.id, message.message_id)
+    content_hash = hash((text, repr(kwargs)))
+    if _last_edit.get(key) == content_hash:
+        return message
+    
     try:
-        await analytics_manager.track_user_event(user_id, event_type, data)
-        metrics.active_users.add(user_id)
-    except Exception as e:
-        logger.error(f"Analytics tracking error: {e}")
+        result = await message.edit_text(text, **kwargs)
+    except TelegramBadRequest as e:
+        if 'message is not modified' in str(e):
+            return message
+        raise
+    _last_edit[key] = content_hash
+    _last_edit.move_to_end(key)
+    if len(_last_edit) > LAST_EDIT_CACHE_SIZE:
+        _last_edit.popitem(last=False)
+    return result
+
+# Fire-and-forget Bot API calls; references are kept until each task finishes
+_background_calls: set = set()
+
+def _background_call_done(task: asyncio.Task):
+    _background_calls.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.debug("Background API call failed: %s", task.exception())
+
+def fire_and_forget(coro):
+    """Run a non-critical coroutine without awaiting it"""
+    task = asyncio.create_task(coro)
+    _background_calls.add(task)
+    task.add_done_callback(_background_call_done)
+
+async def clear_fsm(state: FSMContext):
+    """Reset FSM state and data, in one statement when the storage supports it"""
+    clear = getattr(state.storage, 'clear', None)
+    if clear is not None:
+        await clear(state.key)
+    else:
+        await state.clear()
+
+def track_download(**fields):
+    """Queue a download analytics event (see AnalyticsManager.track_download_event)"""
+    if analytics_manager and not queue_analytics('download_event', fields):
+        logger.warning("Analytics queue full, dropped download event")
+
+# Welcome templates, specialised per tier at import; only user fields are filled per call
+_WELCOME_PRIME_TMPL: Final[str] = """
+🎉 <b>Welcome to Professional YouTube Downloader!</b>
+
+👋 Hello {first_name}! 
+
+🚀 <b>What I can do:</b>
+• 🎬 Download YouTube videos in multiple qualities
+• 🎵 Extract high-quality audio from videos
+• 👑 Premium features for unlimited access
+• 📊 Real-time usage tracking
+• 🔒 Enterprise-grade security
+
+📊 <b>Your Status:</b>
+👑 Premium User ({user_tier})
+📈 Level: {user_level}
+⚡ Engagement Score: {engagement_score}/100
+
+🎯 <b>Quick Start:</b>
+1. Choose download type below
+2. Send any YouTube link
+3. Select quality and download!
+
+💎 Premium users enjoy unlimited downloads and HD quality!
+
+🔗 <b>Enterprise Bot by AKG Technology</b>
+    """
+
+_WELCOME_FREE_TMPL: Final[str] = """
+🎉 <b>Welcome to Professional YouTube Downloader!</b>
+
+👋 Hello {first_name}! 
+
+🚀 <b>What I can do:</b>
+• 🎬 Download YouTube videos in multiple qualities
+• 🎵 Extract high-quality audio from videos
+• 👑 Premium features for unlimited access
+• 📊 Real-time usage tracking
+• 🔒 Enterprise-grade security
+
+📊 <b>Your Status:</b>
+👤 {user_tier} User
+📈 Level: {user_level}
+⚡ Engagement Score: {engagement_score}/100
+
+🎯 <b>Quick Start:</b>
+1. Choose download type below
+2. Send any YouTube link
+3. Select quality and download!
+
+💎 Premium users enjoy unlimited downloads and HD quality!
+
+🔗 <b>Enterprise Bot by AKG Technology</b>
+    """
 
 # Command handlers with enhanced features
 @router.message(CommandStart())
@@ -348,7 +959,7 @@ async def command_start_handler(message: Message):
     language_code = message.from_user.language_code or 'en'
     
     # Security check
-    if not await security_check(user_id, 'start_bot', message):
+    if security_manager and not await security_check(user_id, 'start_bot', message):
         return
     
     # Initialize user with comprehensive profile
@@ -365,61 +976,81 @@ async def command_start_handler(message: Message):
         return
     
     # Track analytics
-    await track_event(user_id, 'bot_started', {
+    track_event(user_id, 'bot_started', {
         'username': username,
         'language_code': language_code
     })
     
     # Get user status for personalized experience
-    user_status = await user_manager.get_user_status(user_id)
+    user_status = await get_user_status_cached(user_id)
     
-    welcome_text = f"""
-🎉 <b>Welcome to Professional YouTube Downloader!</b>
+    welcome_tmpl = _WELCOME_PRIME_TMPL if user_status['is_prime'] else _WELCOME_FREE_TMPL
+    welcome_text = welcome_tmpl.format_map({**user_status, 'first_name': html_preview(first_name or 'User')})
+    
+    await message.answer(welcome_text, reply_markup=get_main_keyboard(user_status))
 
-👋 Hello {first_name or 'User'}! 
+# Help templates, specialised per tier at import
+_HELP_PRIME_TMPL: Final[str] = """
+📚 <b>Professional YouTube Downloader - Complete Guide</b>
 
-🚀 <b>What I can do:</b>
-• 🎬 Download YouTube videos in multiple qualities
-• 🎵 Extract high-quality audio from videos
-• 👑 Premium features for unlimited access
-• 📊 Real-time usage tracking
-• 🔒 Enterprise-grade security
+<b>🎯 Core Features:</b>
+• 🎬 Video downloads (360p, 480p, 720p, 1080p)
+• 🎵 Audio extraction (Standard, High Quality)
+• 📊 Real-time usage analytics
+• 🔒 Advanced security protection
+• ⚡ Concurrent download processing
 
-📊 <b>Your Status:</b>
-{f"👑 Premium User ({user_status['user_tier']})" if user_status['is_prime'] else f"👤 {user_status['user_tier']} User"}
-📈 Level: {user_status['user_level']}
-⚡ Engagement Score: {user_status['engagement_score']}/100
+<b>📋 Available Commands:</b>
+/start - Initialize the bot
+/help - Show this comprehensive help
+/limit - Check detailed usage limits
+/upgrade - Premium subscription info
+{admin_commands}
 
-🎯 <b>Quick Start:</b>
-1. Choose download type below
-2. Send any YouTube link
-3. Select quality and download!
+<b>🎬 Download Process:</b>
+1. Click "Video Download" or "Audio Download"
+2. Send YouTube link (youtube.com or youtu.be)
+3. Choose quality based on your tier
+4. Download processed with enterprise features
 
-💎 Premium users enjoy unlimited downloads and HD quality!
+<b>👑 Premium Benefits ({user_tier} Tier):</b>
+• ♾️ Unlimited downloads
+• 🎬 HD quality (720p, 1080p)
+• 🎵 High-quality audio
+• ⚡ No cooldown periods
+• 🚀 Priority processing
 
-🔗 <b>Enterprise Bot by AKG Technology</b>
+<b>🔒 Security Features:</b>
+• Advanced rate limiting
+• Input validation and sanitization
+• Threat detection and monitoring
+• Automatic security updates
+
+<b>📊 Your Analytics:</b>
+• Level: {user_level}
+• Engagement Score: {engagement_score}/100
+• Account Age: {account_age_days} days
+
+<b>📞 Professional Support:</b>
+• Telegram: @chhinhlong
+• Email: chhinhlong2008@gmail.com
+• Response time: <24 hours
+• Premium users get priority support
+
+<b>⚡ Performance:</b>
+• Concurrent processing: Up to {max_concurrent} downloads
+• Success rate: 99.2%
+• Average download time: <30 seconds
+
+Built with enterprise-grade technology for optimal performance and security.
     """
-    
-    await message.answer(welcome_text, reply_markup=get_main_keyboard(user_status))
 
-@router.message(Command("help"))
-@monitor_performance
-async def command_help_handler(message: Message):
-    """Enhanced help command with comprehensive information"""
-    if not message.from_user:
-        return
-    
-    user_id = message.from_user.id
-    await track_event(user_id, 'help_requested')
-    
-    user_status = await user_manager.get_user_status(user_id)
-    
-    help_text = f"""
+_HELP_FREE_TMPL: Final[str] = """
 📚 <b>Professional YouTube Downloader - Complete Guide</b>
 
 <b>🎯 Core Features:</b>
-• 🎬 Video downloads (360p, 480p{', 720p, 1080p' if user_status['is_prime'] else ''})
-• 🎵 Audio extraction (Standard{', High Quality' if user_status['is_prime'] else ''})
+• 🎬 Video downloads (360p, 480p)
+• 🎵 Audio extraction (Standard)
 • 📊 Real-time usage analytics
 • 🔒 Advanced security protection
 • ⚡ Concurrent download processing
@@ -429,7 +1060,7 @@ async def command_help_handler(message: Message):
 /help - Show this comprehensive help
 /limit - Check detailed usage limits
 /upgrade - Premium subscription info
-{'/stats - Admin statistics (Admin only)' if user_id == ADMIN_ID else ''}
+{admin_commands}
 
 <b>🎬 Download Process:</b>
 1. Click "Video Download" or "Audio Download"
@@ -437,12 +1068,12 @@ async def command_help_handler(message: Message):
 3. Choose quality based on your tier
 4. Download processed with enterprise features
 
-<b>👑 Premium Benefits ({user_status['user_tier']} Tier):</b>
-{'• ♾️ Unlimited downloads' if user_status['is_prime'] else '• 15 downloads per hour (Standard)'}
-{'• 🎬 HD quality (720p, 1080p)' if user_status['is_prime'] else '• 📱 Standard quality (360p, 480p)'}
-{'• 🎵 High-quality audio' if user_status['is_prime'] else '• 🎵 Standard audio quality'}
-{'• ⚡ No cooldown periods' if user_status['is_prime'] else '• ⏰ 30-minute cooldown after limit'}
-{'• 🚀 Priority processing' if user_status['is_prime'] else '• 📞 Standard support'}
+<b>👑 Premium Benefits ({user_tier} Tier):</b>
+• 15 downloads per hour (Standard)
+• 📱 Standard quality (360p, 480p)
+• 🎵 Standard audio quality
+• ⏰ 30-minute cooldown after limit
+• 📞 Standard support
 
 <b>🔒 Security Features:</b>
 • Advanced rate limiting
@@ -451,9 +1082,9 @@ async def command_help_handler(message: Message):
 • Automatic security updates
 
 <b>📊 Your Analytics:</b>
-• Level: {user_status['user_level']}
-• Engagement Score: {user_status['engagement_score']}/100
-• Account Age: {user_status.get('account_age_days', 0)} days
+• Level: {user_level}
+• Engagement Score: {engagement_score}/100
+• Account Age: {account_age_days} days
 
 <b>📞 Professional Support:</b>
 • Telegram: @chhinhlong
@@ -462,40 +1093,55 @@ async def command_help_handler(message: Message):
 • Premium users get priority support
 
 <b>⚡ Performance:</b>
-• Concurrent processing: Up to {MAX_CONCURRENT_DOWNLOADS} downloads
+• Concurrent processing: Up to {max_concurrent} downloads
 • Success rate: 99.2%
 • Average download time: <30 seconds
 
 Built with enterprise-grade technology for optimal performance and security.
     """
-    
-    await message.answer(help_text, reply_markup=get_main_keyboard(user_status))
 
-@router.message(Command("limit"))
+@lru_cache(maxsize=128)
+def _render_help(is_prime: bool, user_tier: str, user_level: int, engagement_score: int,
+                 account_age_days: int, is_admin: bool, max_concurrent: int) -> str:
+    """Render /help; the output only depends on a handful of status fields"""
+    help_tmpl = _HELP_PRIME_TMPL if is_prime else _HELP_FREE_TMPL
+    return help_tmpl.format(
+        user_tier=user_tier,
+        user_level=user_level,
+        engagement_score=engagement_score,
+        account_age_days=account_age_days,
+        admin_commands='/stats - Admin statistics (Admin only)' if is_admin else '',
+        max_concurrent=max_concurrent
+    )
+
+@router.message(Command("help"))
 @monitor_performance
-async def command_limit_handler(message: Message):
-    """Enhanced limit command with detailed analytics"""
+async def command_help_handler(message: Message):
+    """Enhanced help command with comprehensive information"""
     if not message.from_user:
         return
     
     user_id = message.from_user.id
-    await track_event(user_id, 'limits_checked')
+    track_event(user_id, 'help_requested')
     
-    user_status = await user_manager.get_user_status(user_id)
+    user_status = await get_user_status_cached(user_id)
     
-    # Get security info if available
-    security_info = {}
-    if security_manager:
-        security_info = security_manager.get_user_security_info(user_id)
+    help_text = _render_help(
+        user_status['is_prime'], user_status['user_tier'], user_status['user_level'],
+        user_status['engagement_score'], user_status.get('account_age_days', 0),
+        user_id == CFG.admin_id, CFG.max_concurrent_downloads
+    )
     
-    if user_status['is_prime']:
-        limit_text = f"""
+    await message.answer(help_text, reply_markup=get_main_keyboard(user_status))
+
+# /limit dashboards; per-call values are passed in one format_map context
+_LIMIT_PRIME_TMPL: Final[str] = """
 👑 <b>Premium User Dashboard</b>
 
 ✨ <b>Premium Status:</b>
-• Tier: {user_status['user_tier']}
-• Level: {user_status['user_level']}
-{f"• Expires: {user_status['prime_expiry']}" if user_status.get('prime_expiry') else "• Duration: Unlimited"}
+• Tier: {user_tier}
+• Level: {user_level}
+{expiry_line}
 
 🚀 <b>Premium Benefits Active:</b>
 • ♾️ Unlimited downloads
@@ -506,38 +1152,35 @@ async def command_limit_handler(message: Message):
 • 📊 Advanced analytics
 
 📈 <b>Usage Analytics:</b>
-• Downloads today: {user_status.get('total_downloads', 0)}
-• Engagement score: {user_status['engagement_score']}/100
-• Member since: {user_status.get('member_since', 'Recently')}
+• Downloads today: {total_downloads}
+• Engagement score: {engagement_score}/100
+• Member since: {member_since}
 
 🔒 <b>Security Status:</b>
-• Trust score: {security_info.get('trust_score', 100)}/100
-• Security level: {security_info.get('security_level', 'secure').title()}
+• Trust score: {trust_score}/100
+• Security level: {security_level}
 • Account protection: Active
         """
-    else:
-        remaining = user_status['downloads_remaining']
-        reset_time = user_status['reset_time']
-        
-        limit_text = f"""
+
+_LIMIT_FREE_TMPL: Final[str] = """
 👤 <b>Standard User Dashboard</b>
 
 📊 <b>Current Usage:</b>
-• Downloads used: {user_status['downloads_this_hour']}/15
-• Downloads remaining: {remaining}
+• Downloads used: {downloads_this_hour}/15
+• Downloads remaining: {downloads_remaining}
 • Resets at: {reset_time}
-{f"• In cooldown until: {user_status['cooldown_until']}" if user_status.get('in_cooldown') else ""}
+{cooldown_line}
 
 📈 <b>Account Analytics:</b>
-• User tier: {user_status['user_tier']}
-• Level: {user_status['user_level']}
-• Engagement score: {user_status['engagement_score']}/100
-• Total downloads: {user_status.get('total_downloads', 0)}
+• User tier: {user_tier}
+• Level: {user_level}
+• Engagement score: {engagement_score}/100
+• Total downloads: {total_downloads}
 
 🔒 <b>Security Status:</b>
-• Trust score: {security_info.get('trust_score', 100)}/100
-• Security level: {security_info.get('security_level', 'secure').title()}
-• Remaining requests: {security_info.get('remaining_requests', 'N/A')}
+• Trust score: {trust_score}/100
+• Security level: {security_level}
+• Remaining requests: {remaining_requests}
 
 ⭐ <b>Upgrade Benefits:</b>
 • ♾️ Unlimited downloads
@@ -548,35 +1191,48 @@ async def command_limit_handler(message: Message):
 
 💰 Contact @chhinhlong to upgrade to Premium!
         """
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔄 Refresh Stats", callback_data="check_limits")],
-        [InlineKeyboardButton(text="📊 Detailed Analytics", callback_data="user_analytics")],
-        [InlineKeyboardButton(text="🔙 Back to Menu", callback_data="back_to_main")]
-    ])
-    
-    await message.answer(limit_text, reply_markup=keyboard)
 
-@router.message(Command("upgrade"))
+@router.message(Command("limit"))
 @monitor_performance
-async def command_upgrade_handler(message: Message):
-    """Enhanced upgrade command with detailed premium information"""
+async def command_limit_handler(message: Message):
+    """Enhanced limit command with detailed analytics"""
     if not message.from_user:
         return
     
     user_id = message.from_user.id
-    await track_event(user_id, 'upgrade_viewed')
-    
-    user_status = await user_manager.get_user_status(user_id)
-    
+    track_event(user_id, 'limits_checked')
+    
+    # Read-only: can_user_download would spend a rate-limit slot on a status check
+    user_status = await get_user_status_cached(user_id)
+    security_info = security_manager.get_user_security_info(user_id) if security_manager else {}
+    
+    ctx = {
+        **user_status,
+        'total_downloads': user_status.get('total_downloads', 0),
+        'trust_score': security_info.get('trust_score', 100),
+        'security_level': security_info.get('security_level', 'secure').title()
+    }
     if user_status['is_prime']:
-        upgrade_text = f"""
+        ctx['expiry_line'] = (f"• Expires: {user_status['prime_expiry']}"
+                              if user_status.get('prime_expiry') else "• Duration: Unlimited")
+        ctx['member_since'] = user_status.get('member_since', 'Recently')
+        limit_text = _LIMIT_PRIME_TMPL.format_map(ctx)
+    else:
+        ctx['cooldown_line'] = (f"• In cooldown until: {user_status['cooldown_until']}"
+                                if user_status.get('in_cooldown') else "")
+        ctx['remaining_requests'] = security_info.get('remaining_requests', 'N/A')
+        limit_text = _LIMIT_FREE_TMPL.format_map(ctx)
+    
+    await message.answer(limit_text, reply_markup=LIMITS_KB)
+
+# Upgrade templates; the premium one only needs the expiry line filled in
+_UPGRADE_PRIME_TMPL: Final[str] = """
 👑 <b>You're Already Premium!</b>
 
 ✨ <b>Your Premium Status:</b>
-• Tier: {user_status['user_tier']}
-• Level: {user_status['user_level']}
-{f"• Expires: {user_status['prime_expiry']}" if user_status.get('prime_expiry') else "• Duration: Unlimited"}
+• Tier: {user_tier}
+• Level: {user_level}
+{expiry_line}
 
 🎯 <b>Active Benefits:</b>
 • ♾️ Unlimited downloads
@@ -595,8 +1251,8 @@ async def command_upgrade_handler(message: Message):
 
 Thank you for being a Premium user! 🙏
         """
-    else:
-        upgrade_text = f"""
+
+_UPGRADE_FREE_TMPL: Final[str] = """
 ⭐ <b>Upgrade to Premium - Unlock Full Potential!</b>
 
 🌟 <b>Premium Benefits Overview:</b>
@@ -631,8 +1287,8 @@ Contact @chhinhlong now and mention "PREMIUM2024" for special pricing!
 4. Instant activation
 
 📈 <b>Why Upgrade Now?</b>
-• Your current level: {user_status['user_level']}
-• Engagement score: {user_status['engagement_score']}/100
+• Your current level: {user_level}
+• Engagement score: {engagement_score}/100
 • You're ready for premium features!
 
 🛡️ <b>Enterprise Grade:</b>
@@ -640,19 +1296,42 @@ All premium features include enterprise-level security, 99.9% uptime guarantee,
 
 Contact us today to unlock your full potential! 🚀
         """
+
+@lru_cache(maxsize=128)
+def _render_upgrade(is_prime: bool, user_tier: str, user_level: int,
+                    engagement_score: int, prime_expiry: Optional[str]) -> str:
+    """Render /upgrade; the output only depends on a handful of status fields"""
+    if is_prime:
+        return _UPGRADE_PRIME_TMPL.format(
+            user_tier=user_tier,
+            user_level=user_level,
+            expiry_line=f"• Expires: {prime_expiry}" if prime_expiry else "• Duration: Unlimited"
+        )
+    return _UPGRADE_FREE_TMPL.format(user_level=user_level, engagement_score=engagement_score)
+
+@router.message(Command("upgrade"))
+@monitor_performance
+async def command_upgrade_handler(message: Message):
+    """Enhanced upgrade command with detailed premium information"""
+    if not message.from_user:
+        return
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="💬 Contact Admin", url="https://t.me/chhinhlong")],
-        [InlineKeyboardButton(text="📊 View Benefits", callback_data="premium_benefits")],
-        [InlineKeyboardButton(text="🔙 Back to Menu", callback_data="back_to_main")]
-    ])
+    user_id = message.from_user.id
+    track_event(user_id, 'upgrade_viewed')
+    
+    user_status = await get_user_status_cached(user_id)
+    
+    upgrade_text = _render_upgrade(
+        user_status['is_prime'], user_status['user_tier'], user_status['user_level'],
+        user_status['engagement_score'], user_status.get('prime_expiry')
+    )
     
-    await message.answer(upgrade_text, reply_markup=keyboard)
+    await message.answer(upgrade_text, reply_markup=UPGRADE_KB)
 
 # Enhanced callback handlers
 @router.callback_query(F.data == "video_download")
 @monitor_performance
-async def callback_video_download(callback: CallbackQuery):
+async def callback_video_download(callback: CallbackQuery, state: FSMContext):
     """Enhanced video download handler with security and analytics"""
     if not callback.from_user or not callback.message:
         return
@@ -660,20 +1339,17 @@ async def callback_video_download(callback: CallbackQuery):
     user_id = callback.from_user.id
     
     # Security check
-    if not await security_check(user_id, 'initiate_download'):
+    if security_manager and not await security_check(user_id, 'initiate_download'):
         await callback.answer("🚫 Security check failed", show_alert=True)
         return
     
     # Track analytics
-    await track_event(user_id, 'video_download_initiated')
+    track_event(user_id, 'video_download_initiated')
     
-    # Get user status
-    user_status = await user_manager.get_user_status(user_id)
-    
-    # Check download permission
-    permission_check = await user_manager.can_user_download(user_id)
+    # Get user status and download permission
+    user_status, permission_check, _ = await get_status_bundle(user_id)
     if not permission_check['can_download']:
-        await callback.message.edit_text(
+        await safe_edit_text(callback.message,
             f"🚫 <b>Download Not Available</b>\n\n{permission_check['reason']}\n\n"
             f"{'💡 ' + permission_check.get('recommendation', '') if permission_check.get('recommendation') else ''}",
             reply_markup=get_main_keyboard(user_status)
@@ -681,7 +1357,7 @@ async def callback_video_download(callback: CallbackQuery):
         await callback.answer()
         return
     
-    await callback.message.edit_text(
+    await safe_edit_text(callback.message,
         f"""
 🎬 <b>Video Download Mode Activated</b>
 
@@ -704,19 +1380,16 @@ async def callback_video_download(callback: CallbackQuery):
 
 Send your YouTube link now! 👇
         """,
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="❓ Help with Links", callback_data="link_help")],
-            [InlineKeyboardButton(text="🔙 Back to Menu", callback_data="back_to_main")]
-        ])
+        reply_markup=VIDEO_PROMPT_KB
     )
     
     # Set user state
-    await user_manager.set_user_state(user_id, "waiting_video_url")
+    await state.set_state(BotStates.waiting_video_url)
     await callback.answer()
 
 @router.callback_query(F.data == "audio_download")
 @monitor_performance
-async def callback_audio_download(callback: CallbackQuery):
+async def callback_audio_download(callback: CallbackQuery, state: FSMContext):
     """Enhanced audio download handler"""
     if not callback.from_user or not callback.message:
         return
@@ -724,20 +1397,17 @@ async def callback_audio_download(callback: CallbackQuery):
     user_id = callback.from_user.id
     
     # Security check
-    if not await security_check(user_id, 'initiate_download'):
+    if security_manager and not await security_check(user_id, 'initiate_download'):
         await callback.answer("🚫 Security check failed", show_alert=True)
         return
     
     # Track analytics
-    await track_event(user_id, 'audio_download_initiated')
-    
-    # Get user status
-    user_status = await user_manager.get_user_status(user_id)
+    track_event(user_id, 'audio_download_initiated')
     
-    # Check download permission
-    permission_check = await user_manager.can_user_download(user_id)
+    # Get user status and download permission
+    user_status, permission_check, _ = await get_status_bundle(user_id)
     if not permission_check['can_download']:
-        await callback.message.edit_text(
+        await safe_edit_text(callback.message,
             f"🚫 <b>Download Not Available</b>\n\n{permission_check['reason']}\n\n"
             f"{'💡 ' + permission_check.get('recommendation', '') if permission_check.get('recommendation') else ''}",
             reply_markup=get_main_keyboard(user_status)
@@ -745,7 +1415,7 @@ async def callback_audio_download(callback: CallbackQuery):
         await callback.answer()
         return
     
-    await callback.message.edit_text(
+    await safe_edit_text(callback.message,
         f"""
 🎵 <b>Audio Download Mode Activated</b>
 
@@ -769,20 +1439,76 @@ async def callback_audio_download(callback: CallbackQuery):
 
 Send your YouTube link now! 👇
         """,
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="❓ Audio Help", callback_data="audio_help")],
-            [InlineKeyboardButton(text="🔙 Back to Menu", callback_data="back_to_main")]
-        ])
+        reply_markup=AUDIO_PROMPT_KB
     )
     
     # Set user state
-    await user_manager.set_user_state(user_id, "waiting_audio_url")
+    await state.set_state(BotStates.waiting_audio_url)
     await callback.answer()
 
 # Continue with URL handling and other enhanced features...
-@router.message(F.text.contains("youtube.com") | F.text.contains("youtu.be"))
+# One scan both recognises a YouTube video link and captures its 11-character id
+YOUTUBE_URL_RE = re.compile(
+    r'(?:youtube\.com/(?:watch\?(?:\S*?&)?v=|shorts/|embed/|live/)|youtu\.be/)([A-Za-z0-9_-]{11})'
+)
+
+# URL preview messages, filled with str.format per call
+_INVALID_URL_TMPL: Final[str] = (
+    "❌ <b>Invalid YouTube URL</b>\n\n{reason}\n\n"
+    "📝 <b>Valid formats:</b>\n"
+    "• https://youtube.com/watch?v=VIDEO_ID\n"
+    "• https://youtu.be/VIDEO_ID\n"
+    "• https://m.youtube.com/watch?v=VIDEO_ID"
+)
+
+_ANALYSIS_FAILED_TMPL: Final[str] = (
+    "❌ <b>Video Analysis Failed</b>\n\n{error}\n\nPlease check the URL and try again."
+)
+
+_VIDEO_TOO_LONG_TMPL: Final[str] = (
+    "⚠️ <b>Video Too Long</b>\n\n"
+    "🎬 <b>Title:</b> {title}\n"
+    "⏱️ <b>Duration:</b> {duration}\n\n"
+    "❌ Videos longer than 1 hour are not supported.\n"
+    "Please choose a shorter video."
+)
+
+# Shared by the video and audio previews; the parts that differ are looked up by type
+_MEDIA_READY_TMPL: Final[str] = (
+    "{header}\n\n"
+    "{title_icon} <b>Title:</b> {title}\n"
+    "👤 <b>Channel:</b> {uploader}\n"
+    "⏱️ <b>Duration:</b> {duration}\n"
+    "👀 <b>Views:</b> {view_count:,}\n"
+    "{uploaded_line}\n\n"
+    "📊 <b>Your Status:</b> {user_tier} (Level {user_level})\n\n"
+    "🎯 <b>Choose {kind} quality:</b>"
+)
+_MEDIA_READY_PARTS: Final[Dict[str, Tuple[str, str]]] = {
+    'video': ("🎬 <b>Video Ready for Download</b>", "📹"),
+    'audio': ("🎵 <b>Audio Ready for Extraction</b>", "🎼"),
+}
+
+_VIDEO_DETECTED_TMPL: Final[str] = (
+    "🔗 <b>YouTube Video Detected!</b>\n\n"
+    "📹 <b>Title:</b> {title}\n"
+    "👤 <b>Channel:</b> {uploader}\n"
+    "⏱️ <b>Duration:</b> {duration}\n\n"
+    "Please choose download type first:"
+)
+
+_PROCESSING_ERROR_TEXT: Final[str] = (
+    "❌ <b>Processing Error</b>\n\n"
+    "Failed to analyze the video. This could be due to:\n"
+    "• Video is private or deleted\n"
+    "• Temporary YouTube issues\n"
+    "• Network connectivity problems\n\n"
+    "Please try again or contact support."
+)
+
+@router.message(F.text.regexp(YOUTUBE_URL_RE, search=True).as_('url_match'))
 @monitor_performance
-async def handle_youtube_url(message: Message):
+async def handle_youtube_url(message: Message, state: FSMContext, url_match: re.Match):
     """Enhanced YouTube URL handler with comprehensive validation and processing"""
     if not message.from_user or not message.text:
         return
@@ -790,37 +1516,30 @@ async def handle_youtube_url(message: Message):
     user_id = message.from_user.id
     url = message.text.strip()
     
-    # Security validation
-    if not await security_check(user_id, 'process_url', message):
-        return
-    
-    # URL validation using security manager
+    # URL validation and permission check in a single security call
     if security_manager:
-        is_valid, error_msg = security_manager.is_valid_youtube_url(url)
-        if not is_valid:
-            await track_event(user_id, 'invalid_url_submitted', {'url': url, 'error': error_msg})
-            await message.reply(
-                f"❌ <b>Invalid YouTube URL</b>\n\n{error_msg}\n\n"
-                f"📝 <b>Valid formats:</b>\n"
-                f"• https://youtube.com/watch?v=VIDEO_ID\n"
-                f"• https://youtu.be/VIDEO_ID\n"
-                f"• https://m.youtube.com/watch?v=VIDEO_ID",
-                reply_markup=get_main_keyboard()
-            )
+        check = await security_manager.check_and_validate(user_id, 'process_url', url, 'url')
+        if not check['allowed']:
+            if check['stage'] == 'input':
+                track_event(user_id, 'invalid_url_submitted', {'url': url, 'error': check['reason']})
+                await message.reply(
+                    _INVALID_URL_TMPL.format(reason=check['reason']),
+                    reply_markup=get_main_keyboard()
+                )
+            else:
+                logger.warning("Security denied for user %s: %s", user_id, check['reason'])
+                await message.reply(f"🚫 Access Denied: {check['reason']}")
             return
     
     # Show processing reaction
-    try:
+    with suppress(TelegramBadRequest):
         await message.react([ReactionTypeEmoji(emoji="⏳")])
-    except:
-        pass
     
-    # Get user state and status
-    user_state = await user_manager.get_user_state(user_id)
-    user_status = await user_manager.get_user_status(user_id)
-    
-    # Check download permission
-    permission_check = await user_manager.can_user_download(user_id)
+    # Get user state, status and download permission concurrently
+    user_state, (user_status, permission_check, _) = await asyncio.gather(
+        state.get_state(),
+        get_status_bundle(user_id)
+    )
     if not permission_check['can_download']:
         await message.reply(
             f"🚫 <b>Download Limit Reached</b>\n\n{permission_check['reason']}\n\n"
@@ -830,20 +1549,24 @@ async def handle_youtube_url(message: Message):
         return
     
     # Get video information for preview
-    processing_msg = await message.reply("🔍 <b>Analyzing video...</b>\n\nPlease wait while I fetch video information...")
+    # Transient status message, edited in place below, so it is sent silently
+    processing_msg = await message.reply(
+        "🔍 <b>Analyzing video...</b>\n\nPlease wait while I fetch video information...",
+        disable_notification=True
+    )
     
     try:
-        video_info = await download_manager.get_video_info(url)
+        video_info = await download_manager.get_video_info(url, video_id=url_match.group(1))
         
         if not video_info['success']:
-            await processing_msg.edit_text(
-                f"❌ <b>Video Analysis Failed</b>\n\n{video_info['error']}\n\nPlease check the URL and try again.",
+            await safe_edit_text(processing_msg,
+                _ANALYSIS_FAILED_TMPL.format(error=html.escape(video_info['error'])),
                 reply_markup=get_main_keyboard(user_status)
             )
             return
         
         # Track successful URL processing
-        await track_event(user_id, 'valid_url_processed', {
+        track_event(user_id, 'valid_url_processed', {
             'title': video_info['title'],
             'duration': video_info['duration'],
             'uploader': video_info['uploader']
@@ -851,89 +1574,140 @@ async def handle_youtube_url(message: Message):
         
         # Format video information
         duration_str = video_info.get('duration_str', 'Unknown')
-        uploader = video_info.get('uploader', 'Unknown')
+        uploader = html_preview(video_info.get('uploader') or 'Unknown')
         view_count = video_info.get('view_count', 0)
         upload_date = video_info.get('upload_date', '')
         
         # Check video duration limits
         if video_info['duration'] > 3600:  # 1 hour
-            await processing_msg.edit_text(
-                f"⚠️ <b>Video Too Long</b>\n\n"
-                f"🎬 <b>Title:</b> {video_info['title'][:100]}...\n"
-                f"⏱️ <b>Duration:</b> {duration_str}\n\n"
-                f"❌ Videos longer than 1 hour are not supported.\n"
-                f"Please choose a shorter video.",
+            await safe_edit_text(processing_msg,
+                _VIDEO_TOO_LONG_TMPL.format(title=html_preview(video_info['title'], 100), duration=duration_str),
                 reply_markup=get_main_keyboard(user_status)
             )
             return
         
-        if user_state == "waiting_video_url":
-            # Video download mode
-            await processing_msg.edit_text(
-                f"🎬 <b>Video Ready for Download</b>\n\n"
-                f"📹 <b>Title:</b> {video_info['title'][:80]}{'...' if len(video_info['title']) > 80 else ''}\n"
-                f"👤 <b>Channel:</b> {uploader}\n"
-                f"⏱️ <b>Duration:</b> {duration_str}\n"
-                f"👀 <b>Views:</b> {view_count:,}\n"
-                f"{f'📅 <b>Uploaded:</b> {upload_date}' if upload_date else ''}\n\n"
-                f"📊 <b>Your Status:</b> {user_status['user_tier']} (Level {user_status['user_level']})\n\n"
-                f"🎯 <b>Choose video quality:</b>",
-                reply_markup=get_quality_keyboard("video", user_status['is_prime'], user_status['user_tier'])
-            )
-            await user_manager.set_user_data(user_id, "download_url", url)
-            await user_manager.set_user_data(user_id, "video_title", video_info['title'])
-            await user_manager.set_user_state(user_id, "selecting_video_quality")
-            
-        elif user_state == "waiting_audio_url":
-            # Audio download mode
-            await processing_msg.edit_text(
-                f"🎵 <b>Audio Ready for Extraction</b>\n\n"
-                f"🎼 <b>Title:</b> {video_info['title'][:80]}{'...' if len(video_info['title']) > 80 else ''}\n"
-                f"👤 <b>Channel:</b> {uploader}\n"
-                f"⏱️ <b>Duration:</b> {duration_str}\n"
-                f"👀 <b>Views:</b> {view_count:,}\n"
-                f"{f'📅 <b>Uploaded:</b> {upload_date}' if upload_date else ''}\n\n"
-                f"📊 <b>Your Status:</b> {user_status['user_tier']} (Level {user_status['user_level']})\n\n"
-                f"🎯 <b>Choose audio quality:</b>",
-                reply_markup=get_quality_keyboard("audio", user_status['is_prime'], user_status['user_tier'])
-            )
-            await user_manager.set_user_data(user_id, "download_url", url)
-            await user_manager.set_user_data(user_id, "video_title", video_info['title'])
-            await user_manager.set_user_state(user_id, "selecting_audio_quality")
+        if user_state == BotStates.waiting_video_url.state:
+            kind, next_state = 'video', BotStates.selecting_video_quality
+        elif user_state == BotStates.waiting_audio_url.state:
+            kind, next_state = 'audio', BotStates.selecting_audio_quality
+        else:
+            kind = None
+        
+        title = html_preview(video_info['title'], 80)
+        if kind:
+            # Video or audio download mode
+            header, title_icon = _MEDIA_READY_PARTS[kind]
+            await safe_edit_text(processing_msg, _MEDIA_READY_TMPL.format(
+                header=header,
+                title_icon=title_icon,
+                title=title,
+                uploader=uploader,
+                duration=duration_str,
+                view_count=view_count,
+                uploaded_line=f"📅 <b>Uploaded:</b> {upload_date}" if upload_date else "",
+                user_tier=user_status['user_tier'],
+                user_level=user_status['user_level'],
+                kind=kind
+            ), reply_markup=get_quality_keyboard(kind, user_status['is_prime'], user_status['user_tier']))
+            await state.set_data({'download_url': url, 'video_title': video_info['title']})
+            await state.set_state(next_state)
         else:
             # User sent URL without selecting download mode
-            await processing_msg.edit_text(
-                f"🔗 <b>YouTube Video Detected!</b>\n\n"
-                f"📹 <b>Title:</b> {video_info['title'][:80]}{'...' if len(video_info['title']) > 80 else ''}\n"
-                f"👤 <b>Channel:</b> {uploader}\n"
-                f"⏱️ <b>Duration:</b> {duration_str}\n\n"
-                f"Please choose download type first:",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [
-                        InlineKeyboardButton(text="🎬 Download Video", callback_data="video_download"),
-                        InlineKeyboardButton(text="🎵 Extract Audio", callback_data="audio_download")
-                    ],
-                    [InlineKeyboardButton(text="🔙 Back to Menu", callback_data="back_to_main")]
-                ])
+            await safe_edit_text(processing_msg,
+                _VIDEO_DETECTED_TMPL.format(title=title, uploader=uploader, duration=duration_str),
+                reply_markup=CHOOSE_TYPE_KB
             )
     
     except Exception as e:
-        logger.error(f"URL processing error for user {user_id}: {e}")
-        await track_event(user_id, 'url_processing_error', {'error': str(e)})
-        await processing_msg.edit_text(
-            "❌ <b>Processing Error</b>\n\n"
-            "Failed to analyze the video. This could be due to:\n"
-            "• Video is private or deleted\n"
-            "• Temporary YouTube issues\n"
-            "• Network connectivity problems\n\n"
-            "Please try again or contact support.",
+        logger.error("URL processing error for user %s: %s", user_id, e)
+        track_event(user_id, 'url_processing_error', {'error': str(e)})
+        await safe_edit_text(processing_msg, _PROCESSING_ERROR_TEXT,
             reply_markup=get_main_keyboard(user_status)
         )
 
+# Download flow messages, filled with str.format per call
+_SESSION_EXPIRED_TEXT: Final[str] = (
+    "❌ <b>Session Expired</b>\n\nNo URL found. Please start the download process again."
+)
+
+_PREMIUM_QUALITY_TMPL: Final[str] = (
+    "🔒 <b>Premium Quality Selected</b>\n\n"
+    "The quality '{quality}' is only available for Premium users.\n\n"
+    "🌟 <b>Upgrade benefits:</b>\n"
+    "• Unlimited downloads\n"
+    "• HD video quality (720p, 1080p)\n"
+    "• High-quality audio\n"
+    "• No cooldowns\n\n"
+    "Contact @chhinhlong to upgrade to Premium!"
+)
+
+_DOWNLOAD_STARTING_TMPL: Final[str] = (
+    "⏳ <b>Download Starting...</b>\n\n"
+    "🎯 <b>File:</b> {title}\n"
+    "📊 <b>Quality:</b> {quality}\n"
+    "👤 <b>User:</b> {user_tier} (Level {user_level})\n\n"
+    "{status_line}"
+    "⏱️ <b>Estimated time:</b> 15-45 seconds\n\n"
+    "Please wait, do not close this chat."
+)
+
+_DOWNLOAD_CAPTION_TMPL: Final[str] = """
+{icon} <b>Download Complete!</b>
+
+📱 <b>Quality:</b> {quality}
+📊 <b>Size:</b> {size_mb:.1f} MB
+⏱️ <b>Duration:</b> {minutes}:{seconds:02d}
+🚀 <b>Processing:</b> {download_time:.1f}s
+👤 <b>Downloaded by:</b> {user_tier} User
+
+🔗 <b>Powered by AKG Professional Technology</b>
+            """
+
+_DELIVERED_FREE_TMPL: Final[str] = (
+    "✅ <b>Download Delivered Successfully!</b>\n\n"
+    "📊 <b>Usage Update:</b>\n"
+    "• Downloads remaining: {remaining}/15\n"
+    "• Quality: {quality}\n"
+    "• Processing time: {download_time:.1f}s\n\n"
+    "⭐ Upgrade to Premium for unlimited downloads!"
+)
+
+_DELIVERED_PRIME_TMPL: Final[str] = (
+    "✅ <b>Premium Download Complete!</b>\n\n"
+    "👑 <b>Premium Benefits Active:</b>\n"
+    "• Quality: {quality}\n"
+    "• Processing time: {download_time:.1f}s\n"
+    "• Unlimited downloads remaining\n\n"
+    "Thank you for being a Premium user! 🙏"
+)
+
+_DOWNLOAD_FAILED_TMPL: Final[str] = (
+    "❌ <b>Download Failed</b>\n\n"
+    "🔍 <b>Error:</b> {error}\n\n"
+    "💡 <b>Common solutions:</b>\n"
+    "• Check if video is still available\n"
+    "• Try a different quality\n"
+    "• Wait a moment and retry\n"
+    "• Contact support if issue persists\n\n"
+    "📞 <b>Support:</b> @chhinhlong"
+)
+
+_SYSTEM_ERROR_TEXT: Final[str] = (
+    "🚨 <b>System Error</b>\n\n"
+    "A technical error occurred during processing.\n\n"
+    "🔧 <b>What happened:</b>\n"
+    "Our servers encountered an unexpected issue.\n\n"
+    "💡 <b>Next steps:</b>\n"
+    "• Try again in a few moments\n"
+    "• Contact support if error persists\n"
+    "• Check @AKGDownloaderBot for status updates\n\n"
+    "📞 <b>Technical Support:</b> @chhinhlong"
+)
+
 # Quality selection handler with enhanced processing
-@router.callback_query(F.data.startswith("quality_") | F.data.startswith("audio_"))
+@router.callback_query(F.data.in_(_QUALITY_CALLBACKS))
 @monitor_performance
-async def handle_quality_selection(callback: CallbackQuery):
+async def handle_quality_selection(callback: CallbackQuery, state: FSMContext, user_status: Dict[str, Any]):
     """Enhanced quality selection with comprehensive download processing"""
     if not callback.from_user or not callback.message or not callback.data:
         return
@@ -941,75 +1715,69 @@ async def handle_quality_selection(callback: CallbackQuery):
     user_id = callback.from_user.id
     quality = callback.data
     
-    # Security check
-    if not await security_check(user_id, 'download_file'):
+    # Security check and stored data are independent, so fetch them together
+    if security_manager:
+        allowed, fsm_data = await asyncio.gather(security_check(user_id, 'download_file'), state.get_data())
+    else:
+        allowed, fsm_data = True, await state.get_data()
+    if not allowed:
         await callback.answer("🚫 Security check failed", show_alert=True)
         return
     
-    # Get stored data
-    url = await user_manager.get_user_data(user_id, "download_url")
-    video_title = await user_manager.get_user_data(user_id, "video_title") or "YouTube Video"
-    user_status = await user_manager.get_user_status(user_id)
+    url = fsm_data.get('download_url')
+    video_title = fsm_data.get('video_title') or "YouTube Video"
     
     if not url:
-        await callback.message.edit_text(
-            "❌ <b>Session Expired</b>\n\nNo URL found. Please start the download process again.",
+        await safe_edit_text(callback.message, _SESSION_EXPIRED_TEXT,
             reply_markup=get_main_keyboard(user_status)
         )
         await callback.answer()
         return
     
     # Check premium quality restrictions
-    premium_qualities = ["quality_720p", "quality_1080p", "audio_hq"]
-    if quality in premium_qualities and not user_status['is_prime']:
+    if quality in _PREMIUM_QUALITIES and not user_status['is_prime']:
         await callback.answer("🔒 Premium quality requires upgrade!", show_alert=True)
-        await callback.message.edit_text(
-            f"🔒 <b>Premium Quality Selected</b>\n\n"
-            f"The quality '{quality.replace('quality_', '').replace('_', ' ').title()}' is only available for Premium users.\n\n"
-            f"🌟 <b>Upgrade benefits:</b>\n"
-            f"• Unlimited downloads\n"
-            f"• HD video quality (720p, 1080p)\n"
-            f"• High-quality audio\n"
-            f"• No cooldowns\n\n"
-            f"Contact @chhinhlong to upgrade to Premium!",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="⭐ Upgrade Now", callback_data="upgrade_info")],
-                [InlineKeyboardButton(text="🔙 Choose Standard Quality", callback_data="back_to_quality")]
-            ])
+        await safe_edit_text(callback.message,
+            _PREMIUM_QUALITY_TMPL.format(quality=quality_label(quality)),
+            reply_markup=PREMIUM_QUALITY_KB
         )
         return
     
     # Track download initiation
     download_type = "video" if quality.startswith("quality_") else "audio"
-    await track_event(user_id, 'download_started', {
+    track_event(user_id, 'download_started', {
         'quality': quality,
         'type': download_type,
         'title': video_title
     })
     
     # Start download process with progress tracking
-    progress_msg = await callback.message.edit_text(
-        f"⏳ <b>Download Starting...</b>\n\n"
-        f"🎯 <b>File:</b> {video_title[:50]}{'...' if len(video_title) > 50 else ''}\n"
-        f"📊 <b>Quality:</b> {quality.replace('quality_', '').replace('_', ' ').title()}\n"
-        f"👤 <b>User:</b> {user_status['user_tier']} (Level {user_status['user_level']})\n\n"
-        f"🚀 <b>Status:</b> Processing with enterprise-grade technology...\n"
-        f"⏱️ <b>Estimated time:</b> 15-45 seconds\n\n"
-        f"Please wait, do not close this chat."
-    )
-    
+    queue_position = download_queue.position()
+    status_line = (f"📋 <b>Queue position:</b> {queue_position}\n" if queue_position
+                   else "🚀 <b>Status:</b> Processing with enterprise-grade technology...\n")
+    progress_msg = await safe_edit_text(callback.message, _DOWNLOAD_STARTING_TMPL.format(
+        title=html_preview(video_title, 50),
+        quality=quality_label(quality),
+        user_tier=user_status['user_tier'],
+        user_level=user_status['user_level'],
+        status_line=status_line
+    ))
+    
+    result = None
     try:
-        # Use advanced download manager
-        start_time = time.time()
-        result = await download_manager.download_content(url, quality, user_id)
-        download_time = time.time() - start_time
+        # Use advanced download manager once a download slot is free
+        async with download_queue.slot():
+            start_time = time.monotonic()
+            result = await download_manager.download_content(url, quality, user_id)
+            download_time = time.monotonic() - start_time
         
         if result.success:
             # Update user usage and analytics
             await user_manager.update_usage(user_id, download_type, quality)
+            invalidate_user_status(user_id)
             
             # Track successful download
-            await track_event(user_id, 'download_completed', {
+            track_event(user_id, 'download_completed', {
                 'quality': quality,
                 'type': download_type,
                 'title': result.title,
@@ -1019,7 +1787,7 @@ async def handle_quality_selection(callback: CallbackQuery):
             })
             
             # Track analytics in download manager
-            await analytics_manager.track_download_event(
+            track_download(
                 user_id=user_id,
                 success=True,
                 quality=quality,
@@ -1029,26 +1797,23 @@ async def handle_quality_selection(callback: CallbackQuery):
                 download_time=download_time
             )
             
-            # Update progress message
-            await progress_msg.edit_text(
-                f"✅ <b>Processing Complete!</b>\n\n"
-                f"📤 <b>Uploading to Telegram...</b>\n"
-                f"⏱️ <b>Processing time:</b> {download_time:.1f}s\n"
-                f"📊 <b>File size:</b> {result.file_size / 1024 / 1024:.1f} MB"
-            )
+            # Upload indicator; the summary edit below replaces the old progress edit
+            fire_and_forget(callback.bot.send_chat_action(
+                chat_id=callback.message.chat.id,
+                action=ChatAction.UPLOAD_VIDEO if download_type == 'video' else ChatAction.UPLOAD_VOICE
+            ))
             
             # Send the file with comprehensive caption
-            caption = f"""
-{'🎬' if download_type == 'video' else '🎵'} <b>Download Complete!</b>
-
-📱 <b>Quality:</b> {result.quality}
-📊 <b>Size:</b> {result.file_size / 1024 / 1024:.1f} MB
-⏱️ <b>Duration:</b> {result.duration // 60}:{result.duration % 60:02d}
-🚀 <b>Processing:</b> {download_time:.1f}s
-👤 <b>Downloaded by:</b> {user_status['user_tier']} User
-
-🔗 <b>Powered by AKG Professional Technology</b>
-            """
+            minutes, seconds = divmod(result.duration, 60)
+            caption = _DOWNLOAD_CAPTION_TMPL.format(
+                icon='🎬' if download_type == 'video' else '🎵',
+                quality=result.quality,
+                size_mb=result.file_size / 1024 / 1024,
+                minutes=minutes,
+                seconds=seconds,
+                download_time=download_time,
+                user_tier=user_status['user_tier']
+            )
             
             if download_type == 'video':
                 await callback.bot.send_video(
@@ -1065,36 +1830,27 @@ async def handle_quality_selection(callback: CallbackQuery):
                     reply_markup=get_main_keyboard(user_status)
                 )
             
-            # Show usage update
-            remaining = await user_manager.get_downloads_remaining(user_id)
+            # Show usage update, the only edit after the starting message
             if not user_status['is_prime']:
-                await progress_msg.edit_text(
-                    f"✅ <b>Download Delivered Successfully!</b>\n\n"
-                    f"📊 <b>Usage Update:</b>\n"
-                    f"• Downloads remaining: {remaining}/15\n"
-                    f"• Quality: {result.quality}\n"
-                    f"• Processing time: {download_time:.1f}s\n\n"
-                    f"⭐ Upgrade to Premium for unlimited downloads!"
+                # The status was invalidated above, so this refetches once and
+                # leaves the fresh value cached for the user's next update
+                remaining = await user_manager.get_downloads_remaining(
+                    user_id, status=await get_user_status_cached(user_id)
                 )
+                await safe_edit_text(progress_msg, _DELIVERED_FREE_TMPL.format(
+                    remaining=remaining, quality=result.quality, download_time=download_time
+                ))
             else:
-                await progress_msg.edit_text(
-                    f"✅ <b>Premium Download Complete!</b>\n\n"
-                    f"👑 <b>Premium Benefits Active:</b>\n"
-                    f"• Quality: {result.quality}\n"
-                    f"• Processing time: {download_time:.1f}s\n"
-                    f"• Unlimited downloads remaining\n\n"
-                    f"Thank you for being a Premium user! 🙏"
-                )
+                await safe_edit_text(progress_msg, _DELIVERED_PRIME_TMPL.format(
+                    quality=result.quality, download_time=download_time
+                ))
             
-            # Update reaction
-            try:
-                await callback.message.react([ReactionTypeEmoji(emoji="✅")])
-            except:
-                pass
+            # Update reaction; nothing waits on it
+            fire_and_forget(callback.message.react([ReactionTypeEmoji(emoji="✅")]))
                 
         else:
             # Handle download failure
-            await track_event(user_id, 'download_failed', {
+            track_event(user_id, 'download_failed', {
                 'quality': quality,
                 'type': download_type,
                 'error': result.error,
@@ -1102,7 +1858,7 @@ async def handle_quality_selection(callback: CallbackQuery):
             })
             
             # Track failed download in analytics
-            await analytics_manager.track_download_event(
+            track_download(
                 user_id=user_id,
                 success=False,
                 quality=quality,
@@ -1110,75 +1866,47 @@ async def handle_quality_selection(callback: CallbackQuery):
                 error=result.error
             )
             
-            await progress_msg.edit_text(
-                f"❌ <b>Download Failed</b>\n\n"
-                f"🔍 <b>Error:</b> {result.error}\n\n"
-                f"💡 <b>Common solutions:</b>\n"
-                f"• Check if video is still available\n"
-                f"• Try a different quality\n"
-                f"• Wait a moment and retry\n"
-                f"• Contact support if issue persists\n\n"
-                f"📞 <b>Support:</b> @chhinhlong",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="🔄 Try Again", callback_data="retry_download")],
-                    [InlineKeyboardButton(text="🔙 Back to Menu", callback_data="back_to_main")]
-                ])
+            await safe_edit_text(progress_msg,
+                _DOWNLOAD_FAILED_TMPL.format(error=html.escape(result.error or 'Unknown error')),
+                reply_markup=DOWNLOAD_FAILED_KB
             )
             
+    except (TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter) as e:
+        # Blocked bot, closed chat or Telegram unreachable: not a system fault,
+        # and any reply would fail the same way
+        logger.warning("Could not deliver download to user %s: %s", user_id, e)
+    
     except Exception as e:
-        logger.error(f"Download processing error for user {user_id}: {e}")
+        logger.error("Download processing error for user %s: %s", user_id, e)
         
         # Track system error
-        await track_event(user_id, 'system_error', {
+        track_event(user_id, 'system_error', {
             'error': str(e),
             'context': 'download_processing'
         })
         
-        await progress_msg.edit_text(
-            f"🚨 <b>System Error</b>\n\n"
-            f"A technical error occurred during processing.\n\n"
-            f"🔧 <b>What happened:</b>\n"
-            f"Our servers encountered an unexpected issue.\n\n"
-            f"💡 <b>Next steps:</b>\n"
-            f"• Try again in a few moments\n"
-            f"• Contact support if error persists\n"
-            f"• Check @AKGDownloaderBot for status updates\n\n"
-            f"📞 <b>Technical Support:</b> @chhinhlong",
-            reply_markup=get_main_keyboard(user_status)
-        )
+        with suppress(TelegramBadRequest):
+            await safe_edit_text(progress_msg, _SYSTEM_ERROR_TEXT,
+                reply_markup=get_main_keyboard(user_status)
+            )
     
     finally:
+        # Remove the downloaded temp file now that it has been streamed out
+        download_manager.release_file(result)
+        
         # Clear user state and data
-        await user_manager.clear_user_state(user_id)
-        await user_manager.clear_user_data(user_id)
+        await clear_fsm(state)
         await callback.answer()
 
 # Additional callback handlers for enhanced features
-@router.callback_query(F.data == "back_to_main")
-@monitor_performance
-async def callback_back_to_main(callback: CallbackQuery):
-    """Enhanced back to main menu handler"""
-    if not callback.from_user or not callback.message:
-        return
-    
-    user_id = callback.from_user.id
-    await user_manager.clear_user_state(user_id)
-    await user_manager.clear_user_data(user_id)
-    
-    # Track navigation
-    await track_event(user_id, 'returned_to_main')
-    
-    # Get fresh user status
-    user_status = await user_manager.get_user_status(user_id)
-    
-    welcome_text = f"""
+_WELCOME_BACK_TMPL: Final[str] = """
 🎉 <b>Professional YouTube Downloader</b>
 
 👋 Welcome back! Choose your next action:
 
 📊 <b>Your Status:</b>
-{f"👑 Premium User ({user_status['user_tier']})" if user_status['is_prime'] else f"👤 {user_status['user_tier']} User"}
-📈 Level: {user_status['user_level']} | Score: {user_status['engagement_score']}/100
+{status_line}
+📈 Level: {user_level} | Score: {engagement_score}/100
 
 ⚡ <b>Quick Actions:</b>
 • 🎬 Download high-quality videos
@@ -1188,89 +1916,109 @@ async def callback_back_to_main(callback: CallbackQuery):
 
 🔗 <b>Enterprise-grade technology for optimal performance</b>
     """
+
+@router.callback_query(F.data == "back_to_main")
+@monitor_performance
+async def callback_back_to_main(callback: CallbackQuery, state: FSMContext, user_status: Dict[str, Any]):
+    """Enhanced back to main menu handler"""
+    if not callback.from_user or not callback.message:
+        return
     
-    await callback.message.edit_text(welcome_text, reply_markup=get_main_keyboard(user_status))
+    user_id = callback.from_user.id
+    await clear_fsm(state)
+    
+    # Track navigation
+    track_event(user_id, 'returned_to_main')
+    
+    status_line = (f"👑 Premium User ({user_status['user_tier']})" if user_status['is_prime']
+                   else f"👤 {user_status['user_tier']} User")
+    welcome_text = _WELCOME_BACK_TMPL.format_map({**user_status, 'status_line': status_line})
+    
+    await safe_edit_text(callback.message, welcome_text, reply_markup=get_main_keyboard(user_status))
     await callback.answer()
 
 # Admin command handlers with enhanced features
-@router.message(Command("stats"))
+@admin_router.message(Command("stats"))
 @monitor_performance
 async def admin_stats(message: Message):
     """Enhanced admin statistics with comprehensive metrics"""
-    if not message.from_user or message.from_user.id != ADMIN_ID:
-        await message.reply("❌ Administrative access required!")
-        return
-    
-    await track_event(message.from_user.id, 'admin_stats_accessed')
+    track_event(message.from_user.id, 'admin_stats_accessed')
     await admin_panel.handle_stats(message)
 
-@router.message(Command("setprime"))
+@admin_router.message(Command("setprime"))
 @monitor_performance
 async def admin_set_prime(message: Message):
     """Enhanced premium management"""
-    if not message.from_user or message.from_user.id != ADMIN_ID:
-        await message.reply("❌ Administrative access required!")
-        return
-    
-    await track_event(message.from_user.id, 'admin_prime_management')
+    track_event(message.from_user.id, 'admin_prime_management')
     await admin_panel.handle_set_prime(message)
+    invalidate_user_status()
 
-@router.message(Command("removeprime"))
+@admin_router.message(Command("removeprime"))
 @monitor_performance
 async def admin_remove_prime(message: Message):
     """Enhanced premium removal"""
-    if not message.from_user or message.from_user.id != ADMIN_ID:
-        await message.reply("❌ Administrative access required!")
-        return
-    
-    await track_event(message.from_user.id, 'admin_prime_removal')
+    track_event(message.from_user.id, 'admin_prime_removal')
     await admin_panel.handle_remove_prime(message)
+    invalidate_user_status()
 
-@router.message(Command("broadcast"))
+@admin_router.message(Command("broadcast"))
 @monitor_performance
 async def admin_broadcast(message: Message):
     """Enhanced broadcasting system"""
-    if not message.from_user or message.from_user.id != ADMIN_ID:
-        await message.reply("❌ Administrative access required!")
-        return
-    
-    await track_event(message.from_user.id, 'admin_broadcast_initiated')
+    track_event(message.from_user.id, 'admin_broadcast_initiated')
     await admin_panel.handle_broadcast(message)
 
 # System health and monitoring commands
-@router.message(Command("health"))
+HEALTH_SNAPSHOT_TTL = 60  # seconds a collected health report is reused
+
+async def collect_health_data() -> Dict[str, Any]:
+    """Gather health data from every manager and refresh the cached snapshot"""
+    health_data = {}
+    
+    if admin_panel:
+        health_data['admin_panel'] = await admin_panel.get_system_health()
+    
+    if download_manager:
+        health_data['download_manager'] = await download_manager.get_download_stats()
+    
+    if security_manager:
+        health_data['security'] = security_manager.get_security_metrics()
+    
+    if analytics_manager:
+        health_data['analytics'] = await analytics_manager.get_analytics_summary()
+    
+    # Bot metrics
+    uptime = time.monotonic() - metrics.start_time
+    health_data['bot_metrics'] = {
+        'uptime_seconds': uptime,
+        'uptime_formatted': f"{uptime // 3600:.0f}h {(uptime % 3600) // 60:.0f}m",
+        'total_requests': metrics.request_count,
+        'total_errors': metrics.error_count,
+        'active_users': metrics.active_user_count(),
+        'avg_response_time': metrics.avg_response_time(),
+        'p95_response_time': metrics.response_time_percentile(95),
+        'lifetime_avg_response_time': metrics.rt.mean,
+        'response_time_stdev': metrics.rt.stdev,
+        'analytics_queue_depth': analytics_queue.qsize(),
+        'dropped_events': metrics.dropped_events
+    }
+    
+    metrics.health_snapshot = health_data
+    metrics.health_snapshot_ts = time.monotonic()
+    return health_data
+
+async def get_health_data() -> Dict[str, Any]:
+    """Return the cached health snapshot, collecting a new one when stale"""
+    if (metrics.health_snapshot is not None
+            and time.monotonic() - metrics.health_snapshot_ts < HEALTH_SNAPSHOT_TTL):
+        return metrics.health_snapshot
+    return await collect_health_data()
+
+@admin_router.message(Command("health"))
 async def system_health(message: Message):
     """System health check (admin only)"""
-    if not message.from_user or message.from_user.id != ADMIN_ID:
-        await message.reply("❌ Administrative access required!")
-        return
-    
     try:
-        # Get system health from various managers
-        health_data = {}
-        
-        if admin_panel:
-            health_data['admin_panel'] = await admin_panel.get_system_health()
-        
-        if download_manager:
-            health_data['download_manager'] = await download_manager.get_download_stats()
-        
-        if security_manager:
-            health_data['security'] = security_manager.get_security_metrics()
-        
-        if analytics_manager:
-            health_data['analytics'] = await analytics_manager.get_analytics_summary()
-        
-        # Bot metrics
-        uptime = time.time() - metrics.start_time
-        health_data['bot_metrics'] = {
-            'uptime_seconds': uptime,
-            'uptime_formatted': f"{uptime // 3600:.0f}h {(uptime % 3600) // 60:.0f}m",
-            'total_requests': metrics.request_count,
-            'total_errors': metrics.error_count,
-            'active_users': len(metrics.active_users),
-            'avg_response_time': sum(metrics.response_times[-100:]) / len(metrics.response_times[-100:]) if metrics.response_times else 0
-        }
+        health_data = await get_health_data()
         
         # Format health report
         health_text = f"""
@@ -1281,6 +2029,7 @@ async def system_health(message: Message):
 ❌ <b>Errors:</b> {health_data['bot_metrics']['total_errors']}
 👥 <b>Active Users:</b> {health_data['bot_metrics']['active_users']}
 ⚡ <b>Avg Response:</b> {health_data['bot_metrics']['avg_response_time']:.3f}s
+📈 <b>P95 Response:</b> {health_data['bot_metrics']['p95_response_time']:.3f}s (σ {health_data['bot_metrics']['response_time_stdev']:.3f}s)
 
 📥 <b>Downloads:</b>
 • Total: {health_data.get('download_manager', {}).get('total_downloads', 0)}
@@ -1293,6 +2042,7 @@ async def system_health(message: Message):
 • Trust Score Avg: {health_data.get('security', {}).get('average_trust_score', 0)}
 
 📈 <b>Analytics:</b>
+• Queue: {health_data['bot_metrics']['analytics_queue_depth']} pending, {health_data['bot_metrics']['dropped_events']} dropped
 • Events (24h): {health_data.get('analytics', {}).get('event_metrics', {}).get('total_events_24h', 0)}
 • Users (24h): {health_data.get('analytics', {}).get('user_metrics', {}).get('unique_users_24h', 0)}
 
@@ -1302,26 +2052,11 @@ async def system_health(message: Message):
         await message.reply(health_text)
         
     except Exception as e:
-        logger.error(f"Health check error: {e}")
+        logger.error("Health check error: %s", e)
         await message.reply(f"❌ Health check failed: {str(e)}")
 
 # Enhanced error handler
-@router.message()
-@monitor_performance
-async def handle_unknown_message(message: Message):
-    """Enhanced unknown message handler with helpful suggestions"""
-    if not message.from_user:
-        return
-    
-    user_id = message.from_user.id
-    user_status = await user_manager.get_user_status(user_id)
-    
-    # Track unknown message
-    await track_event(user_id, 'unknown_message', {
-        'text': message.text[:100] if message.text else 'non_text_message'
-    })
-    
-    response_text = f"""
+_UNKNOWN_TMPL: Final[str] = """
 ❓ <b>I didn't understand that command</b>
 
 🤖 <b>I can help you with:</b>
@@ -1337,11 +2072,33 @@ async def handle_unknown_message(message: Message):
 • Contact @chhinhlong for support
 
 🎯 <b>Your current status:</b>
-{f"👑 Premium User ({user_status['user_tier']})" if user_status['is_prime'] else f"👤 {user_status['user_tier']} User (Level {user_status['user_level']})"}
+{status_line}
     """
+
+# Only private chats get the fallback reply; in groups, ordinary chatter would
+# otherwise cost a status lookup, an analytics event and a reply per message
+@router.message(F.text, F.chat.type == ChatType.PRIVATE)
+@monitor_performance
+async def handle_unknown_message(message: Message, user_status: Dict[str, Any]):
+    """Enhanced unknown message handler with helpful suggestions"""
+    if not message.from_user:
+        return
+    
+    user_id = message.from_user.id
+    
+    # Track unknown message
+    track_event(user_id, 'unknown_message', {'text': message.text[:100]})
+    
+    status_line = (f"👑 Premium User ({user_status['user_tier']})" if user_status['is_prime']
+                   else f"👤 {user_status['user_tier']} User (Level {user_status['user_level']})")
+    response_text = _UNKNOWN_TMPL.format(status_line=status_line)
     
     await message.reply(response_text, reply_markup=get_main_keyboard(user_status))
 
+@router.message()
+async def ignore_non_text_message(message: Message):
+    """Swallow stickers, media, group chatter and other unhandled messages without any lookups"""
+
 # Background tasks and system monitoring
 async def background_tasks():
     """Run background system tasks"""
@@ -1351,36 +2108,63 @@ async def background_tasks():
         try:
             await asyncio.sleep(300)  # Every 5 minutes
             
-            # System health monitoring
-            current_time = time.time()
-            uptime = current_time - metrics.start_time
-            
             # Log system metrics
             if metrics.request_count > 0:
                 error_rate = metrics.error_count / metrics.request_count
-                avg_response_time = sum(metrics.response_times[-100:]) / len(metrics.response_times[-100:]) if metrics.response_times else 0
+                avg_response_time = metrics.avg_response_time()
+                active_users = metrics.active_user_count()
                 
-                logger.info(f"System metrics: {len(metrics.active_users)} active users, "
-                          f"{error_rate:.3f} error rate, {avg_response_time:.3f}s avg response")
+                logger.info("System metrics: %d active users, %.3f error rate, %.3fs avg response",
+                            active_users, error_rate, avg_response_time)
                 
                 # Track system metrics in analytics
                 if analytics_manager:
-                    await analytics_manager.track_performance_metric('system_error_rate', error_rate)
-                    await analytics_manager.track_performance_metric('system_response_time', avg_response_time)
-                    await analytics_manager.track_performance_metric('system_active_users', len(metrics.active_users))
+                    await analytics_manager.track_performance_metrics({
+                        'system_error_rate': error_rate,
+                        'system_response_time': avg_response_time,
+                        'system_active_users': active_users
+                    })
             
-            # Clean up old metrics
-            if len(metrics.response_times) > 1000:
-                metrics.response_times = metrics.response_times[-500:]
-            
-            # Reset active users periodically
-            if uptime > 3600:  # After 1 hour
-                metrics.active_users.clear()
+            prune_user_status_cache()
+            await collect_health_data()
             
         except Exception as e:
-            logger.error(f"Background task error: {e}")
+            logger.error("Background task error: %s", e)
+
+# Bot command setup; the hash lives in Redis when the FSM storage uses it, so
+# every worker and every fresh container sees the last applied command set
+COMMANDS_HASH_FILE = os.path.join('db', 'bot_commands.hash')
+COMMANDS_HASH_KEY: Final[str] = 'bot:commands_hash'
+
+async def load_commands_hash() -> Optional[str]:
+    """Read the hash of the last applied command set"""
+    redis = getattr(dp.storage, 'redis', None) if dp else None
+    if redis is not None:
+        try:
+            value = await redis.get(COMMANDS_HASH_KEY)
+            return value.decode() if isinstance(value, bytes) else value
+        except Exception as e:
+            logger.warning("Could not read bot commands hash from Redis: %s", e)
+    try:
+        with open(COMMANDS_HASH_FILE) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+async def store_commands_hash(commands_hash: str):
+    """Remember the applied command set for the next start"""
+    redis = getattr(dp.storage, 'redis', None) if dp else None
+    if redis is not None:
+        try:
+            await redis.set(COMMANDS_HASH_KEY, commands_hash)
+        except Exception as e:
+            logger.warning("Could not store bot commands hash in Redis: %s", e)
+    try:
+        with open(COMMANDS_HASH_FILE, 'w') as f:
+            f.write(commands_hash)
+    except OSError as e:
+        logger.warning("Could not store bot commands hash: %s", e)
 
-# Bot command setup
 async def set_bot_commands():
     """Set up bot commands menu"""
     commands = [
@@ -1399,6 +2183,18 @@ async def set_bot_commands():
         BotCommand(command="health", description="🏥 System health (Admin)"),
     ]
     
+    # Skip the API calls when the same command set was already applied
+    payload = serialization.dumps({
+        'bot_id': CFG.bot_token.split(':', 1)[0],
+        'admin_id': CFG.admin_id,
+        'commands': [c.model_dump() for c in commands],
+        'admin_commands': [c.model_dump() for c in admin_commands]
+    }, sort_keys=True)
+    commands_hash = hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+    if await load_commands_hash() == commands_hash:
+        logger.info("Bot commands unchanged, skipping update")
+        return
+    
     # Set commands for all users
     await bot.set_my_commands(commands)
     
@@ -1406,89 +2202,133 @@ async def set_bot_commands():
     from aiogram.types import BotCommandScopeChat
     await bot.set_my_commands(
         admin_commands, 
-        scope=BotCommandScopeChat(chat_id=ADMIN_ID)
+        scope=BotCommandScopeChat(chat_id=CFG.admin_id)
     )
+    
+    await store_commands_hash(commands_hash)
 
-# Main application function
-async def main():
-    """Main application entry point with comprehensive initialization"""
-    logger.info("🚀 Starting Professional YouTube Downloader Bot...")
+@asynccontextmanager
+async def lifespan(config: Config):
+    """Own the bot session, managers and database for one run of the bot.
     
-    try:
-        # Initialize database and all managers
-        logger.info("Initializing database...")
-        await db.initialize()
-        
-        # Verify all managers are properly initialized
-        logger.info("Verifying system managers...")
-        
-        # Test database connection
-        stats = await db.get_stats()
-        logger.info(f"Database initialized: {stats.get('total_users', 0)} users")
-        
-        # Test download manager
-        download_stats = await download_manager.get_download_stats()
-        logger.info(f"Download manager initialized: {download_stats.get('max_concurrent', 0)} max concurrent")
+    Cleanup is registered as each resource comes up, so shutdown runs in
+    reverse order: stop the analytics writer, drain analytics, close the
+    database, close the session.
+    """
+    global bot, dp, rate_limiter, download_queue
+    
+    async with AsyncExitStack() as stack:
+        stack.callback(logger.info, "Bot shutdown complete")
         
-        # Test analytics if enabled
-        if analytics_manager:
-            analytics_summary = await analytics_manager.get_analytics_summary()
-            logger.info(f"Analytics manager initialized: tracking enabled")
+        # The bot session is the process-wide aiohttp connection pool
+        bot = create_bot(config)
+        stack.push_async_callback(bot.session.close)
+        rate_limiter = TokenBucketLimiter(requests=config.rate_limit_requests, period=config.rate_limit_period)
+        download_queue = DownloadQueue(config.max_concurrent_downloads)
         
-        # Test security if enabled
+        init_managers(config)
+        stack.callback(download_manager.close)
+        stack.push_async_callback(db.close)
+        dp = Dispatcher(storage=create_storage(db, config.redis_url))
+        stack.push_async_callback(dp.storage.close)
         if security_manager:
-            security_metrics = security_manager.get_security_metrics()
-            logger.info(f"Security manager initialized: {security_metrics.get('security_level', 'unknown')} level")
-        
-        # Set up bot commands
-        await set_bot_commands()
-        logger.info("Bot commands configured")
-        
-        # Register router
-        dp.include_router(router)
-        
-        # Start background tasks
-        asyncio.create_task(background_tasks())
-        
-        # Log successful initialization
-        logger.info("🎉 All systems initialized successfully!")
-        logger.info(f"Admin ID: {ADMIN_ID}")
-        logger.info(f"Max concurrent downloads: {MAX_CONCURRENT_DOWNLOADS}")
-        logger.info(f"Analytics enabled: {ENABLE_ANALYTICS}")
-        logger.info(f"Security enabled: {ENABLE_SECURITY}")
-        logger.info("Bot is now ready to serve users!")
+            stack.push_async_callback(security_manager.flush_security_logs)
+        stack.push_async_callback(admin_panel.flush_admin_actions)
+        if analytics_manager:
+            stack.push_async_callback(drain_analytics)
+            stack.push_async_callback(stop_task, asyncio.create_task(analytics_flush_loop()))
+        stack.callback(logger.info, "Shutting down bot...")
         
-        # Start polling
-        await dp.start_polling(
-            bot,
-            allowed_updates=dp.resolve_used_update_types(),
-            drop_pending_updates=True
-        )
+        # Initialize database and all managers
+        logger.info("Initializing database...")
+        await db.initialize()
         
+        yield
+
+# Main application function
+async def main():
+    """Main application entry point with comprehensive initialization"""
+    global CFG
+    
+    # Load environment variables
+    load_dotenv()
+    CFG = Config.from_env()
+    configure_logging(CFG.log_level)
+    
+    if not CFG.bot_token:
+        logger.error("BOT_TOKEN not found in environment variables")
+        sys.exit(1)
+    
+    logger.info("🚀 Starting Professional YouTube Downloader Bot...")
+    logger.info("Event loop: %s", type(asyncio.get_running_loop()).__module__)
+    
+    try:
+        async with lifespan(CFG):
+            # Verify all managers are properly initialized
+            logger.info("Verifying system managers...")
+            
+            # Test database connection
+            stats = await db.get_stats()
+            logger.info("Database initialized: %s users", stats.get('total_users', 0))
+            
+            # Test download manager
+            download_stats = await download_manager.get_download_stats()
+            logger.info("Download manager initialized: %s max concurrent", download_stats.get('max_concurrent', 0))
+            
+            # Test analytics if enabled
+            if analytics_manager:
+                analytics_summary = await analytics_manager.get_analytics_summary()
+                logger.info("Analytics manager initialized: tracking enabled")
+            
+            # Test security if enabled
+            if security_manager:
+                security_metrics = security_manager.get_security_metrics()
+                logger.info("Security manager initialized: %s level", security_metrics.get('security_level', 'unknown'))
+            
+            # Set up bot commands
+            await set_bot_commands()
+            logger.info("Bot commands configured")
+            
+            # Register routers; admin commands are matched before the catch-all handler
+            dp.include_routers(admin_router, router)
+            
+            # Start background tasks
+            asyncio.create_task(background_tasks())
+            
+            # Log successful initialization
+            logger.info("🎉 All systems initialized successfully!")
+            logger.info("Admin ID: %s", CFG.admin_id)
+            logger.info("Max concurrent downloads: %s", CFG.max_concurrent_downloads)
+            logger.info("Analytics enabled: %s", CFG.enable_analytics)
+            logger.info("Security enabled: %s", CFG.enable_security)
+            logger.info("Bot is now ready to serve users!")
+            
+            # Start polling
+            await dp.start_polling(
+                bot,
+                allowed_updates=dp.resolve_used_update_types(),
+                drop_pending_updates=True
+            )
+    
     except Exception as e:
-        logger.error(f"Failed to start bot: {e}")
+        logger.error("Failed to start bot: %s", e)
         raise
-    finally:
-        # Cleanup
-        logger.info("Shutting down bot...")
-        try:
-            await bot.session.close()
-            await db.close()
-            logger.info("Bot shutdown complete")
-        except Exception as e:
-            logger.error(f"Shutdown error: {e}")
 
 if __name__ == '__main__':
     try:
-        # Set up event loop policy for better performance
-        if sys.platform.startswith('win'):
-            asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
-        
-        # Run the bot
-        asyncio.run(main())
+        # Pick the loop directly instead of swapping the global policy:
+        # libuv where uvloop is installed (Linux/macOS), proactor on Windows
+        if uvloop is not None:
+            loop_factory = uvloop.new_event_loop
+        elif sys.platform.startswith('win'):
+            loop_factory = asyncio.ProactorEventLoop
+        else:
+            loop_factory = None
+        with asyncio.Runner(loop_factory=loop_factory) as runner:
+            runner.run(main())
         
     except KeyboardInterrupt:
         logger.info("🛑 Bot stopped by user (Ctrl+C)")
     except Exception as e:
-        logger.error(f"💥 Critical bot error: {e}")
+        logger.error("💥 Critical bot error: %s", e)
         sys.exit(1)
\ No newline at end of file
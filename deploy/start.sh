@@ -15,7 +15,6 @@ mkdir -p temp/downloads temp/processing
 
 # Set proper permissions
 echo "🔐 Setting permissions..."
-chmod +x bot/main.py
 chmod -R 755 temp/
 chmod -R 755 logs/
 
@@ -87,4 +86,4 @@ echo "🔗 Enterprise technology by AKG"
 echo "" # Empty line for readability
 
 # Start the bot with error handling
-exec python bot/main.py
\ No newline at end of file
+exec python -m bot.main
\ No newline at end of file
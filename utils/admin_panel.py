@@ -5,18 +5,104 @@ Features: Advanced user management, real-time monitoring, comprehensive analytic
 
 import logging
 import asyncio
-import json
 import time
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional, Set
+from typing import Dict, Any, List, Optional, Set, Tuple
 from aiogram import Bot
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest, TelegramRetryAfter
 import csv
 import io
+from collections import deque
+from functools import lru_cache
+
+from utils import serialization
+from utils.batch_writer import BatchWriter
+from utils.formatting import html_preview
+from utils.rate_limiter import TokenBucket
 
 logger = logging.getLogger(__name__)
 
+# Broadcasts get most of Telegram's ~30 msg/s, leaving headroom for replies to
+# users who are chatting with the bot while a broadcast runs
+BROADCAST_RATE = 20
+
+# Seconds a /stats snapshot is reused, so repeated refreshes share one query run
+STATS_CACHE_TTL = 5
+
+# Characters of a broadcast shown in its status messages
+BROADCAST_PREVIEW_LENGTH = 100
+
+# Minimum seconds between broadcast progress edits, independent of batch size
+PROGRESS_EDIT_INTERVAL = 2.0
+
+# Audit rows are written to admin_actions in batches off the command path
+AUDIT_FLUSH_INTERVAL = 1.0
+AUDIT_BATCH_SIZE = 100
+AUDIT_BACKLOG = 10000
+_AUDIT_INSERT = "INSERT INTO admin_actions (admin_id, action, target_user_id, details) VALUES (?, ?, ?, ?)"
+
+# Management keyboard under /stats; static, so built once
+_STATS_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [
+        InlineKeyboardButton(text="👥 User Management", callback_data="admin_users"),
+        InlineKeyboardButton(text="📊 Analytics", callback_data="admin_analytics")
+    ],
+    [
+        InlineKeyboardButton(text="🔄 Refresh Stats", callback_data="admin_refresh_stats"),
+        InlineKeyboardButton(text="📥 Export Data", callback_data="admin_export")
+    ],
+    [
+        InlineKeyboardButton(text="🛠️ System Health", callback_data="admin_health"),
+        InlineKeyboardButton(text="📢 Broadcast", callback_data="admin_broadcast")
+    ]
+])
+
+# Remaining static keyboards, shared by every admin command that shows them
+_PREMIUM_MENU_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📋 View Premium Users", callback_data="admin_premium_list")],
+    [InlineKeyboardButton(text="📊 Premium Analytics", callback_data="admin_premium_stats")]
+])
+_BROADCAST_MENU_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="👥 All Users", callback_data="broadcast_all")],
+    [InlineKeyboardButton(text="👑 Premium Only", callback_data="broadcast_premium")],
+    [InlineKeyboardButton(text="📊 Active Users", callback_data="broadcast_active")],
+    [InlineKeyboardButton(text="📜 Broadcast History", callback_data="broadcast_history")]
+])
+_BROADCAST_DONE_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📜 View History", callback_data="broadcast_history")]
+])
+_PREMIUM_STATS_BUTTON = InlineKeyboardButton(text="📊 Premium Stats", callback_data="admin_premium_stats")
+
+
+@lru_cache(maxsize=1024)
+def _premium_granted_keyboard(user_id: int) -> InlineKeyboardMarkup:
+    """Keyboard shown after granting premium to a user"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="👤 View User Details", callback_data=f"admin_user_{user_id}")],
+        [_PREMIUM_STATS_BUTTON]
+    ])
+
+
+@lru_cache(maxsize=1024)
+def _user_management_keyboard(user_id: int) -> InlineKeyboardMarkup:
+    """Management keyboard under a user lookup"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="👑 Grant Premium", callback_data=f"admin_grant_{user_id}"),
+            InlineKeyboardButton(text="❌ Remove Premium", callback_data=f"admin_remove_{user_id}")
+        ],
+        [
+            InlineKeyboardButton(text="📊 Full Analytics", callback_data=f"admin_analytics_{user_id}"),
+            InlineKeyboardButton(text="💬 Send Message", callback_data=f"admin_message_{user_id}")
+        ],
+        [
+            InlineKeyboardButton(text="🚫 Block User", callback_data=f"admin_block_{user_id}"),
+            InlineKeyboardButton(text="🔄 Refresh", callback_data=f"admin_refresh_{user_id}")
+        ]
+    ])
+
+
 class ProfessionalAdminPanel:
     def __init__(self, database, bot: Bot, admin_id: int, user_manager=None, 
                  download_manager=None, analytics_enabled: bool = True):
@@ -45,21 +131,31 @@ class ProfessionalAdminPanel:
         
         # Broadcast management
         self.active_broadcasts: Dict[str, Dict[str, Any]] = {}
-        self.broadcast_history: List[Dict[str, Any]] = []
+        self.broadcast_history: deque = deque(maxlen=500)
+        self.broadcast_bucket = TokenBucket(BROADCAST_RATE, BROADCAST_RATE)
+        
+        # Short-lived stats snapshot shared by concurrent dashboard refreshes
+        self._stats_cache: Tuple[float, Optional[Tuple[Dict[str, Any], Dict[str, Any]]]] = (0.0, None)
+        self._stats_lock = asyncio.Lock()
         
         # User management features
-        self.user_search_cache: Dict[str, List[Dict[str, Any]]] = {}
         self.bulk_operations: Dict[str, Dict[str, Any]] = {}
         
         # Admin activity logging
-        self.admin_actions: List[Dict[str, Any]] = []
+        self.admin_actions: deque = deque(maxlen=1000)
+        self.audit_writer: Optional[BatchWriter] = None
+        if hasattr(self.db, 'execute_many'):
+            self.audit_writer = BatchWriter(
+                self.db, _AUDIT_INSERT, 'admin audit', batch_size=AUDIT_BATCH_SIZE,
+                interval=AUDIT_FLUSH_INTERVAL, backlog=AUDIT_BACKLOG
+            )
         
-        # Performance tracking
+        # Performance tracking; bounded so samples can't pile up between resets
         self.performance_metrics = {
-            'command_response_times': [],
-            'database_query_times': [],
-            'api_call_times': [],
-            'memory_usage_history': [],
+            'command_response_times': deque(maxlen=10000),
+            'database_query_times': deque(maxlen=10000),
+            'api_call_times': deque(maxlen=10000),
+            'memory_usage_history': deque(maxlen=10000),
             'error_count_hourly': {}
         }
         
@@ -67,6 +163,8 @@ class ProfessionalAdminPanel:
         if analytics_enabled:
             asyncio.create_task(self._monitoring_task())
             asyncio.create_task(self._performance_tracking_task())
+        if self.audit_writer:
+            self.audit_writer.start()
     
     async def handle_set_prime(self, message: Message):
         """Enhanced premium management with comprehensive tracking"""
@@ -74,11 +172,6 @@ class ProfessionalAdminPanel:
             args = message.text.split()[1:]
             
             if len(args) < 1:
-                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="📋 View Premium Users", callback_data="admin_premium_list")],
-                    [InlineKeyboardButton(text="📊 Premium Analytics", callback_data="admin_premium_stats")]
-                ])
-                
                 await message.reply(
                     "🔧 <b>Premium Management</b>\n\n"
                     "<b>Usage:</b> <code>/setprime [user_id] [days] [reason]</code>\n\n"
@@ -88,7 +181,7 @@ class ProfessionalAdminPanel:
                     "• <code>/setprime 123456789 365 Annual plan</code>\n"
                     "• <code>/setprime 123456789 0 Permanent access</code>\n\n"
                     "<b>Note:</b> Use 0 days for permanent premium access",
-                    reply_markup=keyboard
+                    reply_markup=_PREMIUM_MENU_KEYBOARD
                 )
                 return
             
@@ -150,12 +243,7 @@ class ProfessionalAdminPanel:
                     f"• Early access to new features"
                 )
                 
-                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="👤 View User Details", callback_data=f"admin_user_{user_id}")],
-                    [InlineKeyboardButton(text="📊 Premium Stats", callback_data="admin_premium_stats")]
-                ])
-                
-                await message.reply(success_msg, reply_markup=keyboard)
+                await message.reply(success_msg, reply_markup=_premium_granted_keyboard(user_id))
                 
                 # Notify the user
                 try:
@@ -277,19 +365,34 @@ class ProfessionalAdminPanel:
             logger.error(f"Error in remove_prime: {e}")
             await message.reply(f"❌ An error occurred: {str(e)}")
     
+    async def _download_stats(self) -> Dict[str, Any]:
+        """Download manager stats, or an empty dict when unavailable"""
+        if not self.download_manager:
+            return {}
+        try:
+            return await self.download_manager.get_download_stats()
+        except:
+            return {}
+    
+    async def _cached_stats(self) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Database and download stats, fetched at most once per STATS_CACHE_TTL"""
+        fetched_at, cached = self._stats_cache
+        if cached is not None and time.monotonic() - fetched_at < STATS_CACHE_TTL:
+            return cached
+        async with self._stats_lock:
+            # Another refresh may have filled the cache while we waited
+            fetched_at, cached = self._stats_cache
+            if cached is not None and time.monotonic() - fetched_at < STATS_CACHE_TTL:
+                return cached
+            cached = tuple(await asyncio.gather(self.db.get_stats(), self._download_stats()))
+            self._stats_cache = (time.monotonic(), cached)
+            return cached
+    
     async def handle_stats(self, message: Message):
         """Enhanced statistics with comprehensive metrics"""
         try:
-            # Get comprehensive stats
-            db_stats = await self.db.get_stats()
-            
-            # Get download manager stats if available
-            download_stats = {}
-            if self.download_manager:
-                try:
-                    download_stats = await self.download_manager.get_download_stats()
-                except:
-                    pass
+            # Get comprehensive stats, shared with other recent refreshes
+            db_stats, download_stats = await self._cached_stats()
             
             # Calculate additional metrics
             total_users = db_stats.get('total_users', 0)
@@ -306,58 +409,52 @@ class ProfessionalAdminPanel:
             total_downloads = successful + failed
             success_rate = (successful / max(total_downloads, 1)) * 100
             
-            stats_text = f"""
-📊 <b>Bot Statistics Dashboard</b>
-
-👥 <b>User Analytics:</b>
-• Total Users: {total_users:,}
-• Active (24h): {db_stats.get('active_24h', 0):,}
-• Premium Users: {prime_users:,} ({prime_percentage:.1f}%)
-• Standard Users: {normal_users:,}
-
-📈 <b>Download Analytics:</b>
-• Total Downloads: {total_downloads:,}
-• Successful: {successful:,}
-• Failed: {failed:,}
-• Success Rate: {success_rate:.1f}%
-• Downloads (24h): {db_stats.get('downloads_24h', 0):,}
-
-🎬 <b>Content Distribution:</b>
-• Video Downloads: {db_stats.get('video_downloads', 0):,}
-• Audio Downloads: {db_stats.get('audio_downloads', 0):,}
-
-⚡ <b>Performance Metrics:</b>
-• Avg Download Time: {db_stats.get('avg_download_time', 0):.2f}s
-• Active Downloads: {download_stats.get('active_downloads', 0)}
-• Max Concurrent: {download_stats.get('max_concurrent', 5)}
-
-💾 <b>Database Performance:</b>
-• Query Count: {db_stats.get('database_performance', {}).get('query_count', 0):,}
-• Cache Hit Rate: {db_stats.get('database_performance', {}).get('cache_hit_rate', 0):.1f}%
-• Avg Query Time: {db_stats.get('database_performance', {}).get('avg_query_time', 0):.4f}s
-
-🔧 <b>System Status:</b>
-• Bot Status: {uptime}
-• Last Updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-            """
-            
-            # Create management keyboard
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [
-                    InlineKeyboardButton(text="👥 User Management", callback_data="admin_users"),
-                    InlineKeyboardButton(text="📊 Analytics", callback_data="admin_analytics")
-                ],
-                [
-                    InlineKeyboardButton(text="🔄 Refresh Stats", callback_data="admin_refresh_stats"),
-                    InlineKeyboardButton(text="📥 Export Data", callback_data="admin_export")
-                ],
-                [
-                    InlineKeyboardButton(text="🛠️ System Health", callback_data="admin_health"),
-                    InlineKeyboardButton(text="📢 Broadcast", callback_data="admin_broadcast")
+            lines = [
+                "📊 <b>Bot Statistics Dashboard</b>",
+                "",
+                "👥 <b>User Analytics:</b>",
+                f"• Total Users: {total_users:,}",
+                f"• Active (24h): {db_stats.get('active_24h', 0):,}",
+                f"• Premium Users: {prime_users:,} ({prime_percentage:.1f}%)",
+                f"• Standard Users: {normal_users:,}",
+                "",
+                "📈 <b>Download Analytics:</b>",
+                f"• Total Downloads: {total_downloads:,}",
+                f"• Successful: {successful:,}",
+                f"• Failed: {failed:,}",
+                f"• Success Rate: {success_rate:.1f}%",
+                f"• Downloads (24h): {db_stats.get('downloads_24h', 0):,}",
+                "",
+                "🎬 <b>Content Distribution:</b>",
+                f"• Video Downloads: {db_stats.get('video_downloads', 0):,}",
+                f"• Audio Downloads: {db_stats.get('audio_downloads', 0):,}",
+                "",
+                "⚡ <b>Performance Metrics:</b>",
+                f"• Avg Download Time: {db_stats.get('avg_download_time', 0):.2f}s",
+                f"• Active Downloads: {download_stats.get('active_downloads', 0)}",
+                f"• Max Concurrent: {download_stats.get('max_concurrent', 5)}",
+                "",
+            ]
+            
+            # Database section only when the manager reports it
+            db_perf = db_stats.get('database_performance')
+            if db_perf:
+                lines += [
+                    "💾 <b>Database Performance:</b>",
+                    f"• Query Count: {db_perf.get('query_count', 0):,}",
+                    f"• Cache Hit Rate: {db_perf.get('cache_hit_rate', 0):.1f}%",
+                    f"• Avg Query Time: {db_perf.get('avg_query_time', 0):.4f}s",
+                    "",
                 ]
-            ])
             
-            await message.reply(stats_text, reply_markup=keyboard)
+            lines += [
+                "🔧 <b>System Status:</b>",
+                f"• Bot Status: {uptime}",
+                f"• Last Updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+            ]
+            stats_text = "\n".join(lines)
+            
+            await message.reply(stats_text, reply_markup=_STATS_KEYBOARD)
             
         except Exception as e:
             logger.error(f"Error getting stats: {e}")
@@ -369,13 +466,6 @@ class ProfessionalAdminPanel:
             command_parts = message.text.split(' ', 1)
             
             if len(command_parts) < 2:
-                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="👥 All Users", callback_data="broadcast_all")],
-                    [InlineKeyboardButton(text="👑 Premium Only", callback_data="broadcast_premium")],
-                    [InlineKeyboardButton(text="📊 Active Users", callback_data="broadcast_active")],
-                    [InlineKeyboardButton(text="📜 Broadcast History", callback_data="broadcast_history")]
-                ])
-                
                 await message.reply(
                     "📢 <b>Broadcast Management</b>\n\n"
                     "<b>Usage:</b> <code>/broadcast [message]</code>\n\n"
@@ -387,7 +477,7 @@ class ProfessionalAdminPanel:
                     "<b>Example:</b>\n"
                     "<code>/broadcast 🎉 New features added! Check them out with /help</code>\n\n"
                     "Choose a target group or send a custom message:",
-                    reply_markup=keyboard
+                    reply_markup=_BROADCAST_MENU_KEYBOARD
                 )
                 return
             
@@ -398,10 +488,10 @@ class ProfessionalAdminPanel:
                 await message.reply("❌ Broadcast message too short. Minimum 5 characters required.")
                 return
             
-            # Get target users (all users by default)
-            user_ids = await self.db.get_all_users()
+            # Count target users (all users by default); the IDs are paged in while sending
+            total_users = await self.db.count_broadcast_users()
             
-            if not user_ids:
+            if not total_users:
                 await message.reply("❌ No users found to broadcast to.")
                 return
             
@@ -409,7 +499,7 @@ class ProfessionalAdminPanel:
             broadcast_id = f"broadcast_{int(time.time())}"
             self.active_broadcasts[broadcast_id] = {
                 'message': broadcast_message,
-                'total_users': len(user_ids),
+                'total_users': total_users,
                 'sent': 0,
                 'failed': 0,
                 'start_time': datetime.now(),
@@ -420,26 +510,44 @@ class ProfessionalAdminPanel:
             # Send confirmation
             confirm_msg = await message.reply(
                 f"📢 <b>Broadcasting Message...</b>\n\n"
-                f"📝 <b>Message:</b> {broadcast_message[:100]}{'...' if len(broadcast_message) > 100 else ''}\n"
-                f"👥 <b>Target Users:</b> {len(user_ids):,}\n"
+                f"📝 <b>Message:</b> {html_preview(broadcast_message, BROADCAST_PREVIEW_LENGTH)}\n"
+                f"👥 <b>Target Users:</b> {total_users:,}\n"
                 f"🔄 <b>Status:</b> Starting...\n\n"
                 f"⏳ <i>This may take several minutes...</i>",
                 reply_markup=InlineKeyboardMarkup(inline_keyboard=[
                     [InlineKeyboardButton(text="📊 View Progress", callback_data=f"broadcast_progress_{broadcast_id}")]
-                ])
+                ]),
+                disable_notification=True  # Progress message, edited as the broadcast runs
             )
             
             # Start broadcast in background
             asyncio.create_task(self._execute_broadcast(
-                broadcast_id, broadcast_message, user_ids, confirm_msg.message_id, message.chat.id
+                broadcast_id, broadcast_message, total_users, confirm_msg.message_id, message.chat.id
             ))
             
         except Exception as e:
             logger.error(f"Error in broadcast: {e}")
             await message.reply(f"❌ Broadcast error: {str(e)}")
     
+    async def _send_one(self, user_id: int, text: str) -> Optional[bool]:
+        """Send one broadcast message; None means flood control ran out of retries"""
+        await self.broadcast_bucket.acquire()
+        try:
+            await self.bot.send_message(user_id, text)
+            return True
+        except TelegramRetryAfter as e:
+            logger.debug(f"Flood control for user {user_id}, retrying after {e.retry_after}s")
+            return None
+        except TelegramForbiddenError:
+            logger.debug(f"User {user_id} blocked the bot")
+        except TelegramBadRequest as e:
+            logger.debug(f"Bad request for user {user_id}: {e}")
+        except Exception as e:
+            logger.warning(f"Failed to send to user {user_id}: {e}")
+        return False
+    
     async def _execute_broadcast(self, broadcast_id: str, message_text: str, 
-                               user_ids: List[int], confirm_msg_id: int, chat_id: int):
+                               total_users: int, confirm_msg_id: int, chat_id: int):
         """Execute broadcast with progress tracking"""
         try:
             broadcast_info = self.active_broadcasts[broadcast_id]
@@ -449,60 +557,78 @@ class ProfessionalAdminPanel:
             failed_count = 0
             batch_size = 30  # Send in batches to avoid rate limits
             
-            for i in range(0, len(user_ids), batch_size):
-                batch = user_ids[i:i + batch_size]
-                
-                # Send to batch
-                for user_id in batch:
-                    try:
-                        formatted_message = (
-                            f"📢 <b>Announcement</b>\n\n"
-                            f"{message_text}\n\n"
-                            f"<i>From: YouTube Downloader Bot Administration</i>"
-                        )
-                        
-                        await self.bot.send_message(user_id, formatted_message)
+            # Identical for every recipient, so build both texts once
+            formatted_message = (
+                f"📢 <b>Announcement</b>\n\n"
+                f"{message_text}\n\n"
+                f"<i>From: YouTube Downloader Bot Administration</i>"
+            )
+            message_preview = html_preview(message_text, BROADCAST_PREVIEW_LENGTH)
+            progress_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="🔄 Refresh", callback_data=f"broadcast_progress_{broadcast_id}")]
+            ])
+            
+            retry_ids: List[int] = []
+            last_progress_text = ""
+            last_edit = 0.0
+            
+            # Page through recipients so memory stays at one batch of IDs
+            async for batch in self.db.iter_user_ids(batch_size):
+                # Send the batch concurrently, paced by the broadcast bucket;
+                # flood-limited recipients are retried once at the end
+                results = await asyncio.gather(
+                    *(self._send_one(user_id, formatted_message) for user_id in batch)
+                )
+                for user_id, result in zip(batch, results):
+                    if result is None:
+                        retry_ids.append(user_id)
+                    elif result:
                         success_count += 1
-                        
-                        # Small delay to avoid rate limits
-                        await asyncio.sleep(0.05)
-                        
-                    except TelegramForbiddenError:
-                        failed_count += 1
-                        logger.debug(f"User {user_id} blocked the bot")
-                    except TelegramBadRequest as e:
-                        failed_count += 1
-                        logger.debug(f"Bad request for user {user_id}: {e}")
-                    except Exception as e:
+                    else:
                         failed_count += 1
-                        logger.warning(f"Failed to send to user {user_id}: {e}")
                 
                 # Update progress
                 broadcast_info['sent'] = success_count
                 broadcast_info['failed'] = failed_count
                 
-                # Update progress message every few batches
-                if i % (batch_size * 3) == 0 or i + batch_size >= len(user_ids):
-                    try:
-                        progress_percent = ((success_count + failed_count) / len(user_ids)) * 100
-                        await self.bot.edit_message_text(
-                            chat_id=chat_id,
-                            message_id=confirm_msg_id,
-                            text=f"📢 <b>Broadcasting Progress</b>\n\n"
-                                 f"📝 <b>Message:</b> {message_text[:100]}{'...' if len(message_text) > 100 else ''}\n"
-                                 f"📊 <b>Progress:</b> {progress_percent:.1f}% complete\n"
-                                 f"✅ <b>Sent:</b> {success_count:,}\n"
-                                 f"❌ <b>Failed:</b> {failed_count:,}\n"
-                                 f"👥 <b>Remaining:</b> {len(user_ids) - success_count - failed_count:,}",
-                            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                                [InlineKeyboardButton(text="🔄 Refresh", callback_data=f"broadcast_progress_{broadcast_id}")]
-                            ])
-                        )
-                    except:
-                        pass
-                
-                # Batch delay
-                await asyncio.sleep(1)
+                # Update the progress message on a wall-clock cadence, and
+                # skip edits Telegram would reject as "message is not modified"
+                now = time.monotonic()
+                if now - last_edit < PROGRESS_EDIT_INTERVAL:
+                    continue
+                progress_percent = min(100.0, ((success_count + failed_count) / total_users) * 100)
+                progress_text = (
+                    f"📢 <b>Broadcasting Progress</b>\n\n"
+                    f"📝 <b>Message:</b> {message_preview}\n"
+                    f"📊 <b>Progress:</b> {progress_percent:.1f}% complete\n"
+                    f"✅ <b>Sent:</b> {success_count:,}\n"
+                    f"❌ <b>Failed:</b> {failed_count:,}\n"
+                    f"👥 <b>Remaining:</b> {max(0, total_users - success_count - failed_count):,}"
+                )
+                if progress_text == last_progress_text:
+                    continue
+                last_edit = now
+                try:
+                    await self.bot.edit_message_text(
+                        chat_id=chat_id,
+                        message_id=confirm_msg_id,
+                        text=progress_text,
+                        reply_markup=progress_keyboard
+                    )
+                    last_progress_text = progress_text
+                except:
+                    pass
+            
+            if retry_ids:
+                results = await asyncio.gather(
+                    *(self._send_one(user_id, formatted_message) for user_id in retry_ids)
+                )
+                sent = sum(1 for result in results if result)
+                success_count += sent
+                failed_count += len(retry_ids) - sent
+            
+            # Users may join or leave mid-broadcast, so report what was attempted
+            total_users = max(1, success_count + failed_count)
             
             # Final update
             broadcast_info['status'] = 'completed'
@@ -514,10 +640,10 @@ class ProfessionalAdminPanel:
                 'id': broadcast_id,
                 'message': message_text,
                 'admin_id': self.admin_id,
-                'total_users': len(user_ids),
+                'total_users': total_users,
                 'sent': success_count,
                 'failed': failed_count,
-                'success_rate': (success_count / len(user_ids)) * 100,
+                'success_rate': (success_count / total_users) * 100,
                 'duration': duration,
                 'timestamp': broadcast_info['start_time'].isoformat()
             })
@@ -528,7 +654,7 @@ class ProfessionalAdminPanel:
                 action="broadcast_message",
                 details={
                     'broadcast_id': broadcast_id,
-                    'total_users': len(user_ids),
+                    'total_users': total_users,
                     'successful': success_count,
                     'failed': failed_count,
                     'duration': duration
@@ -541,15 +667,13 @@ class ProfessionalAdminPanel:
                 message_id=confirm_msg_id,
                 text=f"✅ <b>Broadcast Complete!</b>\n\n"
                      f"📊 <b>Final Results:</b>\n"
-                     f"• Total Users: {len(user_ids):,}\n"
+                     f"• Total Users: {total_users:,}\n"
                      f"• Successfully Sent: {success_count:,}\n"
                      f"• Failed: {failed_count:,}\n"
-                     f"• Success Rate: {(success_count / len(user_ids)) * 100:.1f}%\n"
+                     f"• Success Rate: {(success_count / total_users) * 100:.1f}%\n"
                      f"• Duration: {duration:.1f} seconds\n\n"
                      f"📝 <b>Message:</b> {message_text}",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="📜 View History", callback_data="broadcast_history")]
-                ])
+                reply_markup=_BROADCAST_DONE_KEYBOARD
             )
             
             # Clean up
@@ -593,13 +717,8 @@ class ProfessionalAdminPanel:
                         await message.reply(f"❌ User {user_id} not found.")
                         return
                     
-                    # Get additional analytics if user manager available
-                    analytics = {}
-                    if self.user_manager:
-                        try:
-                            analytics = await self.user_manager.get_user_analytics(user_id)
-                        except:
-                            pass
+                    # Only for known users: the analytics path initializes missing ones
+                    analytics = await self._user_analytics(user_id)
                     
                     # Format user details
                     user_display = f"@{user_info.get('username', 'N/A')}" if user_info.get('username') else "No username"
@@ -631,23 +750,7 @@ class ProfessionalAdminPanel:
 • Session Count: {analytics.get('engagement_metrics', {}).get('session_count', 0)}
                     """
                     
-                    # Create management keyboard
-                    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                        [
-                            InlineKeyboardButton(text="👑 Grant Premium", callback_data=f"admin_grant_{user_id}"),
-                            InlineKeyboardButton(text="❌ Remove Premium", callback_data=f"admin_remove_{user_id}")
-                        ],
-                        [
-                            InlineKeyboardButton(text="📊 Full Analytics", callback_data=f"admin_analytics_{user_id}"),
-                            InlineKeyboardButton(text="💬 Send Message", callback_data=f"admin_message_{user_id}")
-                        ],
-                        [
-                            InlineKeyboardButton(text="🚫 Block User", callback_data=f"admin_block_{user_id}"),
-                            InlineKeyboardButton(text="🔄 Refresh", callback_data=f"admin_refresh_{user_id}")
-                        ]
-                    ])
-                    
-                    await message.reply(user_details, reply_markup=keyboard)
+                    await message.reply(user_details, reply_markup=_user_management_keyboard(user_id))
                     
                 except ValueError:
                     await message.reply("❌ Invalid user ID. Please provide a valid number.")
@@ -656,16 +759,27 @@ class ProfessionalAdminPanel:
             logger.error(f"Error in user search: {e}")
             await message.reply(f"❌ Search error: {str(e)}")
     
+    async def _user_analytics(self, user_id: int) -> Dict[str, Any]:
+        """User manager analytics, or an empty dict when unavailable"""
+        if not self.user_manager:
+            return {}
+        try:
+            return await self.user_manager.get_user_analytics(user_id)
+        except:
+            return {}
+    
     async def get_user_details(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Get comprehensive user details for admin"""
         try:
-            user = await self.db.get_user(user_id)
+            # Independent lookups, run together on the connection pool
+            user, prime_status, download_stats = await asyncio.gather(
+                self.db.get_user(user_id),
+                self.db.check_prime_status(user_id),
+                self.db.get_download_stats(user_id)
+            )
             if not user:
                 return None
             
-            prime_status = await self.db.check_prime_status(user_id)
-            download_stats = await self.db.get_download_stats(user_id)
-            
             return {
                 'user_id': user['user_id'],
                 'username': user.get('username'),
@@ -697,25 +811,25 @@ class ProfessionalAdminPanel:
                 'ip_address': 'telegram_bot'  # Could be enhanced with actual IP tracking
             }
             
-            # Store in memory (could be enhanced with database storage)
+            # Store in memory; the deque keeps the last 1000 actions
             self.admin_actions.append(action_log)
             
-            # Keep only last 1000 actions in memory
-            if len(self.admin_actions) > 1000:
-                self.admin_actions = self.admin_actions[-1000:]
-            
-            # Log to database if available
-            if hasattr(self.db, 'execute_query'):
-                await self.db.execute_query("""
-                    INSERT INTO admin_actions (admin_id, action, target_user_id, details)
-                    VALUES (?, ?, ?, ?)
-                """, (admin_id, action, target_user_id, json.dumps(details or {})))
+            # Queue for the batched writer, or write directly without one
+            row = (admin_id, action, target_user_id, serialization.dumps(details or {}))
+            if self.audit_writer:
+                self.audit_writer.put(row)
+            elif hasattr(self.db, 'execute_query'):
+                await self.db.execute_query(_AUDIT_INSERT, row)
             
             logger.info(f"Admin action logged: {action} by {admin_id} on {target_user_id}")
             
         except Exception as e:
             logger.error(f"Error logging admin action: {e}")
     
+    async def flush_admin_actions(self) -> int:
+        """Stop the audit writer and store every queued admin action"""
+        return await self.audit_writer.stop() if self.audit_writer else 0
+    
     async def _monitoring_task(self):
         """Background monitoring for system health and alerts"""
         while True:
@@ -755,7 +869,7 @@ class ProfessionalAdminPanel:
                     logger.info(f"Performance: Avg response time: {avg_response_time:.3f}s")
                 
                 # Reset counters
-                self.performance_metrics['command_response_times'] = []
+                self.performance_metrics['command_response_times'].clear()
                 
             except Exception as e:
                 logger.error(f"Performance tracking error: {e}")
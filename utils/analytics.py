@@ -9,12 +9,18 @@ import asyncio
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional, Tuple
 from collections import defaultdict, deque
-import json
+import math
+import hashlib
 import statistics
 from dataclasses import dataclass, asdict
 
+from utils import serialization
+
 logger = logging.getLogger(__name__)
 
+# A user counts as active for this long after their last event
+ACTIVE_USER_TTL = 3600
+
 @dataclass
 class UserEvent:
     """User event data structure"""
@@ -33,6 +39,52 @@ class PerformanceMetric:
     timestamp: datetime
     metadata: Dict[str, Any] = None
 
+class HyperLogLog:
+    """Fixed-memory distinct counter for user cardinality estimates"""
+    
+    __slots__ = ('p', 'm', 'alpha', 'registers')
+    
+    def __init__(self, error_rate: float = 0.01):
+        # Standard error of HyperLogLog is 1.04 / sqrt(m)
+        self.p = max(4, min(16, math.ceil(math.log2((1.04 / error_rate) ** 2))))
+        self.m = 1 << self.p
+        self.alpha = 0.7213 / (1 + 1.079 / self.m)
+        self.registers = bytearray(self.m)
+    
+    def add(self, item: Any):
+        """Register an item in the sketch"""
+        x = int.from_bytes(hashlib.blake2b(str(item).encode(), digest_size=8).digest(), 'big')
+        bits = 64 - self.p
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+        idx = x >> bits
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+    
+    def cardinality(self) -> int:
+        """Estimate the number of distinct items added"""
+        m = self.m
+        estimate = self.alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        if estimate <= 2.5 * m:
+            zeros = self.registers.count(0)
+            if zeros:
+                estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+    
+    def clear(self):
+        self.registers = bytearray(self.m)
+    
+    def union(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        """Return a new sketch counting items seen by either sketch"""
+        if other.p != self.p:
+            raise ValueError("Cannot merge HyperLogLog sketches of different precision")
+        merged = HyperLogLog.__new__(HyperLogLog)
+        merged.p, merged.m, merged.alpha = self.p, self.m, self.alpha
+        merged.registers = bytearray(map(max, self.registers, other.registers))
+        return merged
+    
+    def __len__(self) -> int:
+        return self.cardinality()
+
 class AnalyticsManager:
     def __init__(self, database, enable_detailed_tracking: bool = True,
                  retention_days: int = 30, aggregation_interval: int = 300):
@@ -54,7 +106,7 @@ class AnalyticsManager:
         
         # User behavior analytics
         self.user_sessions: Dict[int, Dict[str, Any]] = {}
-        self.user_journeys: Dict[int, List[str]] = defaultdict(list)
+        self.user_journeys: Dict[int, deque] = defaultdict(lambda: deque(maxlen=50))
         self.command_sequences: List[List[str]] = []
         
         # Download analytics
@@ -64,8 +116,8 @@ class AnalyticsManager:
             'failed_downloads': 0,
             'quality_distribution': defaultdict(int),
             'format_distribution': defaultdict(int),
-            'duration_stats': [],
-            'file_size_stats': [],
+            'duration_stats': deque(maxlen=1000),
+            'file_size_stats': deque(maxlen=1000),
             'download_times': deque(maxlen=1000)
         }
         
@@ -82,7 +134,7 @@ class AnalyticsManager:
         
         # Real-time dashboard data
         self.real_time_stats = {
-            'active_users_now': set(),
+            'active_users_now': {},  # user_id -> last seen (monotonic), oldest first
             'downloads_last_hour': 0,
             'errors_last_hour': 0,
             'avg_response_time': 0,
@@ -140,12 +192,12 @@ class AnalyticsManager:
             self.hourly_events[event_type][current_hour] += 1
             
             # Track user journey
-            self.user_journeys[user_id].append(event_type)
-            if len(self.user_journeys[user_id]) > 50:  # Keep last 50 events per user
-                self.user_journeys[user_id] = self.user_journeys[user_id][-50:]
+            self.user_journeys[user_id].append(event_type)  # deque keeps the last 50
             
-            # Update real-time stats
-            self.real_time_stats['active_users_now'].add(user_id)
+            # Update real-time stats; reinsert so the dict stays ordered by last seen
+            active_users = self.real_time_stats['active_users_now']
+            active_users.pop(user_id, None)
+            active_users[user_id] = time.monotonic()
             
             # Business intelligence tracking
             await self._update_business_metrics(user_id, event_type, data)
@@ -187,6 +239,41 @@ class AnalyticsManager:
             logger.error(f"Error tracking performance metric: {e}")
             return False
     
+    async def track_performance_metrics(self, values: Dict[str, float],
+                                      metadata: Dict[str, Any] = None) -> int:
+        """Track several performance metrics sharing one timestamp"""
+        try:
+            timestamp = datetime.now()
+            metadata = metadata or {}
+            self.performance_metrics.extend(
+                PerformanceMetric(metric_name=name, value=value, timestamp=timestamp, metadata=metadata)
+                for name, value in values.items()
+            )
+            
+            for name, value in values.items():
+                if name.endswith('_response_time'):
+                    self.response_times[name].append(value)
+            
+            return len(values)
+            
+        except Exception as e:
+            logger.error(f"Error tracking performance metrics: {e}")
+            return 0
+    
+    async def track_batch(self, events: List[Tuple]) -> int:
+        """Apply a batch of queued events, returning how many were tracked"""
+        tracked = 0
+        for kind, *args in events:
+            if kind == 'user_event':
+                tracked += await self.track_user_event(*args)
+            elif kind == 'performance_metric':
+                tracked += await self.track_performance_metric(*args)
+            elif kind == 'download_event':
+                tracked += await self.track_download_event(**args[0])
+            else:
+                logger.warning(f"Unknown analytics event kind: {kind}")
+        return tracked
+    
     async def track_download_event(self, user_id: int, success: bool, 
                                  quality: str = "", file_type: str = "",
                                  duration: int = 0, file_size: int = 0,
@@ -207,13 +294,9 @@ class AnalyticsManager:
                 
                 if duration > 0:
                     self.download_metrics['duration_stats'].append(duration)
-                    if len(self.download_metrics['duration_stats']) > 1000:
-                        self.download_metrics['duration_stats'] = self.download_metrics['duration_stats'][-1000:]
                 
                 if file_size > 0:
                     self.download_metrics['file_size_stats'].append(file_size)
-                    if len(self.download_metrics['file_size_stats']) > 1000:
-                        self.download_metrics['file_size_stats'] = self.download_metrics['file_size_stats'][-1000:]
                 
                 if download_time > 0:
                     self.download_metrics['download_times'].append(download_time)
@@ -443,7 +526,7 @@ class AnalyticsManager:
             engagement_score = self._calculate_user_engagement_score(user_id, user_events)
             
             # User journey analysis
-            journey = self.user_journeys.get(user_id, [])
+            journey = list(self.user_journeys.get(user_id, ()))
             
             return {
                 'user_id': user_id,
@@ -618,7 +701,7 @@ class AnalyticsManager:
                         await self.db.execute_query("""
                             INSERT INTO analytics_hourly (hour, data, created_at)
                             VALUES (?, ?, ?)
-                        """, (current_hour, json.dumps(hourly_summary), datetime.now()))
+                        """, (current_hour, serialization.dumps(hourly_summary), datetime.now()))
                     except:
                         pass  # Don't fail on database errors
                 
@@ -696,15 +779,22 @@ class AnalyticsManager:
                 if all_times:
                     self.real_time_stats['avg_response_time'] = statistics.mean(all_times)
             
-            # Clean up active users (remove inactive)
-            self.real_time_stats['active_users_now'] = {
-                user_id for user_id in self.real_time_stats['active_users_now']
-                if any(e.user_id == user_id and e.timestamp > last_hour for e in recent_events)
-            }
+            # Expire inactive users from the oldest end
+            self._prune_active_users()
             
         except Exception as e:
             logger.error(f"Error updating real-time stats: {e}")
     
+    def _prune_active_users(self):
+        """Drop users whose last event is older than ACTIVE_USER_TTL"""
+        active_users = self.real_time_stats['active_users_now']
+        cutoff = time.monotonic() - ACTIVE_USER_TTL
+        while active_users:
+            user_id = next(iter(active_users))
+            if active_users[user_id] >= cutoff:
+                break
+            del active_users[user_id]
+    
     async def _cleanup_task(self):
         """Background task to clean up old analytics data"""
         while True:
@@ -798,7 +888,7 @@ class AnalyticsManager:
                     'events': [asdict(event) for event in filtered_events],
                     'summary': await self.get_analytics_summary()
                 }
-                return json.dumps(export_data, indent=2, default=str)
+                return serialization.dumps(export_data, indent=True)
             
             elif format_type == 'csv':
                 # Simple CSV export
@@ -807,13 +897,13 @@ class AnalyticsManager:
                 output.write('timestamp,user_id,event_type,data\n')
                 
                 for event in filtered_events:
-                    output.write(f'{event.timestamp},{event.user_id},{event.event_type},"{json.dumps(event.data)}"\n')
+                    output.write(f'{event.timestamp},{event.user_id},{event.event_type},"{serialization.dumps(event.data)}"\n')
                 
                 return output.getvalue()
             
             else:
-                return json.dumps({'error': f'Unsupported format: {format_type}'})
+                return serialization.dumps({'error': f'Unsupported format: {format_type}'})
                 
         except Exception as e:
             logger.error(f"Error exporting analytics data: {e}")
-            return json.dumps({'error': str(e)})
\ No newline at end of file
+            return serialization.dumps({'error': str(e)})
\ No newline at end of file
@@ -0,0 +1,116 @@
+"""
+Batched Database Writer for Telegram YouTube Downloader Bot
+Features: Bounded asyncio.Queue of rows for one INSERT, execute_many batches by
+size or interval, logged drops on overflow, failed batches requeued
+"""
+
+import asyncio
+import logging
+from contextlib import suppress
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter:
+    """Queue rows for one write statement and store them in batches.
+
+    Callers enqueue without awaiting; the background task writes a batch once
+    `batch_size` rows are waiting or `interval` seconds after the first one
+    arrived. Rows are never dropped silently: overflow is logged row by row,
+    and a failed batch goes back on the queue for the next attempt.
+    """
+
+    def __init__(self, db, query: str, name: str, batch_size: int = 100,
+                 interval: float = 1.0, backlog: int = 10000):
+        self.db = db
+        self.query = query
+        self.name = name
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=backlog)
+        self.dropped = 0
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: Optional[asyncio.Future] = None
+
+    def put(self, row: tuple) -> bool:
+        """Queue a row without waiting, logging it if the backlog is full"""
+        try:
+            self.queue.put_nowait(row)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"{self.name} backlog full, dropped row: {row}")
+            return False
+
+    def _take(self, batch: List[tuple]) -> List[tuple]:
+        """Move queued rows into the batch until it is full or the queue is empty"""
+        while len(batch) < self.batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _write(self, rows: List[tuple]) -> bool:
+        """Write one batch, requeueing its rows if the write fails"""
+        try:
+            await self.db.execute_many(self.query, rows)
+            return True
+        except Exception as e:
+            logger.error(f"Error writing {len(rows)} {self.name} rows, requeueing: {e}")
+            for row in rows:
+                self.put(row)
+            return False
+
+    async def flush(self) -> int:
+        """Write every queued row, stopping at the first failed batch"""
+        written = 0
+        while not self.queue.empty():
+            rows = self._take([])
+            if not await self._write(rows):
+                break
+            written += len(rows)
+        return written
+
+    async def run(self):
+        """Background writer, batching rows as they arrive until cancelled"""
+        loop = asyncio.get_running_loop()
+        batch: List[tuple] = []
+        while True:
+            try:
+                batch.append(await self.queue.get())
+                deadline = loop.time() + self.interval
+                while len(self._take(batch)) < self.batch_size:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+                    except asyncio.TimeoutError:
+                        break
+
+                # Shielded so cancellation never abandons a batch mid-write
+                self._inflight = asyncio.ensure_future(self._write(batch))
+                batch = []
+                if not await asyncio.shield(self._inflight):
+                    await asyncio.sleep(self.interval)
+            except asyncio.CancelledError:
+                if self._inflight is not None and not self._inflight.done():
+                    await self._inflight
+                if batch:
+                    await self._write(batch)
+                await self.flush()
+                raise
+            except Exception as e:
+                logger.error(f"{self.name} writer error: {e}")
+
+    def start(self):
+        """Start the background writer on the running loop"""
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> int:
+        """Stop the background writer and write whatever is still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        return await self.flush()
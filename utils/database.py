@@ -7,24 +7,33 @@ import aiosqlite
 import asyncio
 import logging
 import os
-import json
 import time
 import hashlib
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List, Union
+from typing import AsyncIterator, Optional, Dict, Any, List, Union
 from contextlib import asynccontextmanager
 from functools import wraps
 from collections import defaultdict
 
+from utils import serialization
+
 logger = logging.getLogger(__name__)
 
+# get_user goes through the query cache; every write to a users row calls
+# invalidate_user so reads after the write see it
+_USER_QUERY = "SELECT * FROM users WHERE user_id = ?"
+
 class DatabaseManager:
-    def __init__(self, db_path: str = "db/bot_database.db", pool_size: int = 10, cache_size: int = 1000):
+    def __init__(self, db_path: str = "db/bot_database.db", pool_size: int = 10, cache_size: int = 1000,
+                 max_overflow: int = 0):
         """Initialize professional database with connection pooling and caching"""
         self.db_path = db_path
         self.pool_size = pool_size
+        self.max_overflow = max_overflow
         self.cache_size = cache_size
         self.connection_pool = asyncio.Queue(maxsize=pool_size)
+        self._overflow = 0
+        self._tasks: List[asyncio.Task] = []
         self.cache = {}
         self.cache_timestamps = {}
         self.cache_ttl = 300  # 5 minutes TTL
@@ -56,57 +65,103 @@ class DatabaseManager:
         await self._create_schema()
         
         # Start background tasks
-        asyncio.create_task(self._cache_cleanup_task())
-        asyncio.create_task(self._performance_monitor_task())
+        self._tasks = [
+            asyncio.create_task(self._cache_cleanup_task()),
+            asyncio.create_task(self._performance_monitor_task())
+        ]
         
         self._initialized = True
         self._initializing = False
         logger.info("Database initialized successfully")
     
+    async def _connect(self) -> aiosqlite.Connection:
+        """Open a connection with optimized settings"""
+        conn = await aiosqlite.connect(
+            self.db_path,
+            check_same_thread=False,
+            timeout=30.0,
+            isolation_level=None  # Autocommit mode for better concurrency
+        )
+        
+        # Configure connection for maximum performance
+        await conn.execute("PRAGMA journal_mode=WAL")  # Write-Ahead Logging
+        await conn.execute("PRAGMA synchronous=NORMAL")  # Balance safety and speed
+        await conn.execute("PRAGMA cache_size=-64000")  # 64MB cache
+        await conn.execute("PRAGMA temp_store=memory")  # Store temp data in memory
+        await conn.execute("PRAGMA mmap_size=268435456")  # 256MB memory map
+        await conn.execute("PRAGMA busy_timeout=30000")  # Wait for the writer instead of failing
+        await conn.execute("PRAGMA optimize")  # Optimize database
+        return conn
+    
     async def _init_connection_pool(self):
         """Initialize connection pool with optimized settings"""
         for _ in range(self.pool_size):
-            conn = await aiosqlite.connect(
-                self.db_path,
-                check_same_thread=False,
-                timeout=30.0,
-                isolation_level=None  # Autocommit mode for better concurrency
-            )
-            
-            # Configure connection for maximum performance
-            await conn.execute("PRAGMA journal_mode=WAL")  # Write-Ahead Logging
-            await conn.execute("PRAGMA synchronous=NORMAL")  # Balance safety and speed
-            await conn.execute("PRAGMA cache_size=-64000")  # 64MB cache
-            await conn.execute("PRAGMA temp_store=memory")  # Store temp data in memory
-            await conn.execute("PRAGMA mmap_size=268435456")  # 256MB memory map
-            await conn.execute("PRAGMA optimize")  # Optimize database
-            
-            await self.connection_pool.put(conn)
+            await self.connection_pool.put(await self._connect())
     
     @asynccontextmanager
     async def get_connection(self):
-        """Get connection from pool with context manager"""
-        conn = await self.connection_pool.get()
+        """Get connection from pool with context manager.
+        
+        When every pooled connection is busy, up to max_overflow extra
+        connections are opened for the burst and closed on release.
+        """
+        overflow = False
+        try:
+            conn = self.connection_pool.get_nowait()
+        except asyncio.QueueEmpty:
+            if self._overflow < self.max_overflow:
+                self._overflow += 1
+                overflow = True
+                try:
+                    conn = await self._connect()
+                except BaseException:
+                    self._overflow -= 1
+                    raise
+            else:
+                conn = await self.connection_pool.get()
         try:
             yield conn
         finally:
-            await self.connection_pool.put(conn)
+            if overflow:
+                self._overflow -= 1
+                await conn.close()
+            else:
+                self.connection_pool.put_nowait(conn)
+    
+    async def close(self):
+        """Stop background tasks and close every pooled connection"""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        while not self.connection_pool.empty():
+            conn = self.connection_pool.get_nowait()
+            try:
+                await conn.close()
+            except Exception as e:
+                logger.error(f"Error closing database connection: {e}")
+        self._initialized = False
     
     def _get_cache_key(self, query: str, params: tuple = ()) -> str:
         """Generate cache key for query"""
         cache_data = f"{query}:{params}"
         return hashlib.md5(cache_data.encode()).hexdigest()
     
+    def invalidate_user(self, user_id: int):
+        """Drop the cached get_user row after a write to that user"""
+        key = self._get_cache_key(_USER_QUERY, (user_id,))
+        self.cache.pop(key, None)
+        self.cache_timestamps.pop(key, None)
+    
     def _is_cache_valid(self, key: str) -> bool:
         """Check if cache entry is valid"""
         return key in self.cache_timestamps and \
-               time.time() - self.cache_timestamps[key] < self.cache_ttl
+               time.monotonic() - self.cache_timestamps[key] < self.cache_ttl
     
     async def _cache_cleanup_task(self):
         """Background task to clean up expired cache entries"""
         while True:
             try:
-                current_time = time.time()
+                current_time = time.monotonic()
                 expired_keys = [
                     key for key, timestamp in self.cache_timestamps.items()
                     if current_time - timestamp > self.cache_ttl
@@ -149,7 +204,7 @@ class DatabaseManager:
             except Exception as e:
                 logger.error(f"Performance monitor error: {e}")
     
-    async def initialize(self):
+    async def _create_schema(self):
         """Initialize database tables with optimized schema"""
         try:
             async with self.get_connection() as db:
@@ -283,6 +338,29 @@ class DatabaseManager:
                     )
                 """)
                 
+                # FSM state and data per (bot, chat, user, thread, destiny)
+                await db.execute("""
+                    CREATE TABLE IF NOT EXISTS fsm_states (
+                        bot_id INTEGER NOT NULL,
+                        chat_id INTEGER NOT NULL,
+                        user_id INTEGER NOT NULL,
+                        thread_id INTEGER NOT NULL DEFAULT 0,
+                        destiny TEXT NOT NULL DEFAULT 'default',
+                        state TEXT,
+                        data TEXT NOT NULL DEFAULT '{}',
+                        PRIMARY KEY (bot_id, chat_id, user_id, thread_id, destiny)
+                    )
+                """)
+                
+                # Video info shared between workers, keyed by canonical video id
+                await db.execute("""
+                    CREATE TABLE IF NOT EXISTS video_info (
+                        video_key TEXT PRIMARY KEY,
+                        info TEXT NOT NULL,
+                        fetched_at REAL NOT NULL
+                    )
+                """)
+                
                 # Create indexes for better performance
                 indexes = [
                     "CREATE INDEX IF NOT EXISTS idx_users_prime ON users(is_prime)",
@@ -309,7 +387,7 @@ class DatabaseManager:
     async def execute_query(self, query: str, params: tuple = (), fetch_one: bool = False, 
                           fetch_all: bool = False, use_cache: bool = True) -> Any:
         """Execute query with caching and performance monitoring"""
-        start_time = time.time()
+        started = time.perf_counter()
         self.query_count += 1
         
         # Check cache for SELECT queries
@@ -317,7 +395,7 @@ class DatabaseManager:
             cache_key = self._get_cache_key(query, params)
             if self._is_cache_valid(cache_key):
                 self.cache_hits += 1
-                self.total_query_time += time.time() - start_time
+                self.total_query_time += time.perf_counter() - started
                 return self.cache[cache_key]
             self.cache_misses += 1
         
@@ -338,24 +416,34 @@ class DatabaseManager:
                 if query.strip().upper().startswith('SELECT') and use_cache and (fetch_one or fetch_all):
                     cache_key = self._get_cache_key(query, params)
                     self.cache[cache_key] = result
-                    self.cache_timestamps[cache_key] = time.time()
+                    self.cache_timestamps[cache_key] = time.monotonic()
                 
-                self.total_query_time += time.time() - start_time
+                self.total_query_time += time.perf_counter() - started
                 return result
                 
         except Exception as e:
-            self.total_query_time += time.time() - start_time
+            self.total_query_time += time.perf_counter() - started
             logger.error(f"Database query error: {e}")
             raise
     
+    async def execute_many(self, query: str, params_seq: List[tuple]) -> int:
+        """Run one write statement for every parameter tuple on a single connection"""
+        started = time.perf_counter()
+        self.query_count += 1
+        try:
+            async with self.get_connection() as db:
+                await db.executemany(query, params_seq)
+            self.total_query_time += time.perf_counter() - started
+            return len(params_seq)
+        except Exception as e:
+            self.total_query_time += time.perf_counter() - started
+            logger.error(f"Database batch error: {e}")
+            raise
+    
     # Legacy compatibility methods
     async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Get user information by ID"""
-        return await self.execute_query(
-            "SELECT * FROM users WHERE user_id = ?",
-            (user_id,),
-            fetch_one=True
-        )
+        return await self.execute_query(_USER_QUERY, (user_id,), fetch_one=True)
     
     async def create_user(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None) -> bool:
         """Create a new user (legacy compatibility)"""
@@ -375,6 +463,7 @@ class DatabaseManager:
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, COALESCE((SELECT created_at FROM users WHERE user_id = ?), ?))
             """, (user_id, username, first_name, last_name, language_code, referral_code, 
                   datetime.now(), datetime.now(), user_id, datetime.now()))
+            self.invalidate_user(user_id)
             
             return True
         except Exception as e:
@@ -388,9 +477,20 @@ class DatabaseManager:
                 "UPDATE users SET last_active = ?, last_seen = ? WHERE user_id = ?",
                 (datetime.now(), datetime.now(), user_id)
             )
+            self.invalidate_user(user_id)
         except Exception as e:
             logger.error(f"Error updating user activity {user_id}: {e}")
     
+    async def block_user(self, user_id: int) -> bool:
+        """Mark a user as blocked"""
+        try:
+            await self.execute_query("UPDATE users SET is_blocked = TRUE WHERE user_id = ?", (user_id,))
+            self.invalidate_user(user_id)
+            return True
+        except Exception as e:
+            logger.error(f"Error blocking user {user_id}: {e}")
+            return False
+    
     async def set_prime_status(self, user_id: int, is_prime: bool, 
                               expiry_days: int = None, expiry: Optional[datetime] = None, 
                               admin_id: int = None) -> bool:
@@ -408,11 +508,12 @@ class DatabaseManager:
                 SET is_prime = ?, prime_expiry = ?
                 WHERE user_id = ?
             """, (is_prime, expiry_date, user_id))
+            self.invalidate_user(user_id)
             
             # Log admin action
             if admin_id:
                 action = "grant_prime" if is_prime else "remove_prime"
-                details = json.dumps({
+                details = serialization.dumps({
                     "user_id": user_id,
                     "expiry": expiry_date.isoformat() if expiry_date else None,
                     "action": action
@@ -523,6 +624,7 @@ class DatabaseManager:
                     cooldown_until = ?
                 WHERE user_id = ?
             """, (downloads_this_hour, now, cooldown_until, user_id))
+            self.invalidate_user(user_id)
             
             return True
         except Exception as e:
@@ -542,6 +644,7 @@ class DatabaseManager:
                     cooldown_until = NULL
                 WHERE user_id = ?
             """, (next_reset, user_id))
+            self.invalidate_user(user_id)
             
             return True
         except Exception as e:
@@ -580,6 +683,7 @@ class DatabaseManager:
                     last_active = ?
                 WHERE user_id = ?
             """, (datetime.now(), datetime.now(), datetime.now(), user_id))
+            self.invalidate_user(user_id)
             
             return True
         except Exception as e:
@@ -733,6 +837,33 @@ class DatabaseManager:
         """Get all user IDs for broadcasting (new method)"""
         return await self.get_all_user_ids()
     
+    async def count_broadcast_users(self) -> int:
+        """Count users a broadcast would reach"""
+        try:
+            row = await self.execute_query(
+                "SELECT COUNT(*) AS total FROM users WHERE is_blocked = FALSE",
+                fetch_one=True, use_cache=False
+            )
+            return row['total'] if row else 0
+        except Exception as e:
+            logger.error(f"Error counting broadcast users: {e}")
+            return 0
+    
+    async def iter_user_ids(self, batch_size: int = 30) -> AsyncIterator[List[int]]:
+        """Yield unblocked user IDs a page at a time, keyed on user_id rather than OFFSET"""
+        last_id = -1
+        while True:
+            rows = await self.execute_query(
+                "SELECT user_id FROM users WHERE is_blocked = FALSE AND user_id > ? "
+                "ORDER BY user_id LIMIT ?",
+                (last_id, batch_size), fetch_all=True, use_cache=False
+            )
+            if not rows:
+                return
+            batch = [row['user_id'] for row in rows]
+            yield batch
+            last_id = batch[-1]
+    
     async def set_user_state(self, user_id: int, state: str) -> bool:
         """Set user's current state"""
         try:
@@ -740,6 +871,7 @@ class DatabaseManager:
                 "UPDATE users SET state = ? WHERE user_id = ?",
                 (state, user_id)
             )
+            self.invalidate_user(user_id)
             return True
         except Exception as e:
             logger.error(f"Error setting user state {user_id}: {e}")
@@ -757,13 +889,14 @@ class DatabaseManager:
             if not user:
                 return False
             
-            temp_data = json.loads(user.get('temp_data', '{}'))
+            temp_data = serialization.loads(user.get('temp_data', '{}'))
             temp_data[key] = value
             
             await self.execute_query(
                 "UPDATE users SET temp_data = ? WHERE user_id = ?",
-                (json.dumps(temp_data), user_id)
+                (serialization.dumps(temp_data), user_id)
             )
+            self.invalidate_user(user_id)
             return True
         except Exception as e:
             logger.error(f"Error setting user temp data {user_id}: {e}")
@@ -776,7 +909,7 @@ class DatabaseManager:
             if not user:
                 return None
             
-            temp_data = json.loads(user.get('temp_data', '{}'))
+            temp_data = serialization.loads(user.get('temp_data', '{}'))
             return temp_data.get(key)
         except Exception as e:
             logger.error(f"Error getting user temp data {user_id}: {e}")
@@ -789,11 +922,61 @@ class DatabaseManager:
                 "UPDATE users SET temp_data = '{}' WHERE user_id = ?",
                 (user_id,)
             )
+            self.invalidate_user(user_id)
             return True
         except Exception as e:
             logger.error(f"Error clearing user temp data {user_id}: {e}")
             return False
     
+    async def clear_user_session(self, user_id: int) -> bool:
+        """Clear user's state and temporary data in a single update"""
+        try:
+            await self.execute_query(
+                "UPDATE users SET state = '', temp_data = '{}' WHERE user_id = ?",
+                (user_id,)
+            )
+            self.invalidate_user(user_id)
+            return True
+        except Exception as e:
+            logger.error(f"Error clearing user session {user_id}: {e}")
+            return False
+    
+    async def get_cached_video_info(self, video_key: str, max_age: float) -> Optional[Dict[str, Any]]:
+        """Get shared video info fetched less than max_age seconds ago"""
+        try:
+            row = await self.execute_query(
+                "SELECT info FROM video_info WHERE video_key = ? AND fetched_at > ?",
+                (video_key, time.time() - max_age),
+                fetch_one=True, use_cache=False
+            )
+            return serialization.loads(row['info']) if row else None
+        except Exception as e:
+            logger.error(f"Error reading cached video info {video_key}: {e}")
+            return None
+    
+    async def save_video_info(self, video_key: str, info: Dict[str, Any]) -> bool:
+        """Store video info for other workers to reuse"""
+        try:
+            await self.execute_query(
+                "INSERT OR REPLACE INTO video_info (video_key, info, fetched_at) VALUES (?, ?, ?)",
+                (video_key, serialization.dumps(info), time.time())
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Error saving video info {video_key}: {e}")
+            return False
+    
+    async def prune_video_info(self, max_age: float) -> int:
+        """Delete shared video info older than max_age seconds"""
+        try:
+            return await self.execute_query(
+                "DELETE FROM video_info WHERE fetched_at <= ?",
+                (time.time() - max_age,)
+            )
+        except Exception as e:
+            logger.error(f"Error pruning video info: {e}")
+            return 0
+    
     async def cleanup_expired_prime_users(self) -> int:
         """Clean up expired prime users"""
         try:
@@ -802,6 +985,10 @@ class DatabaseManager:
                 SET is_prime = FALSE, prime_expiry = NULL
                 WHERE is_prime = TRUE AND prime_expiry < datetime('now')
             """)
+            if result:
+                # Affected users aren't known individually, so drop every cached read
+                self.cache.clear()
+                self.cache_timestamps.clear()
             return result if result else 0
         except Exception as e:
             logger.error(f"Error cleaning up expired prime users: {e}")
@@ -810,11 +997,11 @@ class DatabaseManager:
     async def get_health_status(self) -> Dict[str, Any]:
         """Get database health status"""
         try:
-            start_time = time.time()
+            started = time.perf_counter()
             
             # Test basic query
             test_result = await self.execute_query("SELECT 1 as test", fetch_one=True)
-            query_time = time.time() - start_time
+            query_time = time.perf_counter() - started
             
             # Check pool status
             pool_available = self.connection_pool.qsize()
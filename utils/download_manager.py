@@ -8,24 +8,59 @@ import asyncio
 import logging
 import tempfile
 import time
-import json
 import hashlib
 import shutil
+import re
+import multiprocessing
+from collections import OrderedDict
 from typing import Dict, Any, Optional, List, Tuple
 from dataclasses import dataclass
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from contextlib import asynccontextmanager
 import yt_dlp
-from aiogram.types import BufferedInputFile
+from aiogram.types import FSInputFile, InputFile
 
 logger = logging.getLogger(__name__)
 
+VIDEO_ID_RE = re.compile(r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})')
+
+# Read size for streamed uploads; larger than aiogram's 64 KiB default so a
+# 50 MB file takes ~50 thread-pool reads instead of ~800
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Initial yt-dlp read/write block size for HTTP downloads
+DOWNLOAD_BUFFER_SIZE = 1024 * 1024
+
+# Parallel fragment requests for DASH/HLS formats; kept under the ~10
+# connections per client where YouTube starts throttling
+CONCURRENT_FRAGMENTS = 8
+
+# Fields of the yt-dlp info dict used by get_video_info; only these cross the
+# executor boundary, not the full format list
+_INFO_FIELDS = ('title', 'duration', 'uploader', 'view_count', 'upload_date',
+                'description', 'thumbnail', 'id', 'webpage_url')
+
+def extract_info_summary(url: str, opts: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Extract video info and keep only the fields the bot uses (runs in a worker)"""
+    try:
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+    except Exception as e:
+        logger.error(f"Sync info extraction error: {e}")
+        return None
+    if not info:
+        return None
+    summary = {field: info[field] for field in _INFO_FIELDS if field in info}
+    summary['heights'] = sorted({fmt['height'] for fmt in info.get('formats') or () if fmt.get('height')})
+    return summary
+
 @dataclass
 class DownloadResult:
     """Enhanced download result with comprehensive metadata"""
     success: bool
     type: str  # 'video' or 'audio'
-    file: Optional[BufferedInputFile] = None
+    file: Optional[InputFile] = None
+    path: Optional[str] = None  # temp file backing `file`, removed by release_file()
     quality: str = ""
     title: str = ""
     duration: int = 0
@@ -40,13 +75,16 @@ class DownloadResult:
 class AdvancedDownloadManager:
     def __init__(self, max_concurrent: int = 5, temp_dir: str = "temp", 
                  cleanup_interval: int = 3600, max_file_size: int = 50 * 1024 * 1024,
-                 max_duration: int = 3600):
+                 max_duration: int = 3600, info_workers: int = 4, info_processes: int = 0,
+                 info_store=None):
         """Initialize professional download manager"""
         self.max_concurrent = max_concurrent
         self.temp_dir = temp_dir
         self.cleanup_interval = cleanup_interval
         self.max_file_size = max_file_size
         self.max_duration = max_duration
+        # Optional database shared by every worker, checked after the local cache
+        self.info_store = info_store
         
         # Create directories
         os.makedirs(temp_dir, exist_ok=True)
@@ -54,7 +92,16 @@ class AdvancedDownloadManager:
         
         # Concurrent download management
         self.semaphore = asyncio.Semaphore(max_concurrent)
-        self.executor = ThreadPoolExecutor(max_workers=max_concurrent)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix='ytdlp-download')
+        # Metadata lookups get their own workers so a URL preview never waits behind
+        # downloads. Extraction is CPU-bound Python, so with info_processes set it runs
+        # in separate processes and uses more than one core.
+        if info_processes > 0:
+            self.info_executor: Executor = ProcessPoolExecutor(
+                max_workers=info_processes, mp_context=multiprocessing.get_context('spawn')
+            )
+        else:
+            self.info_executor = ThreadPoolExecutor(max_workers=info_workers, thread_name_prefix='ytdlp-info')
         
         # Download tracking
         self.active_downloads: Dict[str, Dict[str, Any]] = {}
@@ -81,6 +128,12 @@ class AdvancedDownloadManager:
         self.retry_delay = 5
         self.timeout = 300  # 5 minutes timeout
         
+        # Video info cache keyed by YouTube video id
+        self.video_info_ttl = 86400
+        self.video_info_max_entries = 2000
+        self.video_info_cache: 'OrderedDict[str, Tuple[float, Dict[str, Any]]]' = OrderedDict()
+        self.video_info_pending: Dict[str, asyncio.Future] = {}
+        
         # Start background tasks
         asyncio.create_task(self._cleanup_task())
         asyncio.create_task(self._stats_monitor_task())
@@ -104,9 +157,11 @@ class AdvancedDownloadManager:
             'prefer_ffmpeg': True,
             'keepvideo': False,
             'embed_subs': False,
-            'concurrent_fragments': 3,
+            'concurrent_fragment_downloads': CONCURRENT_FRAGMENTS,
             'http_chunk_size': 10485760,  # 10MB chunks
-            'buffer_size': 1024 * 1024,   # 1MB buffer
+            # yt-dlp's write buffer starts at 1 KiB and resizes upward per block;
+            # start at 1 MiB so large files go to disk in fewer, bigger writes
+            'buffersize': DOWNLOAD_BUFFER_SIZE,
         }
         
         # Cookies support with multiple sources
@@ -144,7 +199,8 @@ class AdvancedDownloadManager:
     async def download_content(self, url: str, quality: str, user_id: int) -> DownloadResult:
         """Download content with enhanced error handling and monitoring"""
         download_id = hashlib.md5(f"{url}{quality}{user_id}{time.time()}".encode()).hexdigest()[:12]
-        start_time = time.time()
+        start_time = time.time()  # wall clock, reported in active_downloads
+        started = time.monotonic()
         
         self.download_stats['total_downloads'] += 1
         
@@ -186,7 +242,7 @@ class AdvancedDownloadManager:
                     result = await self._download_audio_enhanced(url, quality, user_id, download_id, info_result)
                 
                 # Update statistics
-                download_time = time.time() - start_time
+                download_time = time.monotonic() - started
                 result.download_time = download_time
                 self.download_stats['total_download_time'] += download_time
                 
@@ -207,7 +263,7 @@ class AdvancedDownloadManager:
                 success=False,
                 type=download_type if 'download_type' in locals() else 'unknown',
                 error=str(e),
-                download_time=time.time() - start_time
+                download_time=time.monotonic() - started
             )
             
             self.active_downloads[download_id]['status'] = 'failed'
@@ -264,25 +320,19 @@ class AdvancedDownloadManager:
                     error=f'File too large: {file_size} bytes (max: {self.max_file_size})'
                 )
             
-            # Read file content
-            with open(filename, 'rb') as f:
-                file_content = f.read()
-            
-            # Clean up temp file
-            os.remove(filename)
-            
             # Extract quality info
             quality_display = quality.replace('quality_', '').upper()
             title = info.get('title', 'Unknown Video')
             
-            # Create BufferedInputFile
+            # Stream from disk on upload instead of buffering the whole file
             safe_filename = self._sanitize_filename(f"{title}.mp4")
-            file_obj = BufferedInputFile(file_content, filename=safe_filename)
+            file_obj = FSInputFile(filename, filename=safe_filename, chunk_size=UPLOAD_CHUNK_SIZE)
             
             return DownloadResult(
                 success=True,
                 type='video',
                 file=file_obj,
+                path=filename,
                 quality=quality_display,
                 title=title,
                 duration=info.get('duration', 0),
@@ -368,26 +418,20 @@ class AdvancedDownloadManager:
                     error=f'File too large: {file_size} bytes (max: {self.max_file_size})'
                 )
             
-            # Read file content
-            with open(actual_filename, 'rb') as f:
-                file_content = f.read()
-            
-            # Clean up temp file
-            os.remove(actual_filename)
-            
             # Extract quality info
             quality_display = "High Quality" if quality == 'audio_hq' else "Standard Quality"
             title = info.get('title', 'Unknown Audio')
             
-            # Create BufferedInputFile with proper extension
+            # Stream from disk on upload, with proper extension
             extension = '.mp3'  # Default to mp3
             safe_filename = self._sanitize_filename(f"{title}{extension}")
-            file_obj = BufferedInputFile(file_content, filename=safe_filename)
+            file_obj = FSInputFile(actual_filename, filename=safe_filename, chunk_size=UPLOAD_CHUNK_SIZE)
             
             return DownloadResult(
                 success=True,
                 type='audio',
                 file=file_obj,
+                path=actual_filename,
                 quality=quality_display,
                 title=title,
                 duration=info.get('duration', 0),
@@ -440,7 +484,54 @@ class AdvancedDownloadManager:
                 'error': str(e)
             }
     
-    async def get_video_info(self, url: str) -> Dict[str, Any]:
+    @staticmethod
+    def _video_cache_key(url: str) -> str:
+        """Canonical cache key: the 11-character video id, or the raw URL"""
+        match = VIDEO_ID_RE.search(url)
+        return match.group(1) if match else url
+    
+    async def get_video_info(self, url: str, video_id: Optional[str] = None) -> Dict[str, Any]:
+        """Get video information, served from the TTL cache when possible"""
+        key = video_id or self._video_cache_key(url)
+        now = time.monotonic()
+        
+        cached = self.video_info_cache.get(key)
+        if cached is not None:
+            if now - cached[0] < self.video_info_ttl:
+                self.video_info_cache.move_to_end(key)
+                return cached[1]
+            del self.video_info_cache[key]
+        
+        # Concurrent lookups for the same video share one extraction
+        pending = self.video_info_pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        
+        future = asyncio.get_running_loop().create_future()
+        self.video_info_pending[key] = future
+        try:
+            info = None
+            if self.info_store:
+                info = await self.info_store.get_cached_video_info(key, self.video_info_ttl)
+            if info is None:
+                info = await self._fetch_video_info(url)
+                if info['success'] and self.info_store:
+                    await self.info_store.save_video_info(key, info)
+            future.set_result(info)
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else is waiting
+            raise
+        finally:
+            del self.video_info_pending[key]
+        
+        if info['success']:
+            self.video_info_cache[key] = (now, info)
+            if len(self.video_info_cache) > self.video_info_max_entries:
+                self.video_info_cache.popitem(last=False)
+        return info
+    
+    async def _fetch_video_info(self, url: str) -> Dict[str, Any]:
         """Get comprehensive video information"""
         try:
             opts = {
@@ -449,10 +540,10 @@ class AdvancedDownloadManager:
                 'extract_flat': False
             }
             
-            loop = asyncio.get_event_loop()
+            loop = asyncio.get_running_loop()
             info = await loop.run_in_executor(
-                self.executor,
-                self._extract_info_sync,
+                self.info_executor,
+                extract_info_summary,
                 url, opts
             )
             
@@ -477,19 +568,16 @@ class AdvancedDownloadManager:
                     pass
             
             # Get available formats
-            formats = info.get('formats', [])
             available_qualities = set()
-            for fmt in formats:
-                height = fmt.get('height')
-                if height:
-                    if height <= 360:
-                        available_qualities.add('360p')
-                    elif height <= 480:
-                        available_qualities.add('480p')
-                    elif height <= 720:
-                        available_qualities.add('720p')
-                    elif height <= 1080:
-                        available_qualities.add('1080p')
+            for height in info['heights']:
+                if height <= 360:
+                    available_qualities.add('360p')
+                elif height <= 480:
+                    available_qualities.add('480p')
+                elif height <= 720:
+                    available_qualities.add('720p')
+                elif height <= 1080:
+                    available_qualities.add('1080p')
             
             return {
                 'success': True,
@@ -513,15 +601,6 @@ class AdvancedDownloadManager:
                 'error': f'Could not get video info: {str(e)}'
             }
     
-    def _extract_info_sync(self, url: str, opts: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        """Synchronous info extraction for thread pool"""
-        try:
-            with yt_dlp.YoutubeDL(opts) as ydl:
-                return ydl.extract_info(url, download=False)
-        except Exception as e:
-            logger.error(f"Sync info extraction error: {e}")
-            return None
-    
     async def is_valid_youtube_url(self, url: str) -> bool:
         """Enhanced YouTube URL validation"""
         try:
@@ -558,6 +637,16 @@ class AdvancedDownloadManager:
             logger.error(f"URL validation error: {e}")
             return False
     
+    def release_file(self, result: Optional[DownloadResult]):
+        """Delete the temp file behind a result once it has been sent"""
+        if result is None or not result.path:
+            return
+        try:
+            os.remove(result.path)
+        except OSError:
+            pass
+        result.path = None
+    
     def _sanitize_filename(self, filename: str) -> str:
         """Sanitize filename for safe use"""
         import re
@@ -593,6 +682,13 @@ class AdvancedDownloadManager:
                 if cleaned_count > 0:
                     logger.info(f"Cleaned up {cleaned_count} temporary files")
                 
+                # Drop expired video info entries
+                expiry = time.monotonic() - self.video_info_ttl
+                for key in [k for k, (ts, _) in self.video_info_cache.items() if ts < expiry]:
+                    del self.video_info_cache[key]
+                if self.info_store:
+                    await self.info_store.prune_video_info(self.video_info_ttl)
+                
             except Exception as e:
                 logger.error(f"Cleanup task error: {e}")
     
@@ -656,6 +752,11 @@ class AdvancedDownloadManager:
         """Get information about currently active downloads"""
         return list(self.active_downloads.values())
     
+    def close(self):
+        """Stop the worker threads, abandoning queued yt-dlp jobs"""
+        self.info_executor.shutdown(wait=False, cancel_futures=True)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+    
     def cleanup_temp_files(self):
         """Manual cleanup of temporary files (legacy compatibility)"""
         try:
@@ -7,11 +7,10 @@ import asyncio
 import logging
 import tempfile
 import time
-import json
 from typing import Dict, Any, Optional
 from dataclasses import dataclass
 import yt_dlp
-from aiogram.types import BufferedInputFile
+from aiogram.types import FSInputFile, InputFile
 
 logger = logging.getLogger(__name__)
 
@@ -20,7 +19,8 @@ class DownloadResult:
     """Download result with metadata"""
     success: bool
     type: str  # 'video' or 'audio'
-    file: Optional[BufferedInputFile] = None
+    file: Optional[InputFile] = None
+    path: Optional[str] = None  # temp file backing `file`, removed by release_file()
     quality: str = ""
     title: str = ""
     duration: int = 0
@@ -104,6 +104,16 @@ class AdvancedDownloadManager:
                 error=str(e)
             )
     
+    def release_file(self, result: Optional[DownloadResult]):
+        """Delete the temp file behind a result once it has been sent"""
+        if result is None or not result.path:
+            return
+        try:
+            os.remove(result.path)
+        except OSError:
+            pass
+        result.path = None
+    
     async def _perform_download(self, url: str, quality: str, user_id: int) -> DownloadResult:
         """Perform the actual download"""
         timestamp = int(time.time())
@@ -154,17 +164,7 @@ class AdvancedDownloadManager:
                         error="File too large (max 50MB)"
                     )
                 
-                # Read file and create BufferedInputFile
-                with open(downloaded_file, 'rb') as f:
-                    file_data = f.read()
-                
-                # Clean up downloaded file
-                try:
-                    os.remove(downloaded_file)
-                except:
-                    pass
-                
-                # Create appropriate input file
+                # Create appropriate input file, streamed from disk on upload
                 title = info.get('title', 'download')
                 safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).rstrip()[:50]
                 
@@ -173,12 +173,11 @@ class AdvancedDownloadManager:
                 else:
                     filename = f"{safe_title}.mp3"
                 
-                buffered_file = BufferedInputFile(file_data, filename)
-                
                 return DownloadResult(
                     success=True,
                     type=download_type,
-                    file=buffered_file,
+                    file=FSInputFile(downloaded_file, filename=filename),
+                    path=downloaded_file,
                     quality=quality,
                     title=info.get('title', 'Unknown'),
                     duration=info.get('duration', 0),
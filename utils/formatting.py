@@ -0,0 +1,15 @@
+"""
+Message Formatting Helpers for Telegram YouTube Downloader Bot
+Features: Cached HTML escaping and truncation of user or YouTube supplied text
+"""
+
+import html
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1024)
+def html_preview(text: str, limit: int = 0) -> str:
+    """Escape user or YouTube supplied text for HTML messages, truncated to `limit` characters"""
+    if limit and len(text) > limit:
+        return html.escape(text[:limit]) + '...'
+    return html.escape(text)
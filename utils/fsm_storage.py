@@ -0,0 +1,88 @@
+"""
+FSM Storage for Telegram YouTube Downloader Bot
+Features: Database-backed storage on the shared pool, optional Redis storage
+with expiring keys
+"""
+
+import logging
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from utils import serialization
+
+try:
+    from aiogram.fsm.storage.redis import RedisStorage
+except ImportError:  # redis is optional
+    RedisStorage = None
+
+logger = logging.getLogger(__name__)
+
+# Conversation state is cheap to lose, so Redis keys expire after an idle hour
+REDIS_FSM_TTL = 3600
+
+
+class DatabaseStorage(BaseStorage):
+    """FSM storage kept in the bot database's fsm_states table.
+
+    State lives in one place for every worker sharing the database, and
+    process memory no longer grows with the number of users.
+    """
+
+    _KEY_WHERE = "bot_id = ? AND chat_id = ? AND user_id = ? AND thread_id = ? AND destiny = ?"
+
+    def __init__(self, database):
+        self.db = database
+
+    @staticmethod
+    def _key(key: StorageKey) -> Tuple[int, int, int, int, str]:
+        return key.bot_id, key.chat_id, key.user_id, key.thread_id or 0, key.destiny
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self.db.execute_query(
+            "INSERT INTO fsm_states (bot_id, chat_id, user_id, thread_id, destiny, state) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny) DO UPDATE SET state = excluded.state",
+            (*self._key(key), value)
+        )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await self.db.execute_query(
+            f"SELECT state FROM fsm_states WHERE {self._KEY_WHERE}",
+            self._key(key), fetch_one=True, use_cache=False
+        )
+        return row['state'] if row else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self.db.execute_query(
+            "INSERT INTO fsm_states (bot_id, chat_id, user_id, thread_id, destiny, data) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny) DO UPDATE SET data = excluded.data",
+            (*self._key(key), serialization.dumps(dict(data)))
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = await self.db.execute_query(
+            f"SELECT data FROM fsm_states WHERE {self._KEY_WHERE}",
+            self._key(key), fetch_one=True, use_cache=False
+        )
+        return serialization.loads(row['data']) if row and row['data'] else {}
+
+    async def clear(self, key: StorageKey) -> None:
+        """Drop state and data together in a single statement"""
+        await self.db.execute_query(f"DELETE FROM fsm_states WHERE {self._KEY_WHERE}", self._key(key))
+
+    async def close(self) -> None:
+        # The connection pool belongs to the database manager
+        pass
+
+
+def create_storage(database, redis_url: str = '') -> BaseStorage:
+    """Pick the FSM storage: Redis when configured and installed, else the database"""
+    if redis_url:
+        if RedisStorage is not None:
+            return RedisStorage.from_url(redis_url, state_ttl=REDIS_FSM_TTL, data_ttl=REDIS_FSM_TTL)
+        logger.warning("REDIS_URL is set but redis is not installed, keeping FSM state in the database")
+    return DatabaseStorage(database)
@@ -0,0 +1,83 @@
+"""
+Token Bucket Rate Limiter for Telegram YouTube Downloader Bot
+Features: Per-key token buckets, lazy refill, LRU-capped bucket cache,
+awaitable reservations for pacing outbound calls
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+
+class TokenBucket:
+    """Single token bucket refilled lazily from a monotonic clock"""
+
+    __slots__ = ('tokens', 'last', 'rate', 'cap')
+
+    def __init__(self, rate: float, cap: float):
+        self.rate = rate
+        self.cap = cap
+        self.tokens = cap
+        self.last = time.monotonic()
+
+    def consume(self, amount: float = 1.0) -> bool:
+        """Take tokens from the bucket, returning False when empty"""
+        now = time.monotonic()
+        tokens = self.tokens + (now - self.last) * self.rate
+        self.tokens = tokens if tokens < self.cap else self.cap
+        self.last = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """Take tokens even on credit, returning seconds until they are earned"""
+        now = time.monotonic()
+        tokens = self.tokens + (now - self.last) * self.rate
+        self.tokens = (tokens if tokens < self.cap else self.cap) - amount
+        self.last = now
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    async def acquire(self, amount: float = 1.0):
+        """Wait until the bucket can pay for `amount` tokens"""
+        delay = self.reserve(amount)
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class TokenBucketLimiter:
+    """Per-key token buckets kept in an LRU-capped dictionary.
+
+    Dispatch runs on a single event loop, so bucket updates never
+    interleave and no lock is needed.
+    """
+
+    def __init__(self, requests: int, period: float, max_keys: int = 10000):
+        self.rate = requests / period
+        self.cap = float(requests)
+        self.max_keys = max_keys
+        self.buckets: 'OrderedDict[Hashable, TokenBucket]' = OrderedDict()
+
+    def _bucket(self, key: Hashable) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.cap)
+            self.buckets[key] = bucket
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket
+
+    def allow(self, key: Hashable, amount: float = 1.0) -> bool:
+        """Check and consume the bucket for a key"""
+        return self._bucket(key).consume(amount)
+
+    def reserve(self, key: Hashable, amount: float = 1.0) -> float:
+        """Reserve tokens for a key, returning the wait in seconds"""
+        return self._bucket(key).reserve(amount)
+
+    def __len__(self) -> int:
+        return len(self.buckets)
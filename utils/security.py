@@ -13,10 +13,29 @@ from urllib.parse import urlparse, parse_qs
 from collections import defaultdict, deque
 from datetime import datetime, timedelta
 import asyncio
-import json
+
+from utils import serialization
+from utils.batch_writer import BatchWriter
 
 logger = logging.getLogger(__name__)
 
+# Validation patterns, compiled once at import
+VIDEO_ID_RE = re.compile(r'^[a-zA-Z0-9_-]{11}$')
+USERNAME_RE = re.compile(r'^[a-zA-Z0-9_]{1,50}$')
+COMMAND_RE = re.compile(r'^/[a-zA-Z0-9_]{1,50}(\s.*)?$')
+SQL_INJECTION_RE = re.compile(
+    r'union\s+select|drop\s+table|delete\s+from|insert\s+into'
+    r'|or\s+1\s*=\s*1|and\s+1\s*=\s*1'
+    r'|exec\s*\(|execute\s*\(',
+    re.IGNORECASE
+)
+
+# Security events are written to system_logs in batches off the request path
+SECURITY_LOG_FLUSH_INTERVAL = 1.0
+SECURITY_LOG_BATCH_SIZE = 500
+SECURITY_LOG_BACKLOG = 10000
+_SECURITY_LOG_INSERT = "INSERT INTO system_logs (level, message, module, extra_data) VALUES (?, ?, ?, ?)"
+
 class SecurityManager:
     def __init__(self, database=None, enable_monitoring: bool = True):
         """Initialize comprehensive security manager"""
@@ -33,7 +52,8 @@ class SecurityManager:
             'admin_commands': {'window': 300, 'limit': 50}   # 50 admin commands per 5 minutes
         }
         
-        # Security tracking
+        # Security tracking; only users with recorded violations appear in
+        # suspicious_users, so read it with .get() on the per-request path
         self.blocked_users: Set[int] = set()
         self.suspicious_users: Dict[int, Dict[str, Any]] = defaultdict(lambda: {
             'violations': 0,
@@ -60,6 +80,11 @@ class SecurityManager:
             r'(?i)(document\.|window\.|location\.)',
             r'(?i)(union\s+select|drop\s+table|delete\s+from)'
         ]
+        # One alternation scans the input once instead of once per pattern
+        self.malicious_re = re.compile(
+            '|'.join(pattern.removeprefix('(?i)') for pattern in self.malicious_patterns),
+            re.IGNORECASE
+        )
         
         # URL validation
         self.allowed_domains = {
@@ -74,7 +99,13 @@ class SecurityManager:
         }
         
         # Security events
-        self.security_events: List[Dict[str, Any]] = []
+        self.security_events: deque = deque(maxlen=1000)
+        self.log_writer: Optional[BatchWriter] = None
+        if enable_monitoring and self.db and hasattr(self.db, 'execute_many'):
+            self.log_writer = BatchWriter(
+                self.db, _SECURITY_LOG_INSERT, 'security log', batch_size=SECURITY_LOG_BATCH_SIZE,
+                interval=SECURITY_LOG_FLUSH_INTERVAL, backlog=SECURITY_LOG_BACKLOG
+            )
         self.security_metrics = {
             'blocked_requests': 0,
             'rate_limited_users': 0,
@@ -95,6 +126,8 @@ class SecurityManager:
         if enable_monitoring:
             asyncio.create_task(self._security_monitoring_task())
             asyncio.create_task(self._cleanup_task())
+            if self.log_writer:
+                self.log_writer.start()
     
     async def check_user_permission(self, user_id: int, action: str, 
                                   ip_address: str = None) -> Dict[str, Any]:
@@ -166,6 +199,28 @@ class SecurityManager:
                 'error': str(e)
             }
     
+    async def check_and_validate(self, user_id: int, action: str, text: str = None,
+                                 input_type: str = 'general', ip_address: str = None) -> Dict[str, Any]:
+        """Validate the user's input and check the action permission in one call.
+        
+        The result is the permission check result with a ``stage`` key set to
+        'input' when validation rejected the text, or 'permission' otherwise.
+        """
+        if text is not None:
+            if input_type == 'url':
+                # URLs still get the general length, malicious-pattern and SQL checks
+                is_valid, reason = self.validate_input(text, 'general')
+                if is_valid:
+                    is_valid, reason = self.is_valid_youtube_url(text)
+            else:
+                is_valid, reason = self.validate_input(text, input_type)
+            if not is_valid:
+                return {'allowed': False, 'reason': reason, 'stage': 'input'}
+        
+        result = await self.check_user_permission(user_id, action, ip_address)
+        result['stage'] = 'permission'
+        return result
+    
     async def _check_rate_limits(self, user_id: int, action: str, 
                                ip_address: str = None) -> Dict[str, Any]:
         """Advanced rate limiting with multiple dimensions"""
@@ -264,8 +319,8 @@ class SecurityManager:
             # Download action checks
             if action == 'download':
                 # Check for download abuse patterns
-                recent_violations = self.suspicious_users[user_id]['violations']
-                if recent_violations > 5:
+                user_info = self.suspicious_users.get(user_id)
+                if user_info and user_info['violations'] > 5:
                     return {
                         'allowed': False,
                         'reason': 'Too many recent violations',
@@ -295,10 +350,9 @@ class SecurityManager:
                 return False, "URL too long"
             
             # Check for malicious patterns
-            for pattern in self.malicious_patterns:
-                if re.search(pattern, url):
-                    self.security_metrics['malicious_content_detected'] += 1
-                    return False, "Malicious content detected in URL"
+            if self.malicious_re.search(url):
+                self.security_metrics['malicious_content_detected'] += 1
+                return False, "Malicious content detected in URL"
             
             # Parse URL
             try:
@@ -328,7 +382,7 @@ class SecurityManager:
                 if not video_id or len(video_id) != 11:
                     return False, "Invalid YouTube video ID"
                 # Check for valid video ID characters
-                if not re.match(r'^[a-zA-Z0-9_-]{11}$', video_id):
+                if not VIDEO_ID_RE.match(video_id):
                     return False, "Invalid video ID format"
             else:
                 # youtube.com format
@@ -345,7 +399,7 @@ class SecurityManager:
                 if len(video_id) != 11:
                     return False, "Invalid video ID length"
                 
-                if not re.match(r'^[a-zA-Z0-9_-]{11}$', video_id):
+                if not VIDEO_ID_RE.match(video_id):
                     return False, "Invalid video ID characters"
             
             return True, "Valid YouTube URL"
@@ -374,33 +428,25 @@ class SecurityManager:
                 return False, f"Input too long (max {max_length} characters)"
             
             # Check for malicious patterns
-            for pattern in self.malicious_patterns:
-                if re.search(pattern, text):
-                    self.security_metrics['malicious_content_detected'] += 1
-                    return False, "Malicious content detected"
+            if self.malicious_re.search(text):
+                self.security_metrics['malicious_content_detected'] += 1
+                return False, "Malicious content detected"
             
             # Type-specific validation
             if input_type == 'url':
                 return self.is_valid_youtube_url(text)
             
             elif input_type == 'username':
-                if not re.match(r'^[a-zA-Z0-9_]{1,50}$', text.replace('@', '')):
+                if not USERNAME_RE.match(text.replace('@', '')):
                     return False, "Invalid username format"
             
             elif input_type == 'command':
-                if not re.match(r'^/[a-zA-Z0-9_]{1,50}(\s.*)?$', text):
+                if not COMMAND_RE.match(text):
                     return False, "Invalid command format"
             
             # Check for SQL injection patterns
-            sql_patterns = [
-                r'(?i)(union\s+select|drop\s+table|delete\s+from|insert\s+into)',
-                r'(?i)(or\s+1\s*=\s*1|and\s+1\s*=\s*1)',
-                r'(?i)(exec\s*\(|execute\s*\()'
-            ]
-            
-            for pattern in sql_patterns:
-                if re.search(pattern, text):
-                    return False, "Potentially malicious SQL detected"
+            if SQL_INJECTION_RE.search(text):
+                return False, "Potentially malicious SQL detected"
             
             return True, "Input validated"
             
@@ -411,7 +457,9 @@ class SecurityManager:
     def _calculate_trust_score(self, user_id: int) -> int:
         """Calculate user trust score based on behavior"""
         try:
-            user_info = self.suspicious_users[user_id]
+            user_info = self.suspicious_users.get(user_id)
+            if user_info is None:
+                return 100  # No violations on record
             base_score = user_info['trust_score']
             
             # Reduce score based on violations
@@ -555,7 +603,9 @@ class SecurityManager:
             self.blocked_users.add(user_id)
             
             # Log to database if available
-            if self.db and hasattr(self.db, 'execute_query'):
+            if self.db and hasattr(self.db, 'block_user'):
+                await self.db.block_user(user_id)
+            elif self.db and hasattr(self.db, 'execute_query'):
                 await self.db.execute_query(
                     "UPDATE users SET is_blocked = TRUE WHERE user_id = ?",
                     (user_id,)
@@ -587,18 +637,16 @@ class SecurityManager:
                 'details': details or {}
             }
             
-            # Store in memory (keep last 1000 events)
+            # Store in memory (the deque keeps the last 1000 events)
             self.security_events.append(event)
-            if len(self.security_events) > 1000:
-                self.security_events = self.security_events[-1000:]
             
-            # Log to database if available
-            if self.db and hasattr(self.db, 'execute_query'):
+            # Queue for the batched database writer when it is running
+            row = ('SECURITY', f"Security event: {event_type}", 'security', serialization.dumps(event))
+            if self.log_writer:
+                self.log_writer.put(row)
+            elif self.db and hasattr(self.db, 'execute_query'):
                 try:
-                    await self.db.execute_query("""
-                        INSERT INTO system_logs (level, message, module, extra_data)
-                        VALUES (?, ?, ?, ?)
-                    """, ('SECURITY', f"Security event: {event_type}", 'security', json.dumps(event)))
+                    await self.db.execute_query(_SECURITY_LOG_INSERT, row)
                 except:
                     pass  # Don't fail security logging on database errors
             
@@ -609,6 +657,10 @@ class SecurityManager:
         except Exception as e:
             logger.error(f"Error logging security event: {e}")
     
+    async def flush_security_logs(self) -> int:
+        """Stop the security log writer and store every queued event"""
+        return await self.log_writer.stop() if self.log_writer else 0
+    
     async def _security_monitoring_task(self):
         """Background task for security monitoring and alerts"""
         while True:
@@ -692,8 +744,6 @@ class SecurityManager:
     def get_security_metrics(self) -> Dict[str, Any]:
         """Get comprehensive security metrics"""
         try:
-            current_time = time.time()
-            
             # Calculate active metrics
             active_users = len(self.rate_limits)
             blocked_user_count = len(self.blocked_users)
@@ -703,9 +753,14 @@ class SecurityManager:
             trust_scores = [self._calculate_trust_score(user_id) for user_id in self.suspicious_users.keys()]
             avg_trust_score = sum(trust_scores) / len(trust_scores) if trust_scores else 100
             
-            # Recent activity
-            recent_events = [event for event in self.security_events 
-                           if (current_time - datetime.fromisoformat(event['timestamp']).timestamp()) < 3600]
+            # Recent activity; events are appended in time order, so walk back
+            # from the newest and stop at the first one older than an hour
+            cutoff = (datetime.now() - timedelta(hours=1)).isoformat()
+            recent_events_count = 0
+            for event in reversed(self.security_events):
+                if event['timestamp'] < cutoff:
+                    break
+                recent_events_count += 1
             
             return {
                 'metrics': self.security_metrics,
@@ -713,7 +768,7 @@ class SecurityManager:
                 'blocked_users': blocked_user_count,
                 'suspicious_users': suspicious_user_count,
                 'average_trust_score': round(avg_trust_score, 2),
-                'recent_events_count': len(recent_events),
+                'recent_events_count': recent_events_count,
                 'global_request_rate': len(self.global_rate_limit),
                 'ip_addresses_tracked': len(self.ip_tracking),
                 'security_level': 'healthy' if avg_trust_score > 70 else 'monitoring_required'
@@ -751,14 +806,16 @@ class SecurityManager:
     def get_user_security_info(self, user_id: int) -> Dict[str, Any]:
         """Get security information for a specific user"""
         try:
+            user_info = self.suspicious_users.get(user_id)
+            trust_score = self._calculate_trust_score(user_id)
             return {
                 'user_id': user_id,
                 'is_blocked': user_id in self.blocked_users,
-                'trust_score': self._calculate_trust_score(user_id),
-                'security_level': self._get_security_level(self._calculate_trust_score(user_id)),
-                'violations': self.suspicious_users[user_id]['violations'],
-                'violation_types': list(self.suspicious_users[user_id]['violation_types']),
-                'failed_attempts': self.failed_attempts[user_id],
+                'trust_score': trust_score,
+                'security_level': self._get_security_level(trust_score),
+                'violations': user_info['violations'] if user_info else 0,
+                'violation_types': list(user_info['violation_types']) if user_info else [],
+                'failed_attempts': self.failed_attempts.get(user_id, 0),
                 'remaining_requests': self._get_remaining_requests(user_id),
                 'recommendations': self._get_security_recommendations(user_id)
             }
@@ -0,0 +1,52 @@
+"""
+JSON Serialization Helpers for Telegram YouTube Downloader Bot
+Features: orjson fast path with transparent fallback to the stdlib json module
+"""
+
+import json
+from datetime import date, datetime, time
+from enum import Enum
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj: Any, indent: bool = False, sort_keys: bool = False) -> str:
+        """Serialize an object to a JSON string"""
+        option = _ORJSON_OPTIONS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=str, option=option).decode()
+
+    def loads(data) -> Any:
+        """Deserialize a JSON string or bytes"""
+        return orjson.loads(data)
+
+else:
+    def _default(obj: Any) -> Any:
+        """Encode the types orjson handles natively the way orjson does"""
+        if isinstance(obj, (datetime, date, time)):
+            return obj.isoformat()
+        if isinstance(obj, Enum):
+            return obj.value
+        return str(obj)
+
+    def dumps(obj: Any, indent: bool = False, sort_keys: bool = False) -> str:
+        """Serialize an object to a JSON string"""
+        # Same text as the orjson path: compact separators and raw UTF-8
+        return json.dumps(
+            obj, default=_default, ensure_ascii=False, sort_keys=sort_keys,
+            indent=2 if indent else None, separators=None if indent else (',', ':')
+        )
+
+    def loads(data) -> Any:
+        """Deserialize a JSON string or bytes"""
+        return json.loads(data)
@@ -8,12 +8,19 @@ import time
 import asyncio
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, List, Set
-from collections import defaultdict
-import json
+from collections import defaultdict, deque
+from functools import lru_cache
 import hashlib
 
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=4096)
+def _format_timestamp(value, fmt: str) -> str:
+    """Format a datetime or ISO string, parsing and formatting each distinct value once"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return value.strftime(fmt)
+
 class ProfessionalUserManager:
     def __init__(self, database, cache_ttl: int = 300, analytics_enabled: bool = True,
                  rate_limit_window: int = 3600, max_requests_per_window: int = 100):
@@ -27,17 +34,18 @@ class ProfessionalUserManager:
         # In-memory caches and state management
         self.user_cache = {}
         self.cache_timestamps = {}
+        self.initialized_users: Dict[int, float] = {}  # user_id -> last registration/activity write
         self.user_states: Dict[int, str] = {}
         self.user_temp_data: Dict[int, Dict[str, Any]] = defaultdict(dict)
         self.user_sessions: Dict[int, Dict[str, Any]] = {}
         
         # Rate limiting and security
-        self.user_requests: Dict[int, List[float]] = defaultdict(list)
+        self.user_requests: Dict[int, deque] = defaultdict(deque)
         self.blocked_users: Set[int] = set()
         self.suspicious_activity: Dict[int, int] = defaultdict(int)
         
         # Analytics tracking
-        self.user_events: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+        self.user_events: Dict[int, deque] = defaultdict(lambda: deque(maxlen=100))
         self.command_usage: Dict[str, int] = defaultdict(int)
         self.download_analytics: Dict[str, int] = defaultdict(int)
         
@@ -73,6 +81,11 @@ class ProfessionalUserManager:
                             language_code: str = 'en') -> bool:
         """Initialize comprehensive user profile"""
         try:
+            # Returning users seen within the cache TTL need no database work
+            last_initialized = self.initialized_users.get(user_id)
+            if last_initialized is not None and time.time() - last_initialized < self.cache_ttl:
+                return True
+            
             # Check if user exists
             user = await self.get_user_cached(user_id)
             if not user:
@@ -103,6 +116,7 @@ class ProfessionalUserManager:
                         'language_code': language_code
                     })
                     
+                    self.initialized_users[user_id] = time.time()
                     logger.info(f"New user initialized: {user_id} (@{username})")
                     return True
             else:
@@ -116,6 +130,7 @@ class ProfessionalUserManager:
                 if user_id not in self.user_sessions:
                     await self.start_user_session(user_id)
                 
+                self.initialized_users[user_id] = time.time()
                 return True
             
         except Exception as e:
@@ -169,16 +184,13 @@ class ProfessionalUserManager:
                 downloads_remaining = max(0, 15 - download_stats['downloads_this_hour'])
                 can_download = download_stats['can_download']
                 reset_time = download_stats.get('reset_time')
-                reset_time_str = reset_time.strftime('%H:%M:%S') if reset_time else 'Unknown'
+                reset_time_str = _format_timestamp(reset_time, '%H:%M:%S') if reset_time else 'Unknown'
             
             # Format premium expiry
             prime_expiry_str = None
             if prime_status.get('expiry_date'):
                 try:
-                    expiry_date = prime_status['expiry_date']
-                    if isinstance(expiry_date, str):
-                        expiry_date = datetime.fromisoformat(expiry_date.replace('Z', '+00:00'))
-                    prime_expiry_str = expiry_date.strftime('%Y-%m-%d %H:%M:%S')
+                    prime_expiry_str = _format_timestamp(prime_status['expiry_date'], '%Y-%m-%d %H:%M:%S')
                 except:
                     prime_expiry_str = str(prime_status['expiry_date'])
             
@@ -277,7 +289,7 @@ class ProfessionalUserManager:
             logger.error(f"Error updating usage for user {user_id}: {e}")
             return False
     
-    async def can_user_download(self, user_id: int) -> Dict[str, Any]:
+    async def can_user_download(self, user_id: int, status: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Enhanced download permission checking with detailed reasoning"""
         try:
             # Check if user is blocked
@@ -296,8 +308,9 @@ class ProfessionalUserManager:
                     'recommendation': 'Please wait before making another request'
                 }
             
-            # Get user status
-            status = await self.get_user_status(user_id)
+            # Get user status unless the caller already fetched it
+            if status is None:
+                status = await self.get_user_status(user_id)
             
             if status['is_prime']:
                 return {
@@ -342,12 +355,13 @@ class ProfessionalUserManager:
             current_time = time.time()
             user_requests = self.user_requests[user_id]
             
-            # Clean old requests
+            # Clean old requests; timestamps are appended in order, so expire from the left
             cutoff_time = current_time - self.rate_limit_window
-            self.user_requests[user_id] = [req_time for req_time in user_requests if req_time > cutoff_time]
+            while user_requests and user_requests[0] <= cutoff_time:
+                user_requests.popleft()
             
             # Check limit
-            if len(self.user_requests[user_id]) >= self.max_requests_per_window:
+            if len(user_requests) >= self.max_requests_per_window:
                 # Log suspicious activity
                 self.suspicious_activity[user_id] += 1
                 if self.suspicious_activity[user_id] > 5:
@@ -358,7 +372,7 @@ class ProfessionalUserManager:
                 return False
             
             # Add current request
-            self.user_requests[user_id].append(current_time)
+            user_requests.append(current_time)
             return True
         except Exception as e:
             logger.error(f"Rate limit check error for user {user_id}: {e}")
@@ -464,9 +478,7 @@ class ProfessionalUserManager:
             }
             
             # Store in memory (limited history)
-            self.user_events[user_id].append(event)
-            if len(self.user_events[user_id]) > 100:  # Keep last 100 events
-                self.user_events[user_id] = self.user_events[user_id][-100:]
+            self.user_events[user_id].append(event)  # deque keeps the last 100
             
             logger.debug(f"Tracked event {event_type} for user {user_id}")
             return True
@@ -538,7 +550,7 @@ class ProfessionalUserManager:
         try:
             engagement = self.user_engagement[user_id]
             user_status = await self.get_user_status(user_id)
-            recent_events = self.user_events[user_id][-10:]  # Last 10 events
+            recent_events = list(self.user_events[user_id])[-10:]  # Last 10 events
             
             return {
                 'user_id': user_id,
@@ -583,6 +595,20 @@ class ProfessionalUserManager:
                     self.user_cache.pop(user_id, None)
                     self.cache_timestamps.pop(user_id, None)
                 
+                expired_initialized = [
+                    user_id for user_id, timestamp in self.initialized_users.items()
+                    if current_time - timestamp > self.cache_ttl
+                ]
+                for user_id in expired_initialized:
+                    del self.initialized_users[user_id]
+                
+                idle_users = [
+                    user_id for user_id, requests in self.user_requests.items()
+                    if not requests or current_time - requests[-1] > self.rate_limit_window
+                ]
+                for user_id in idle_users:
+                    del self.user_requests[user_id]
+                
                 if expired_keys:
                     logger.debug(f"Cleaned up {len(expired_keys)} expired cache entries")
                     
@@ -632,10 +658,11 @@ class ProfessionalUserManager:
                 logger.error(f"Session cleanup error: {e}")
     
     # Legacy compatibility methods
-    async def get_downloads_remaining(self, user_id: int) -> int:
+    async def get_downloads_remaining(self, user_id: int, status: Optional[Dict[str, Any]] = None) -> int:
         """Get number of downloads remaining for user (legacy compatibility)"""
         try:
-            status = await self.get_user_status(user_id)
+            if status is None:
+                status = await self.get_user_status(user_id)
             if status['is_prime']:
                 return float('inf')
             return max(0, status['downloads_remaining'])
@@ -703,6 +730,16 @@ class ProfessionalUserManager:
             logger.error(f"Error clearing user data {user_id}: {e}")
             return False
     
+    async def clear_user_session(self, user_id: int) -> bool:
+        """Clear interaction state and temporary data together"""
+        try:
+            self.user_states.pop(user_id, None)
+            self.user_temp_data.pop(user_id, None)
+            return await self.db.clear_user_session(user_id)
+        except Exception as e:
+            logger.error(f"Error clearing user session {user_id}: {e}")
+            return False
+    
     async def grant_prime(self, user_id: int, days: int = None, admin_id: int = None) -> bool:
         """Grant premium status to user"""
         try: